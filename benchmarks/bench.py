@@ -0,0 +1,258 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+if True:
+    selfdir = os.path.dirname(os.path.abspath(__file__))
+    rootdir = os.path.join(selfdir, '..')
+    sys.path.insert(0, rootdir)
+import dbgctrl
+from dbgctrl.app import regdump
+
+
+# benchmarks of the gdb, lldb and remote protocol controllers against the
+# scripted stand-ins in this directory (fake-gdb, fake-lldb, fake-gdbserver),
+# so results depend neither on an installed debugger nor on a real target
+DEBUGGERS = {
+    'gdb': os.path.join(selfdir, 'fake-gdb'),
+    'lldb': os.path.join(selfdir, 'fake-lldb'),
+    'rsp': os.path.join(selfdir, 'fake-gdbserver'),
+}
+MEM_ADDR = 0x404000
+
+
+@contextlib.contextmanager
+def quiet():
+    # the controllers print on start up and exit
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def open_debugger(name, args, regs=None):
+    # a controller stopped at the start of main of the simulated target
+    os.environ['FAKEDBG_LATENCY'] = str(args.latency)
+    os.environ['FAKEDBG_REGS'] = str(regs or args.regs)
+    with quiet():
+        dbg = dbgctrl.controller(DEBUGGERS[name])
+        dbg.load(DEBUGGERS[name])
+        dbg.run_stop_at_start()
+        dbg.exec_command('b *0x401000')
+        dbg.exec_command('c')
+    return dbg
+
+
+def close_debugger(dbg):
+    with quiet():
+        dbg.quit()
+
+
+def measure(func, repeat):
+    # latency of every call, then the peak python allocation of one more call
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return samples, peak
+
+
+def bench_get_response(name, args):
+    # one small command: the round trip and framing cost
+    dbg = open_debugger(name, args, regs=24)
+    samples, peak = measure(lambda: dbg.exec_command(dbg.STATUS_COMMAND), args.repeat)
+    close_debugger(dbg)
+    return samples, peak, None
+
+
+def bench_parse_read_reg(name, args):
+    # parsing a reply of `--regs` registers, without the round trip
+    dbg = open_debugger(name, args)
+    layout = dbg.read_reg_layout()
+    if name == 'rsp':
+        # the `g` and `p` replies
+        dbg.read_reg()
+        response = dbg._request(dbg._reg_packets(layout))
+        parse = dbg._parse_regs
+    else:
+        response = dbg.exec_command(dbg._read_reg_command(layout))
+        parse = dbg._parse_read_reg
+    close_debugger(dbg)
+    samples, peak = measure(lambda: parse(response, layout), args.repeat)
+    return samples, peak, None
+
+
+def bench_read_reg(name, args):
+    dbg = open_debugger(name, args)
+    dbg.read_reg_layout()
+    samples, peak = measure(dbg.read_reg, args.repeat)
+    close_debugger(dbg)
+    return samples, peak, None
+
+
+def bench_read_mem(name, args):
+    # `--mem-size` bytes as 4-byte words through the text reply
+    dbg = open_debugger(name, args, regs=24)
+    count = args.mem_size // 4
+    samples, peak = measure(lambda: dbg.read_mem(MEM_ADDR, size=4, count=count),
+                            max(args.repeat // 10, 1))
+    close_debugger(dbg)
+    return samples, peak, None
+
+
+def bench_read_mem_bytes(name, args):
+    # `--mem-size` bytes through a dump file
+    dbg = open_debugger(name, args, regs=24)
+    samples, peak = measure(lambda: dbg.read_mem_bytes(MEM_ADDR, args.mem_size),
+                            max(args.repeat // 10, 1))
+    close_debugger(dbg)
+    return samples, peak, None
+
+
+def bench_snapshot(name, args):
+    # one step of the regdump loop: step, pc, registers and disassembly
+    dbg = open_debugger(name, args, regs=24)
+    dbg.prefill_disasm(0x401000)
+    samples, peak = measure(lambda: dbg.snapshot(step='ni'), args.steps)
+    close_debugger(dbg)
+    return samples, peak, len(samples)
+
+
+def bench_regdump(name, args):
+    # the whole application, from start up to the written trace; the range
+    # covers the loop of main, so --max ends it
+    os.environ['FAKEDBG_LATENCY'] = str(args.latency)
+    os.environ['FAKEDBG_REGS'] = '24'
+    with tempfile.TemporaryDirectory() as tmpdir:
+        argv = ['-d', DEBUGGERS[name], '-r', '0x401000,0x401400', '--max', str(args.steps),
+                '-o', os.path.join(tmpdir, 'trace.csv'), DEBUGGERS[name]]
+
+        def run():
+            with quiet():
+                regdump.regdump(regdump.arg_parse(argv))
+        samples, peak = measure(run, 1)
+    return samples, peak, args.steps
+
+
+BENCHMARKS = {
+    'get_response': bench_get_response,
+    'parse_read_reg': bench_parse_read_reg,
+    'read_reg': bench_read_reg,
+    'read_mem': bench_read_mem,
+    'read_mem_bytes': bench_read_mem_bytes,
+    'snapshot': bench_snapshot,
+    'regdump': bench_regdump,
+}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+def summarize(samples, peak, steps):
+    total = sum(samples)
+    return {
+        'calls': len(samples),
+        'total': total,
+        'mean': total / len(samples),
+        'p50': percentile(samples, 50),
+        'p99': percentile(samples, 99),
+        'steps_per_sec': steps / total if steps and total > 0 else None,
+        'peak_bytes': peak,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=rootdir,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_result(key, result, base=None):
+    rate = '{:10.1f}'.format(result['steps_per_sec']) if result['steps_per_sec'] else ' ' * 10
+    line = '{:<22} {:>6} {:>10.6f} {:>10.6f} {:>10.6f} {} {:>10.1f}'.format(
+        key, result['calls'], result['mean'], result['p50'], result['p99'], rate,
+        result['peak_bytes'] / 1024)
+    if base and key in base:
+        line += ' {:>7.2f}x'.format(result['mean'] / base[key]['mean'])
+    return line
+
+
+def arg_parse():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        '--debugger', '-d', nargs='+', default=list(DEBUGGERS), choices=list(DEBUGGERS),
+        help='controllers to benchmark')
+    argparser.add_argument(
+        '--bench', '-b', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS),
+        help='benchmarks to run')
+    argparser.add_argument(
+        '--repeat', '-n', type=int, default=200,
+        help='calls per benchmark (a tenth of it for memory reads)')
+    argparser.add_argument(
+        '--steps', type=int, default=2000,
+        help='steps of the snapshot and regdump benchmarks')
+    argparser.add_argument(
+        '--regs', type=int, default=2000,
+        help='registers of the target in the register benchmarks')
+    argparser.add_argument(
+        '--mem-size', type=int, default=1 << 20,
+        help='bytes per memory read')
+    argparser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='seconds the fake debugger waits before each reply')
+    argparser.add_argument(
+        '--json', '-o', metavar='PATH', default=None,
+        help='write the results to a json file')
+    argparser.add_argument(
+        '--compare', '-c', metavar='PATH', default=None,
+        help='show the mean latency relative to an earlier json file')
+    return argparser.parse_args()
+
+
+def main():
+    args = arg_parse()
+    base = None
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)['results']
+    print('{:<22} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}{}'.format(
+        'benchmark', 'calls', 'mean[s]', 'p50[s]', 'p99[s]', 'steps/s', 'peak[KiB]',
+        '    ratio' if base else ''))
+    results = {}
+    for name in args.debugger:
+        for bench in args.bench:
+            key = '{}.{}'.format(name, bench)
+            results[key] = summarize(*BENCHMARKS[bench](name, args))
+            print(format_result(key, results[key], base))
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('max rss: {} KiB'.format(maxrss))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'options': vars(args),
+                'max_rss_kib': maxrss,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
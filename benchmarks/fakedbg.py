@@ -0,0 +1,725 @@
+import json
+import os
+import re
+import sys
+import time
+import zlib
+
+
+# stand-in for gdb and lldb used by the benchmarks: fixed replies are replayed
+# from a recorded transcript, and a simulated target steps through a loop of
+# straight-line code so that pc, registers, disassembly and memory replies
+# look like the ones of the real debuggers.
+#
+# configured through the environment, since the controllers run `dbgpath`
+# without arguments:
+#   FAKEDBG_LATENCY     seconds to wait before each reply (default 0)
+#   FAKEDBG_REGS        number of registers of the target (default 24)
+#   FAKEDBG_LOOP        instructions in the loop of main (default 256)
+#   FAKEDBG_STEPS       instructions executed before the program exits (default 1000000)
+#   FAKEDBG_TRANSCRIPT  transcript file (default transcripts/<gdb|lldb>.txt)
+ENTRY = 0x400ff0
+START = 0x401000
+INSN_SIZE = 4
+# the store of every group of INSNS writes the step count to one of the
+# DATA_SLOTS 8-byte slots at DATA, for watchpoints
+DATA = 0x600000
+DATA_SLOTS = 16
+STORE = 3
+HW_WATCHPOINTS = 4
+# start, end, perms, name (None: the program)
+MAPPINGS = [
+    (0x400000, 0x401000, 'r--p', None),
+    (0x401000, 0x402000, 'r-xp', None),
+    (DATA, DATA + 0x1000, 'rw-p', None),
+    (0x602000, 0x623000, 'rw-p', '[heap]'),
+    (0x7ffffffde000, 0x7ffffffff000, 'rw-p', '[stack]'),
+]
+PID = 4242
+MASK64 = (1 << 64) - 1
+GPRS = ['rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rbp', 'rsp'] + \
+    ['r{}'.format(i) for i in range(8, 16)]
+INSNS = [
+    'mov    %rsp,%rbp',
+    'mov    -0x14(%rbp),%eax',
+    'add    $0x1,%eax',
+    'mov    %eax,-0x14(%rbp)',
+    'lea    0x0(,%rax,8),%rdx',
+    'cmp    $0x9,%eax',
+    'movslq %eax,%rcx',
+    'imul   %rcx,%rdx',
+]
+DIRNAME = os.path.dirname(os.path.abspath(__file__))
+
+
+def env_number(name, default, convert=int):
+    value = os.environ.get(name)
+    return convert(value) if value else default
+
+
+def memory_bytes(addr, length):
+    # deterministic contents: the low byte of every address
+    first = addr & 0xff
+    data = bytes(range(256)) * ((first + length) // 256 + 1)
+    return data[first:first + length]
+
+
+def read_transcript(path, prompt):
+    # a debugger session log: the text before the first prompt is the banner,
+    # then every `<prompt><command>` line is followed by its reply.
+    # replies are str.format templates, see Target.variables()
+    banner = []
+    replies = {}
+    lines = banner
+    with open(path) as f:
+        for line in f:
+            if line.startswith(prompt):
+                lines = replies.setdefault(line[len(prompt):].strip(), [])
+            else:
+                lines.append(line)
+    return ''.join(banner), {cmd: ''.join(lines) for cmd, lines in replies.items()}
+
+
+class Target():
+    def __init__(self, nregs, loop, steps):
+        self.nregs = nregs
+        self.loop = loop
+        self.steps = steps
+        self.names = (['rip'] + GPRS + ['eflags'] + ['v{}'.format(i) for i in range(nregs)])[:nregs]
+        self.elfpath = 'a.out'
+        self.pc = None
+        self.count = 0
+        self.breakpoints = []
+        # breakpoint index: hits to ignore
+        self.ignores = {}
+        self.data = bytearray(memory_bytes(DATA, DATA_SLOTS * 8))
+        # number: (addr, size)
+        self.watchpoints = {}
+        self.watch_count = 0
+        # (number, old, new) of the watchpoint hit by the last step
+        self.hit = None
+        # register index: value written by the debugger
+        self.written = {}
+        # checkpoint number: (pc, count, data, written)
+        self.checkpoints = {}
+        self.checkpoint_count = 0
+
+    @property
+    def running(self):
+        return self.pc is not None
+
+    @property
+    def end(self):
+        return START + self.loop * INSN_SIZE
+
+    def start(self):
+        self.pc = ENTRY
+        self.count = 0
+        self.written = {}
+        self.checkpoints = {}
+        self.checkpoint_count = 0
+
+    def kill(self):
+        self.pc = None
+
+    def step(self):
+        # False once the program has exited
+        self.count += 1
+        self.hit = None
+        if self.count >= self.steps:
+            self.pc = None
+            return False
+        self.execute()
+        if self.pc < START or self.pc + INSN_SIZE >= self.end:
+            self.pc = START
+        else:
+            self.pc += INSN_SIZE
+        return True
+
+    def step_count(self, count):
+        for _ in range(count):
+            if not self.step():
+                return False
+        return True
+
+    def resume(self):
+        # run to the next breakpoint or watchpoint hit; False once the program has exited
+        while self.step():
+            if self.hit is not None:
+                return True
+            if self.pc in self.breakpoints:
+                i = self.breakpoints.index(self.pc)
+                if self.ignores.get(i):
+                    self.ignores[i] -= 1
+                    continue
+                return True
+        return False
+
+    def add_breakpoint(self, arg, ignore=0):
+        addr = START if arg == 'main' else int(arg, 0)
+        self.breakpoints.append(addr)
+        if ignore:
+            self.ignores[len(self.breakpoints) - 1] = ignore
+        return addr
+
+    def delete_breakpoints(self):
+        self.breakpoints = []
+        self.ignores = {}
+
+    def add_watchpoint(self, number, addr, size):
+        self.watch_count += 1
+        self.watchpoints[number] = (addr, size)
+
+    def read(self, addr, length):
+        data = memory_bytes(addr, length)
+        start, end = max(addr, DATA), min(addr + length, DATA + len(self.data))
+        if start >= end:
+            return data
+        data = bytearray(data)
+        data[start - addr:end - addr] = self.data[start - DATA:end - DATA]
+        return bytes(data)
+
+    def value(self, addr, size):
+        return int.from_bytes(self.read(addr, size), 'little')
+
+    def write(self, addr, data):
+        # only the data slots are writable
+        if addr < DATA or addr + len(data) > DATA + len(self.data):
+            return False
+        self.data[addr - DATA:addr - DATA + len(data)] = data
+        return True
+
+    def write_reg(self, name, value):
+        if name not in self.names:
+            return False
+        i = self.names.index(name)
+        if i == 0:
+            self.pc = value
+        else:
+            self.written[i] = value & MASK64
+        return True
+
+    def checkpoint(self):
+        # the state a fork of the program would keep
+        self.checkpoint_count += 1
+        self.checkpoints[self.checkpoint_count] = (
+            self.pc, self.count, bytes(self.data), dict(self.written))
+        return self.checkpoint_count
+
+    def restart(self, number):
+        if number not in self.checkpoints:
+            return False
+        self.pc, self.count, data, written = self.checkpoints[number]
+        self.data = bytearray(data)
+        self.written = dict(written)
+        self.hit = None
+        return True
+
+    def execute(self):
+        # the store at pc writes the step count; a watchpoint on a changed value is hit
+        offset = (self.pc - START) // INSN_SIZE
+        if self.pc < START or offset % len(INSNS) != STORE:
+            return
+        addr = DATA + offset // len(INSNS) % DATA_SLOTS * 8
+        old = {number: self.value(*w) for number, w in self.watchpoints.items()}
+        self.data[addr - DATA:addr - DATA + 8] = self.count.to_bytes(8, 'little')
+        for number, w in self.watchpoints.items():
+            if self.hit is None and self.value(*w) != old[number]:
+                self.hit = (number, old[number], self.value(*w))
+
+    def insn(self, addr):
+        if addr < START:
+            return 'xor    %ebp,%ebp'
+        if addr + INSN_SIZE >= self.end:
+            return 'jmp    0x{:x} <main>'.format(START)
+        return INSNS[(addr - START) // INSN_SIZE % len(INSNS)]
+
+    def reg(self, i):
+        # most registers keep their value, a few change on every step
+        if i == 0:
+            return self.pc
+        if i in self.written:
+            return self.written[i]
+        if i % 4 == 1:
+            return (self.pc * i + self.count) & MASK64
+        return i
+
+    def regs(self, names=None):
+        index = {name: i for i, name in enumerate(self.names)}
+        if names:
+            names = [name for name in names if name in index]
+        else:
+            names = self.names
+        return [(name, self.reg(index[name])) for name in names]
+
+    def mappings(self):
+        return [(start, end, perms, name or os.path.abspath(self.elfpath))
+                for start, end, perms, name in MAPPINGS]
+
+    def page_hashes(self, addr, length, page_size):
+        return ' '.join('{:08x}'.format(zlib.crc32(self.read(addr + offset, min(
+            page_size, length - offset)))) for offset in range(0, length, page_size))
+
+    def variables(self, arg):
+        return {
+            'arg': arg, 'pid': PID, 'pc': self.pc or 0, 'offset': (self.pc or START) - START,
+            'elf': self.elfpath, 'start': START, 'end': self.end,
+        }
+
+
+class FakeDebugger():
+    PROMPT = None
+    NAME = None
+
+    def __init__(self, target, latency=0.0, transcript=None):
+        self.target = target
+        self.latency = latency
+        if transcript is None:
+            transcript = os.path.join(DIRNAME, 'transcripts', self.NAME + '.txt')
+        self.banner, self.replies = read_transcript(transcript, self.PROMPT)
+        self.handlers = [(re.compile(pattern), getattr(self, name))
+                         for pattern, name in self.HANDLERS]
+
+    def reply(self, cmd):
+        for pattern, handler in self.handlers:
+            m = pattern.match(cmd)
+            if m:
+                return handler(m)
+        return self.replay(cmd)
+
+    def replay(self, cmd):
+        word, _, arg = cmd.partition(' ')
+        template = self.replies.get(cmd)
+        if template is None:
+            template = self.replies.get(word, '')
+        return template.format(**self.target.variables(arg.strip()))
+
+    def load(self, m):
+        self.target.elfpath = m.group(1)
+        return self.replay(m.group(0))
+
+    def agent(self, m):
+        return ''
+
+    def page_hashes(self, m):
+        # the dbgctrl_pagehash command of the agent
+        opts = json.loads(m.group(1))
+        return ''.join('dbgctrl_pagehash: {}\n'.format(
+            self.target.page_hashes(addr, length, opts['page_size']))
+            for addr, length in opts['regions'])
+
+    def run(self):
+        stdin = sys.stdin.buffer
+        stdout = sys.stdout.buffer
+        banner = self.banner.format(**self.target.variables(''))
+        stdout.write(banner.encode() + self.PROMPT.encode())
+        stdout.flush()
+        for line in stdin:
+            cmd = line.decode().strip()
+            if cmd in ('q', 'quit'):
+                break
+            response = self.reply(cmd)
+            if self.latency:
+                time.sleep(self.latency)
+            stdout.write(response.encode() + self.PROMPT.encode())
+            stdout.flush()
+
+
+class FakeGDB(FakeDebugger):
+    PROMPT = '(gdb) '
+    NAME = 'gdb'
+    WATCH_TYPES = {1: 'unsigned char', 2: 'unsigned short', 4: 'unsigned int',
+                   8: 'unsigned long long'}
+    HANDLERS = [
+        (r'file (.+)$', 'load'),
+        (r'starti$', 'start'),
+        (r'(si|ni|s|n|stepi|nexti|step|next|finish)(?: (\d+))?$', 'step'),
+        (r'(c|continue)$', 'resume'),
+        (r'kill$', 'kill'),
+        (r'(b|break|tbreak|hbreak) +\*?(\S+)$', 'breakpoint'),
+        (r'(d|delete)$', 'delete'),
+        (r'delete checkpoint (\d+)$', 'delete_checkpoint'),
+        (r'checkpoint$', 'checkpoint'),
+        (r'restart (\d+)$', 'restart'),
+        (r'set var \$(\w+) = (\S+)$', 'write_reg'),
+        (r'set var \*\((.+) \*\)(\S+) = (\S+)$', 'write_mem'),
+        (r'(d|delete) (\d+)$', 'unwatch'),
+        (r'watch -l \*\((.+) \*\)(\S+)$', 'watch'),
+        (r'ignore \$bpnum (\d+)$', 'ignore'),
+        (r'info program$', 'status'),
+        (r'info (all-)?registers *(.*)$', 'registers'),
+        (r'output/x \$pc$', 'pc_value'),
+        (r'x/(\d*)x([bhwg]) +(\S+)$', 'memory'),
+        (r'dump binary memory (\S+) (\S+) (\S+)$', 'dump'),
+        (r'disassemble +([^,]+)(?:,(.+))?$', 'disassemble'),
+        (r'info proc mappings$', 'mappings'),
+        (r'source (\S+)$', 'agent'),
+        (r'dbgctrl_pagehash (.+)$', 'page_hashes'),
+    ]
+
+    def address(self, expr):
+        pc = self.target.pc or 0
+        return sum(pc if term.strip() == '$pc' else int(term, 0) for term in expr.split('+'))
+
+    def location(self, addr):
+        if addr < START:
+            return '_start'
+        return 'main+{}'.format(addr - START) if addr > START else 'main'
+
+    def exited(self):
+        return '[Inferior 1 (process {}) exited normally]\n'.format(PID)
+
+    def start(self, m):
+        self.target.start()
+        return 'Program stopped.\n0x{:016x} in _start ()\n'.format(self.target.pc)
+
+    def step(self, m):
+        if not self.target.running:
+            return 'The program is not being run.\n'
+        if not self.target.step_count(int(m.group(2) or 1)):
+            return self.exited()
+        return '0x{:016x} in main ()\n'.format(self.target.pc)
+
+    def resume(self, m):
+        target = self.target
+        if not target.running:
+            return 'The program is not being run.\n'
+        if len(target.watchpoints) > HW_WATCHPOINTS:
+            return ('Could not insert hardware watchpoint {}.\n'
+                    'Could not insert hardware breakpoints:\n'
+                    'You may have requested too many hardware breakpoints/watchpoints.\n\n'
+                    'Command aborted.\n').format(max(target.watchpoints))
+        if not target.resume():
+            return self.exited()
+        if target.hit is not None:
+            number, old, new = target.hit
+            addr, size = target.watchpoints[number]
+            return ('\nHardware watchpoint {}: -location *({} *)0x{:x}\n\n'
+                    'Old value = {}\nNew value = {}\n0x{:016x} in main ()\n').format(
+                        number, self.WATCH_TYPES[size], addr, old, new, target.pc)
+        number = target.breakpoints.index(target.pc) + 1
+        return '\nBreakpoint {}, 0x{:016x} in main ()\n'.format(number, target.pc)
+
+    def kill(self, m):
+        self.target.kill()
+        return '[Inferior 1 (process {}) killed]\n'.format(PID)
+
+    def breakpoint(self, m):
+        addr = self.target.add_breakpoint(m.group(2))
+        return 'Breakpoint {} at 0x{:x}\n'.format(len(self.target.breakpoints), addr)
+
+    def delete(self, m):
+        self.target.delete_breakpoints()
+        self.target.watchpoints = {}
+        return ''
+
+    def watch(self, m):
+        target = self.target
+        size = {v: k for k, v in self.WATCH_TYPES.items()}[m.group(1)]
+        addr = int(m.group(2), 0)
+        number = len(target.breakpoints) + target.watch_count + 1
+        target.add_watchpoint(number, addr, size)
+        return 'Hardware watchpoint {}: -location *({} *)0x{:x}\n'.format(
+            number, m.group(1), addr)
+
+    def unwatch(self, m):
+        if self.target.watchpoints.pop(int(m.group(2)), None) is None:
+            return 'No breakpoint number {}.\n'.format(m.group(2))
+        return ''
+
+    def ignore(self, m):
+        number = len(self.target.breakpoints)
+        self.target.ignores[number - 1] = int(m.group(1))
+        return 'Will ignore next {} crossings of breakpoint {}.\n'.format(m.group(1), number)
+
+    def checkpoint(self, m):
+        if not self.target.running:
+            return 'The program is not being run.\n'
+        number = self.target.checkpoint()
+        return 'checkpoint {}: fork returned pid {}.\n'.format(number, PID + number)
+
+    def restart(self, m):
+        number = int(m.group(1))
+        if not self.target.restart(number):
+            return 'Not found: checkpoint id {}\n'.format(number)
+        return 'Switching to process {}\n#0  0x{:016x} in main ()\n'.format(
+            PID + number, self.target.pc)
+
+    def delete_checkpoint(self, m):
+        number = int(m.group(1))
+        if self.target.checkpoints.pop(number, None) is None and number != 0:
+            return 'No such checkpoint id, {}\n'.format(number)
+        return 'Killed process {}\n'.format(PID + number)
+
+    def write_reg(self, m):
+        if not self.target.running:
+            return 'No registers.\n'
+        if not self.target.write_reg(m.group(1), int(m.group(2), 0) & MASK64):
+            return 'Left operand of assignment is not an lvalue.\n'
+        return ''
+
+    def write_mem(self, m):
+        size = {v: k for k, v in self.WATCH_TYPES.items()}[m.group(1)]
+        addr = int(m.group(2), 0)
+        value = int(m.group(3), 0) & ((1 << size * 8) - 1)
+        if not self.target.write(addr, value.to_bytes(size, 'little')):
+            return 'Cannot access memory at address 0x{:x}\n'.format(addr)
+        return ''
+
+    def status(self, m):
+        if not self.target.running:
+            return 'The program being debugged is not being run.\n'
+        if self.target.hit is not None:
+            reason = 'It stopped at breakpoint {}.'.format(self.target.hit[0])
+        else:
+            reason = 'It stopped after being stepped.'
+        return ('\tUsing the running image of child process {}.\n'
+                'Program stopped at 0x{:x}.\n'
+                '{}\n').format(PID, self.target.pc, reason)
+
+    def registers(self, m):
+        if not self.target.running:
+            return 'The program has no registers now.\n'
+        return ''.join('{:<15}0x{:<18x}{}\n'.format(name, value, value)
+                       for name, value in self.target.regs(m.group(2).split()))
+
+    def pc_value(self, m):
+        if not self.target.running:
+            return 'No registers.\n'
+        return '0x{:x}'.format(self.target.pc)
+
+    def memory(self, m):
+        count = int(m.group(1) or 1)
+        size = {'b': 1, 'h': 2, 'w': 4, 'g': 8}[m.group(2)]
+        addr = self.address(m.group(3))
+        data = self.target.read(addr, count * size)
+        per_line = 8 if size <= 2 else 16 // size
+        fmt = '0x{:0' + str(size * 2) + 'x}'
+        lines = []
+        for offset in range(0, count * size, per_line * size):
+            words = [fmt.format(int.from_bytes(data[i:i + size], 'little'))
+                     for i in range(offset, min(offset + per_line * size, count * size), size)]
+            lines.append('0x{:x}:\t{}\n'.format(addr + offset, '\t'.join(words)))
+        return ''.join(lines)
+
+    def mappings(self, m):
+        if not self.target.running:
+            return 'No current process: you must name one.\n'
+        lines = ['process {}\nMapped address spaces:\n\n'.format(PID),
+                 '{:>18} {:>18} {:>10} {:>10}  {:<5}  {}\n'.format(
+                     'Start Addr', 'End Addr', 'Size', 'Offset', 'Perms', 'objfile')]
+        for start, end, perms, name in self.target.mappings():
+            lines.append('{:>18} {:>18} {:>10} {:>10}  {:<5}  {}\n'.format(
+                hex(start), hex(end), hex(end - start), '0x0', perms, name))
+        return ''.join(lines)
+
+    def dump(self, m):
+        start, end = self.address(m.group(2)), self.address(m.group(3))
+        with open(m.group(1), 'wb') as f:
+            f.write(self.target.read(start, end - start))
+        return ''
+
+    def disassemble(self, m):
+        target = self.target
+        start = self.address(m.group(1))
+        lines = []
+        if m.group(2) is None:
+            lines.append('Dump of assembler code for function main:\n')
+            addrs = range(START, target.end, INSN_SIZE)
+            label = '<+{}>'.format
+        else:
+            lines.append('Dump of assembler code from 0x{:x} to 0x{:x}:\n'.format(
+                start, self.address(m.group(2))))
+            addrs = range(start, self.address(m.group(2)), INSN_SIZE)
+            label = lambda offset: '<{}>'.format(self.location(START + offset))  # noqa: E731
+        for addr in addrs:
+            lines.append('{} 0x{:016x} {}:\t{}\n'.format(
+                '=>' if addr == target.pc else '  ', addr, label(addr - START), target.insn(addr)))
+        lines.append('End of assembler dump.\n')
+        return ''.join(lines)
+
+
+class FakeLLDB(FakeDebugger):
+    PROMPT = '(lldb) '
+    NAME = 'lldb'
+    HANDLERS = [
+        (r'file (.+)$', 'load'),
+        (r'(pr la|process launch)', 'start'),
+        (r'(si|ni|s|n|finish|thread step-\S+)(?: -c (\d+))?$', 'step'),
+        (r'(c|continue|process continue)$', 'resume'),
+        (r'process kill$', 'kill'),
+        (r'(b|breakpoint set -a) +\*?(\S+)(?: -i (\d+))?$', 'breakpoint'),
+        (r'(br|breakpoint) delete$', 'delete'),
+        (r'watchpoint set expression -w write -s (\d+) -- (\S+)$', 'watch'),
+        (r'watchpoint delete (\d+)$', 'unwatch'),
+        (r'process status$', 'status'),
+        (r'(reg|register) read -a$', 'layout'),
+        (r'(reg|register) read *(.*)$', 'registers'),
+        (r'(mem|memory) read -s(\d+) -fx -c(\d+) (\S+)$', 'memory'),
+        (r'memory read --force --binary --outfile (\S+) (\S+) (\S+)$', 'dump'),
+        (r'dis -pc -c 1$', 'disassemble_pc'),
+        (r'dis -a (\S+)$', 'disassemble_function'),
+        (r'dis -s (\S+) -e (\S+)$', 'disassemble'),
+        (r'memory region --all$', 'mappings'),
+        (r'command script import (\S+)$', 'agent'),
+        (r'dbgctrl_pagehash (.+)$', 'page_hashes'),
+    ]
+
+    def frame(self, reason):
+        pc = self.target.pc
+        function, base = ('_start', ENTRY) if pc < START else ('main', START)
+        return ('Process {pid} stopped\n'
+                '* thread #1, name = \'a.out\', stop reason = {reason}\n'
+                '    frame #0: 0x{pc:016x} a.out`{function} + {offset}\n'
+                'a.out`{function}:\n'
+                '->  0x{pc:x} <+{offset}>: {insn}\n').format(
+                    pid=PID, reason=reason, pc=pc, function=function, offset=pc - base,
+                    insn=self.target.insn(pc))
+
+    def exited(self, status=0):
+        return 'Process {} exited with status = {} (0x{:08x})\n'.format(PID, status, status)
+
+    def invalid(self):
+        return 'error: invalid process\n'
+
+    def start(self, m):
+        self.target.start()
+        return 'Process {} launched: \'{}\' (x86_64)\n{}'.format(
+            PID, self.target.elfpath, self.frame('signal SIGSTOP'))
+
+    def step(self, m):
+        if not self.target.running:
+            return self.invalid()
+        if not self.target.step_count(int(m.group(2) or 1)):
+            return self.exited()
+        return self.frame('instruction step into')
+
+    def resume(self, m):
+        target = self.target
+        if not target.running:
+            return self.invalid()
+        if not target.resume():
+            return 'Process {} resuming\n{}'.format(PID, self.exited())
+        if target.hit is not None:
+            number, old, new = target.hit
+            return ('Process {} resuming\n{}\n'
+                    'Watchpoint {} hit:\nold value: {}\nnew value: {}\n').format(
+                        PID, self.frame('watchpoint {}'.format(number)), number, old, new)
+        number = target.breakpoints.index(target.pc) + 1
+        return 'Process {} resuming\n{}'.format(PID, self.frame('breakpoint {}.1'.format(number)))
+
+    def kill(self, m):
+        if not self.target.running:
+            return self.invalid()
+        self.target.kill()
+        return self.exited(9)
+
+    def breakpoint(self, m):
+        addr = self.target.add_breakpoint(m.group(2), int(m.group(3) or 0))
+        return 'Breakpoint {}: where = a.out`main + {}, address = 0x{:016x}\n'.format(
+            len(self.target.breakpoints), addr - START, addr)
+
+    def delete(self, m):
+        n = len(self.target.breakpoints)
+        self.target.delete_breakpoints()
+        return 'All breakpoints removed. ({} breakpoints)\n'.format(n)
+
+    def status(self, m):
+        if not self.target.running:
+            return self.invalid()
+        if self.target.hit is not None:
+            return self.frame('watchpoint {}'.format(self.target.hit[0]))
+        return self.frame('instruction step into')
+
+    def watch(self, m):
+        target = self.target
+        size, addr = int(m.group(1)), int(m.group(2), 0)
+        if len(target.watchpoints) >= HW_WATCHPOINTS:
+            return ('error: Watchpoint creation failed (addr=0x{:x}, size={}).\n'
+                    'error: sending gdb watchpoint packet failed\n').format(addr, size)
+        number = target.watch_count + 1
+        target.add_watchpoint(number, addr, size)
+        return ('Watchpoint created: Watchpoint {}: addr = 0x{:x} size = {} state = enabled '
+                'type = w\n    new value: {}\n').format(
+                    number, addr, size, target.value(addr, size))
+
+    def unwatch(self, m):
+        if self.target.watchpoints.pop(int(m.group(1)), None) is None:
+            return 'error: \'{}\' is not a currently valid watchpoint ID.\n'.format(m.group(1))
+        return '1 watchpoints deleted.\n'
+
+    def layout(self, m):
+        if not self.target.running:
+            return self.invalid()
+        lines = ['General Purpose Registers:\n']
+        for i, (name, value) in enumerate(self.target.regs()):
+            if i == len(GPRS) + 2:
+                lines.append('\nVector Registers:\n')
+            lines.append('{:>11} = 0x{:016x}\n'.format(name, value))
+        return ''.join(lines) + '\n'
+
+    def registers(self, m):
+        if not self.target.running:
+            return self.invalid()
+        names = ['rip' if name == 'pc' else name for name in m.group(2).split()]
+        return ''.join('{:>8} = 0x{:016x}\n'.format(name, value)
+                       for name, value in self.target.regs(names))
+
+    def memory(self, m):
+        if not self.target.running:
+            return self.invalid()
+        size, count, addr = int(m.group(2)), int(m.group(3)), int(m.group(4), 0)
+        data = self.target.read(addr, count * size)
+        fmt = '0x{:0' + str(size * 2) + 'x}'
+        lines = []
+        for offset in range(0, count * size, 16):
+            words = [fmt.format(int.from_bytes(data[i:i + size], 'little'))
+                     for i in range(offset, min(offset + 16, count * size), size)]
+            lines.append('0x{:x}: {}\n'.format(addr + offset, ' '.join(words)))
+        return ''.join(lines)
+
+    def mappings(self, m):
+        if not self.target.running:
+            return self.invalid()
+        return ''.join('[0x{:016x}-0x{:016x}) {} {}\n'.format(start, end, perms[:3], name)
+                       for start, end, perms, name in self.target.mappings())
+
+    def dump(self, m):
+        start, end = int(m.group(2), 0), int(m.group(3), 0)
+        with open(m.group(1), 'wb') as f:
+            f.write(self.target.read(start, end - start))
+        return '{} bytes written to \'{}\'\n'.format(end - start, m.group(1))
+
+    def disasm_lines(self, addrs):
+        target = self.target
+        lines = ['a.out`main:\n']
+        for addr in addrs:
+            lines.append('{} 0x{:x} <+{}>: {}\n'.format(
+                '->' if addr == target.pc else '  ', addr, addr - START, target.insn(addr)))
+        return ''.join(lines)
+
+    def disassemble_pc(self, m):
+        if not self.target.running:
+            return self.invalid()
+        return self.disasm_lines([self.target.pc])
+
+    def disassemble_function(self, m):
+        return self.disasm_lines(range(START, self.target.end, INSN_SIZE))
+
+    def disassemble(self, m):
+        return self.disasm_lines(range(int(m.group(1), 0), int(m.group(2), 0), INSN_SIZE))
+
+
+def main(name):
+    target = Target(
+        env_number('FAKEDBG_REGS', 24),
+        env_number('FAKEDBG_LOOP', 256),
+        env_number('FAKEDBG_STEPS', 1000000))
+    cls = FakeGDB if name == 'gdb' else FakeLLDB
+    debugger = cls(target, latency=env_number('FAKEDBG_LATENCY', 0.0, float),
+                   transcript=os.environ.get('FAKEDBG_TRANSCRIPT'))
+    debugger.run()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'gdb')
@@ -0,0 +1,232 @@
+import os
+import re
+import sys
+import time
+import zlib
+
+import fakedbg
+
+
+# stand-in for gdbserver: the gdb remote serial protocol on stdin and stdout
+# (`gdbserver --once - a.out`), backed by the simulated target of fakedbg.
+# registers after eflags are only sent with `p`, as gdbserver does for the
+# vector registers. FAKEDBG_LATENCY delays every write, not every reply, so
+# pipelined packets share one delay
+PACKET_SIZE = 0x4000
+THREAD = 1
+# AT_ENTRY, AT_NULL
+AUXV = [(9, fakedbg.ENTRY), (0, 0)]
+TARGET_XML = '''<?xml version="1.0"?>
+<!DOCTYPE target SYSTEM "gdb-target.dtd">
+<target version="1.0">
+  <architecture>i386:x86-64</architecture>
+  <xi:include href="core.xml"/>
+  <xi:include href="vector.xml"/>
+</target>
+'''
+pattern_packet = re.compile(rb'\$([^#]*)#[0-9A-Fa-f]{2}')
+
+
+def checksum(data):
+    return sum(data) & 0xff
+
+
+def escape(data):
+    # the binary reply of `x`
+    return re.sub(rb'[#$}*]', lambda m: bytes([0x7d, m.group(0)[0] ^ 0x20]), data)
+
+
+class FakeStub():
+    def __init__(self, target, latency=0.0):
+        self.target = target
+        self.latency = latency
+        self.ack = True
+        self.core = [name for name in target.names
+                     if name in ['rip', 'eflags'] + fakedbg.GPRS]
+        self.handlers = [
+            (rb'qSupported', self.supported),
+            (rb'QStartNoAckMode$', self.no_ack),
+            (rb'\?$', self.status),
+            (rb'vCont\?$', lambda m: b'vCont;c;C;s;S'),
+            (rb'H[gc]', lambda m: b'OK'),
+            (rb'qXfer:features:read:([\w.]+):([0-9a-f]+),([0-9a-f]+)$', self.features),
+            (rb'qXfer:auxv:read::([0-9a-f]+),([0-9a-f]+)$', self.auxv),
+            (rb'g$', self.registers),
+            (rb'p([0-9a-f]+)$', self.register),
+            (rb'P([0-9a-f]+)=([0-9a-f]+)$', self.write_register),
+            (rb'm([0-9a-f]+),([0-9a-f]+)$', self.memory),
+            (rb'x([0-9a-f]+),([0-9a-f]+)$', self.binary_memory),
+            (rb'M([0-9a-f]+),([0-9a-f]+):([0-9a-f]*)$', self.write_memory),
+            (rb'(?:vCont;s(?::\w+)?|s)$', self.step),
+            (rb'(?:vCont;c(?::\w+)?|c)$', self.resume),
+            (rb'([Zz])0,([0-9a-f]+),\d+$', self.breakpoint),
+            (rb'([Zz])2,([0-9a-f]+),([0-9a-f]+)$', self.watchpoint),
+            (rb'qCRC:([0-9a-f]+),([0-9a-f]+)$', self.crc),
+        ]
+        self.handlers = [(re.compile(pattern), handler) for pattern, handler in self.handlers]
+
+    def reply(self, packet):
+        for pattern, handler in self.handlers:
+            m = pattern.match(packet)
+            if m:
+                return handler(m)
+        return b''
+
+    def supported(self, m):
+        return ('PacketSize={:x};QStartNoAckMode+;qXfer:features:read+;'
+                'qXfer:auxv:read+;binary-upload+;swbreak+').format(PACKET_SIZE).encode()
+
+    def no_ack(self, m):
+        self.ack = False
+        return b'OK'
+
+    def stop_reply(self):
+        target = self.target
+        if not target.running:
+            return b'W00'
+        if target.hit is not None:
+            addr = target.watchpoints[target.hit[0]][0]
+            return 'T05watch:{:x};thread:{:x};'.format(addr, THREAD).encode()
+        return 'T05thread:{:x};'.format(THREAD).encode()
+
+    def status(self, m):
+        return self.stop_reply()
+
+    def features(self, m):
+        annex = m.group(1).decode()
+        if annex == 'target.xml':
+            xml = TARGET_XML
+        else:
+            names = self.core if annex == 'core.xml' else \
+                [name for name in self.target.names if name not in self.core]
+            feature = 'org.gnu.gdb.i386.core' if annex == 'core.xml' else 'org.gnu.gdb.i386.avx'
+            regs = ''.join('  <reg name="{}" bitsize="64" regnum="{}"/>\n'.format(
+                name, self.target.names.index(name)) for name in names)
+            xml = '<feature name="{}">\n{}</feature>\n'.format(feature, regs)
+        return self.xfer(xml.encode(), m.group(2), m.group(3))
+
+    def auxv(self, m):
+        data = b''.join(key.to_bytes(8, 'little') + value.to_bytes(8, 'little')
+                        for key, value in AUXV)
+        return self.xfer(data, m.group(1), m.group(2))
+
+    def xfer(self, data, offset, length):
+        offset, length = int(offset, 16), int(length, 16)
+        chunk = data[offset:offset + length]
+        return (b'l' if offset + length >= len(data) else b'm') + escape(chunk)
+
+    def registers(self, m):
+        if not self.target.running:
+            return b'E01'
+        values = dict(self.target.regs(self.core))
+        return b''.join(values[name].to_bytes(8, 'little') for name in self.core).hex().encode()
+
+    def register(self, m):
+        i = int(m.group(1), 16)
+        if not self.target.running or i >= len(self.target.names):
+            return b'E01'
+        return self.target.reg(i).to_bytes(8, 'little').hex().encode()
+
+    def write_register(self, m):
+        i = int(m.group(1), 16)
+        if not self.target.running or i >= len(self.target.names):
+            return b'E01'
+        self.target.write_reg(self.target.names[i], int.from_bytes(
+            bytes.fromhex(m.group(2).decode()), 'little'))
+        return b'OK'
+
+    def memory(self, m):
+        if not self.target.running:
+            return b'E01'
+        return self.target.read(int(m.group(1), 16), int(m.group(2), 16)).hex().encode()
+
+    def write_memory(self, m):
+        if not self.target.running:
+            return b'E01'
+        ok = self.target.write(int(m.group(1), 16), bytes.fromhex(m.group(3).decode()))
+        return b'OK' if ok else b'E14'
+
+    def binary_memory(self, m):
+        if not self.target.running:
+            return b'E01'
+        return b'b' + escape(self.target.read(int(m.group(1), 16), int(m.group(2), 16)))
+
+    def step(self, m):
+        if self.target.running:
+            self.target.step()
+        return self.stop_reply()
+
+    def resume(self, m):
+        if self.target.running:
+            self.target.resume()
+        return self.stop_reply()
+
+    def breakpoint(self, m):
+        target = self.target
+        addr = int(m.group(2), 16)
+        if m.group(1) == b'Z':
+            if addr not in target.breakpoints:
+                target.breakpoints.append(addr)
+        elif addr in target.breakpoints:
+            target.breakpoints.remove(addr)
+        return b'OK'
+
+    def watchpoint(self, m):
+        target = self.target
+        watch = (int(m.group(2), 16), int(m.group(3), 16))
+        if m.group(1) == b'Z':
+            if len(target.watchpoints) >= fakedbg.HW_WATCHPOINTS:
+                return b'E01'
+            target.add_watchpoint(target.watch_count + 1, *watch)
+            return b'OK'
+        for number, w in list(target.watchpoints.items()):
+            if w == watch:
+                del target.watchpoints[number]
+        return b'OK'
+
+    def crc(self, m):
+        if not self.target.running:
+            return b'E01'
+        data = self.target.read(int(m.group(1), 16), int(m.group(2), 16))
+        return 'C{:08x}'.format(zlib.crc32(data)).encode()
+
+    def run(self):
+        rfd, wfd = sys.stdin.fileno(), sys.stdout.fileno()
+        buf = b''
+        self.target.start()
+        while True:
+            data = os.read(rfd, 1 << 16)
+            if not data:
+                break
+            buf += data
+            out = []
+            pos = 0
+            for m in pattern_packet.finditer(buf):
+                pos = m.end()
+                packet = m.group(1)
+                if packet == b'k':
+                    self.target.kill()
+                    return
+                if self.ack:
+                    out.append(b'+')
+                reply = self.reply(packet)
+                out.append(b'$%s#%02x' % (reply, checksum(reply)))
+            buf = buf[pos:]
+            if out:
+                if self.latency:
+                    time.sleep(self.latency)
+                os.write(wfd, b''.join(out))
+
+
+def main():
+    target = fakedbg.Target(
+        fakedbg.env_number('FAKEDBG_REGS', 24),
+        fakedbg.env_number('FAKEDBG_LOOP', 256),
+        fakedbg.env_number('FAKEDBG_STEPS', 1000000))
+    if len(sys.argv) > 1:
+        target.elfpath = sys.argv[-1]
+    FakeStub(target, latency=fakedbg.env_number('FAKEDBG_LATENCY', 0.0, float)).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,52 @@ __version__ = '0.1.0'
 
 import os
 
+from dbgctrl.aio import AsyncGDBController, AsyncLLDBController
+from dbgctrl.core import CoreController, map_cores  # noqa: F401
 from dbgctrl.gdb import GDBController
+from dbgctrl.gdbmi import GDBMIController
 from dbgctrl.lldb import LLDBController
+from dbgctrl.pool import SessionPool  # noqa: F401
+from dbgctrl.ptrace import PtraceController
+from dbgctrl.rsp import RSPController
 
 
-def controller(path):
+def controller(path, backend=None, **kwargs):
+    if backend == 'ptrace':
+        # no debugger: the program is traced by this process
+        return PtraceController(path, **kwargs)
+    if backend == 'rsp' and not os.path.exists(path) and ':' in path:
+        # host:port of a running gdbserver, lldb-server or qemu stub
+        return RSPController(address=path, **kwargs)
+    if not os.path.exists(path):
+        raise IOError(f'debugger not exists: {path}')
+
+    if backend == 'core':
+        # path is a core file; load() the executable for the pages it lacks
+        return CoreController(path, **kwargs)
+    elif backend == 'mi':
+        return GDBMIController(path, **kwargs)
+    elif backend == 'rsp':
+        return RSPController(path, **kwargs)
+    elif backend is not None:
+        raise Exception(f'Unknown backend: {backend}')
+    elif 'gdbserver' in path or 'lldb-server' in path:
+        return RSPController(path, **kwargs)
+    elif 'gdb' in path:
+        return GDBController(path, **kwargs)
+    elif 'lldb' in path:
+        return LLDBController(path, **kwargs)
+    else:
+        raise Exception(f'Unknown debugger: {path}')
+
+
+async def async_controller(path):
     if not os.path.exists(path):
         raise IOError(f'debugger not exists: {path}')
 
     if 'gdb' in path:
-        return GDBController(path)
+        return await AsyncGDBController.create(path)
     elif 'lldb' in path:
-        return LLDBController(path)
+        return await AsyncLLDBController.create(path)
     else:
         raise Exception(f'Unknown debugger: {path}')
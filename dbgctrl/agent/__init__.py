@@ -0,0 +1,54 @@
+import os
+import struct
+from collections import namedtuple
+
+
+# trace records written by the in-debugger agents (gdbagent.py, lldbagent.py):
+#   b'S' <H length> <utf-8>              disassembly string, indexed in order
+#   b'R' <Q pc> <Q reg>*n <i string index or -1>
+TraceRecord = namedtuple('TraceRecord', ['pc', 'regs', 'disasm'])
+
+GDB_AGENT = os.path.join(os.path.dirname(__file__), 'gdbagent.py')
+LLDB_AGENT = os.path.join(os.path.dirname(__file__), 'lldbagent.py')
+TRACE_COMMAND = 'dbgctrl_trace'
+# one line of crc32 per region, '-' for an unreadable page
+PAGEHASH_COMMAND = 'dbgctrl_pagehash'
+CHUNK_SIZE = 1 << 20
+
+
+def read_trace(path, nregs, chunk_size=CHUNK_SIZE):
+    record = struct.Struct(f'<Q{nregs}Qi')
+    length = struct.Struct('<H')
+    strings: list = []
+    buf = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buf += chunk
+            i = 0
+            while i < len(buf):
+                kind = buf[i:i + 1]
+                if kind == b'R':
+                    if i + 1 + record.size > len(buf):
+                        break
+                    values = record.unpack_from(buf, i + 1)
+                    i += 1 + record.size
+                    index = values[-1]
+                    dis = strings[index] if index >= 0 else None
+                    yield TraceRecord(values[0], values[1:-1], dis)
+                elif kind == b'S':
+                    if i + 1 + length.size > len(buf):
+                        break
+                    n, = length.unpack_from(buf, i + 1)
+                    if i + 1 + length.size + n > len(buf):
+                        break
+                    i += 1 + length.size
+                    strings.append(buf[i:i + n].decode())
+                    i += n
+                else:
+                    raise ValueError('broken trace record at {}'.format(i))
+            buf = buf[i:]
+    if buf:
+        raise ValueError('truncated trace: {}'.format(path))
@@ -0,0 +1,116 @@
+# loaded into gdb with `source`; runs in gdb's embedded python.
+# the record format must match dbgctrl.agent.read_trace.
+import json
+import re
+import struct
+import zlib
+
+import gdb
+
+
+MASK64 = (1 << 64) - 1
+BUFFER_SIZE = 1 << 20
+
+# the disassembly as the step engine reads it (GDBParser.pattern_disasm):
+# '<main+4>:\tmov    %rsp,%rbp'
+pattern_disasm = re.compile(r'=\> +(?:[0-9A-Fa-fx]+)(?:\s)+(.+)')
+
+
+class DbgctrlTrace(gdb.Command):
+    def __init__(self):
+        super().__init__('dbgctrl_trace', gdb.COMMAND_USER)
+
+    def invoke(self, arg, from_tty):
+        opts = json.loads(arg)
+        count = trace(**opts)
+        gdb.write('dbgctrl_trace: {} records\n'.format(count))
+
+
+class DbgctrlPageHash(gdb.Command):
+    def __init__(self):
+        super().__init__('dbgctrl_pagehash', gdb.COMMAND_USER)
+
+    def invoke(self, arg, from_tty):
+        opts = json.loads(arg)
+        inferior = gdb.selected_inferior()
+        for addr, length in opts['regions']:
+            hashes = page_hashes(inferior.read_memory, addr, length, opts['page_size'])
+            gdb.write('dbgctrl_pagehash: {}\n'.format(' '.join(hashes)))
+
+
+def page_hashes(read, addr, length, page_size):
+    try:
+        data = read(addr, length)
+    except gdb.error:
+        data = None
+    hashes = []
+    for offset in range(0, length, page_size):
+        size = min(page_size, length - offset)
+        if data is not None:
+            page = data[offset:offset + size]
+        else:
+            # part of the region is unreadable: page by page
+            try:
+                page = read(addr + offset, size)
+            except gdb.error:
+                hashes.append('-')
+                continue
+        hashes.append('{:08x}'.format(zlib.crc32(page)))
+    return hashes
+
+
+def read_register(frame, name):
+    try:
+        return int(frame.read_register(name)) & MASK64
+    except (gdb.error, ValueError):
+        return 0
+
+
+def read_disasm(frame, pc):
+    # `x/i` labels the instruction like `disassemble`; without a symbol the
+    # bare instruction is left
+    m = pattern_disasm.search(gdb.execute('x/i {}'.format(pc), to_string=True))
+    if m:
+        return m.group(1)
+    return frame.architecture().disassemble(pc)[0]['asm']
+
+
+def trace(path, regs, start, end, exit='reach', step='ni', maxcount=1000, disasm=True):
+    record = struct.Struct('<Q{}Qi'.format(len(regs)))
+    length = struct.Struct('<H')
+    strings: dict = {}
+    # pc -> string index, each pc is disassembled once
+    indexes: dict = {}
+    count = 0
+    with open(path, 'wb', buffering=BUFFER_SIZE) as f:
+        while count < maxcount:
+            if gdb.selected_inferior().pid == 0:
+                break
+            try:
+                frame = gdb.newest_frame()
+            except gdb.error:
+                break
+            pc = frame.pc()
+            index = -1
+            if disasm:
+                if pc not in indexes:
+                    asm = read_disasm(frame, pc)
+                    if asm not in strings:
+                        strings[asm] = len(strings)
+                        data = asm.encode()
+                        f.write(b'S' + length.pack(len(data)) + data)
+                    indexes[pc] = strings[asm]
+                index = indexes[pc]
+            values = [read_register(frame, name) for name in regs]
+            f.write(b'R' + record.pack(pc, *values, index))
+            count += 1
+            if exit == 'reach' and pc == end:
+                break
+            elif exit == 'out' and (pc < start or end <= pc):
+                break
+            gdb.execute(step, to_string=True)
+    return count
+
+
+DbgctrlTrace()
+DbgctrlPageHash()
@@ -0,0 +1,132 @@
+# loaded into lldb with `command script import`; runs in lldb's embedded python.
+# the record format must match dbgctrl.agent.read_trace.
+import json
+import re
+import struct
+import zlib
+
+import lldb
+
+
+MASK64 = (1 << 64) - 1
+BUFFER_SIZE = 1 << 20
+
+# the disassembly as the step engine reads it (LLDBParser.pattern_disasm):
+# '<+4>:  movq   %rsp, %rbp'
+pattern_disasm = re.compile(r'\-\> +(?:[0-9A-Fa-fx]+)(?:\s)+(.+)')
+
+
+def __lldb_init_module(debugger, internal_dict):
+    debugger.HandleCommand(
+        'command script add -f {}.trace_command dbgctrl_trace'.format(__name__))
+    debugger.HandleCommand(
+        'command script add -f {}.pagehash_command dbgctrl_pagehash'.format(__name__))
+
+
+def trace_command(debugger, command, result, internal_dict):
+    opts = json.loads(command)
+    is_async = debugger.GetAsync()
+    debugger.SetAsync(False)
+    try:
+        count = trace(debugger.GetSelectedTarget(), **opts)
+    finally:
+        debugger.SetAsync(is_async)
+    result.AppendMessage('dbgctrl_trace: {} records'.format(count))
+
+
+def pagehash_command(debugger, command, result, internal_dict):
+    opts = json.loads(command)
+    process = debugger.GetSelectedTarget().GetProcess()
+    for addr, length in opts['regions']:
+        hashes = page_hashes(process, addr, length, opts['page_size'])
+        result.AppendMessage('dbgctrl_pagehash: {}'.format(' '.join(hashes)))
+
+
+def read_memory(process, addr, length):
+    error = lldb.SBError()
+    data = process.ReadMemory(addr, length, error)
+    return None if error.Fail() else data
+
+
+def page_hashes(process, addr, length, page_size):
+    data = read_memory(process, addr, length)
+    hashes = []
+    for offset in range(0, length, page_size):
+        size = min(page_size, length - offset)
+        if data is not None:
+            page = data[offset:offset + size]
+        else:
+            # part of the region is unreadable: page by page
+            page = read_memory(process, addr + offset, size)
+            if page is None:
+                hashes.append('-')
+                continue
+        hashes.append('{:08x}'.format(zlib.crc32(page)))
+    return hashes
+
+
+def read_register(frame, name):
+    value = frame.FindRegister(name)
+    if not value.IsValid():
+        return 0
+    return value.GetValueAsUnsigned() & MASK64
+
+
+def read_disasm(target, pc):
+    # `dis -s` labels the instruction like the step engine reads it; without
+    # a symbol the bare instruction is left
+    result = lldb.SBCommandReturnObject()
+    target.GetDebugger().GetCommandInterpreter().HandleCommand(
+        'dis -s {} -c 1'.format(pc), result)
+    m = pattern_disasm.search(result.GetOutput() or '')
+    if m:
+        return m.group(1)
+    insn = target.ReadInstructions(lldb.SBAddress(pc, target), 1).GetInstructionAtIndex(0)
+    return '{} {}'.format(insn.GetMnemonic(target), insn.GetOperands(target)).strip()
+
+
+def step_thread(thread, step):
+    if step == 'si':
+        thread.StepInstruction(False)
+    elif step == 'ni':
+        thread.StepInstruction(True)
+    elif step == 's':
+        thread.StepInto()
+    else:
+        thread.StepOver()
+
+
+def trace(target, path, regs, start, end, exit='reach', step='ni', maxcount=1000, disasm=True):
+    record = struct.Struct('<Q{}Qi'.format(len(regs)))
+    length = struct.Struct('<H')
+    process = target.GetProcess()
+    strings: dict = {}
+    # pc -> string index, each pc is disassembled once
+    indexes: dict = {}
+    count = 0
+    with open(path, 'wb', buffering=BUFFER_SIZE) as f:
+        while count < maxcount:
+            if not process.IsValid() or process.GetState() != lldb.eStateStopped:
+                break
+            thread = process.GetSelectedThread()
+            frame = thread.GetFrameAtIndex(0)
+            pc = frame.GetPC()
+            index = -1
+            if disasm:
+                if pc not in indexes:
+                    asm = read_disasm(target, pc)
+                    if asm not in strings:
+                        strings[asm] = len(strings)
+                        data = asm.encode()
+                        f.write(b'S' + length.pack(len(data)) + data)
+                    indexes[pc] = strings[asm]
+                index = indexes[pc]
+            values = [read_register(frame, name) for name in regs]
+            f.write(b'R' + record.pack(pc, *values, index))
+            count += 1
+            if exit == 'reach' and pc == end:
+                break
+            elif exit == 'out' and (pc < start or end <= pc):
+                break
+            step_thread(thread, step)
+    return count
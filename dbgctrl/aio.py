@@ -0,0 +1,225 @@
+import asyncio
+import os
+from typing import Any
+
+from dbgctrl import elf, memory
+from dbgctrl.controller import Parser
+from dbgctrl.gdb import GDBParser
+from dbgctrl.lldb import LLDBParser
+
+
+class AsyncController(Parser):
+    # asyncio counterpart of the prompt-framed controllers. The command strings
+    # and reply parsers come from GDBParser / LLDBParser, like the sync classes.
+    DEFAULT_TIMEOUT = 30.0
+    POLL_INTERVAL = 0.01
+    QUIT_TIMEOUT = 1.0
+    STREAM_LIMIT = 64 << 20
+
+    def __init__(self, dbgpath):
+        self.dbgpath = dbgpath
+        self.elfpath = None
+        self.prompt = self.PROMPT
+        # set by open_debugger()
+        self._process: Any = None
+        self._dump_dir = None
+        self._reg_layout = None
+        self.elf = None
+        self.disasm_cache = {}
+        self._lock = asyncio.Lock()
+        # replies of timed-out commands that are still to arrive
+        self._late_replies = 0
+
+    @classmethod
+    async def create(cls, dbgpath):
+        self = cls(dbgpath)
+        await self.open_debugger()
+        for cmd in self.INIT_COMMANDS:
+            await self.exec_command(cmd)
+        return self
+
+    async def open_debugger(self):
+        if not os.path.exists(self.dbgpath):
+            raise Exception('debugger not found: {}'.format(self.dbgpath))
+        self._process = await asyncio.create_subprocess_exec(
+            self.dbgpath,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=self.STREAM_LIMIT,
+        )
+        # consume the banner up to the first prompt
+        await self._get_responses(1)
+
+    async def exec_command(self, cmd, timeout=None):
+        return (await self.exec_batch([cmd], timeout=timeout))[0]
+
+    async def exec_batch(self, cmds, timeout=None):
+        async with self._lock:
+            self._process.stdin.write(''.join([f'{cmd}\n' for cmd in cmds]).encode())
+            await self._process.stdin.drain()
+            return await self._get_responses(len(cmds), timeout=timeout)
+
+    async def _get_responses(self, count, timeout=None):
+        if timeout is None:
+            timeout = self.DEFAULT_TIMEOUT
+        # the replies of a timed-out batch come first: they are skipped, so the
+        # debugger and this session stay in step
+        late = self._late_replies
+        responses: list = []
+        try:
+            await asyncio.wait_for(self._read_responses(late + count, responses), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('{} not responding'.format(self.NAME))
+        finally:
+            # the replies still owed when the read timed out or was cancelled
+            self._late_replies = late + count - len(responses)
+        return responses[late:]
+
+    async def _read_responses(self, count, responses):
+        # readuntil() keeps a partial reply in the stream when cancelled
+        prompt = self.prompt.encode()
+        while len(responses) < count:
+            try:
+                res = await self._process.stdout.readuntil(prompt)
+            except asyncio.IncompleteReadError as e:
+                # EOF: the debugger has exited
+                responses.append(e.partial.decode())
+                responses += [''] * (count - len(responses))
+                break
+            responses.append(res.decode())
+
+    async def load(self, elfpath, timeout=None):
+        self.elfpath = elfpath
+        self._reg_layout = None
+        self.disasm_cache.clear()
+        if self.elf:
+            self.elf.close()
+        self.elf = elf.open_elf(elfpath)
+        await self.exec_command(f'file {elfpath}', timeout=timeout)
+
+    async def quit(self):
+        try:
+            await self.exec_command('q', timeout=self.QUIT_TIMEOUT)
+        except TimeoutError:
+            pass
+        if self._process:
+            if self._process.returncode is None:
+                self._process.terminate()
+            await self._process.wait()
+            self._process = None
+        memory.remove_dump_dir(self._dump_dir)
+        self._dump_dir = None
+        if self.elf:
+            self.elf.close()
+            self.elf = None
+
+    async def run_stop_at_start(self, timeout=None):
+        return await self.exec_command(self.START_COMMAND, timeout=timeout)
+
+    async def wait_until_stopped(self, timeout=None):
+        if timeout is None:
+            timeout = self.DEFAULT_TIMEOUT
+        loop = asyncio.get_running_loop()
+        timeout_time = loop.time() + timeout
+        while True:
+            remaining = max(timeout_time - loop.time(), self.POLL_INTERVAL)
+            response = await self.exec_command(self.STATUS_COMMAND, timeout=remaining)
+            stopped = self._parse_stopped(response)
+            if stopped is not None:
+                return stopped
+            if loop.time() >= timeout_time:
+                raise TimeoutError('{} target not stopped'.format(self.NAME))
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def reset(self, timeout=None):
+        await self.exec_batch(list(self.RESET_COMMANDS), timeout=timeout)
+
+    async def step_in(self, inst=False, timeout=None):
+        return await self.exec_command(self._step_command('in', inst), timeout=timeout)
+
+    async def step_over(self, inst=False, timeout=None):
+        return await self.exec_command(self._step_command('over', inst), timeout=timeout)
+
+    async def step_out(self, inst=False, timeout=None):
+        return await self.exec_command(self._step_command('out', inst), timeout=timeout)
+
+    async def read_pc(self, timeout=5):
+        response = await self.exec_command(self.PC_COMMAND, timeout=timeout)
+        pc = self._parse_read_pc(response)
+        if pc is None:
+            raise Exception("pc not found")
+        return pc
+
+    async def read_reg_layout(self, timeout=5):
+        if self._reg_layout is None:
+            response = await self.exec_command(self.REG_LAYOUT_COMMAND, timeout=timeout)
+            self._reg_layout = self._parse_reg_layout(response)
+        return self._reg_layout
+
+    async def read_reg(self, names=None, timeout=5):
+        layout = (await self.read_reg_layout(timeout=timeout)).subset(names)
+        response = await self.exec_command(self._read_reg_command(layout), timeout=timeout)
+        return self._parse_read_reg(response, layout)
+
+    async def read_mem(self, addr, size=4, count=1, timeout=3):
+        cmd = self._read_mem_command(addr, size, count)
+        return self._parse_read_mem(await self.exec_command(cmd, timeout=timeout))
+
+    async def read_mem_bytes(self, addr, length, dtype=None, timeout=None):
+        if self._dump_dir is None:
+            self._dump_dir = memory.make_dump_dir()
+        path = memory.dump_path(self._dump_dir)
+        cmd = self._dump_mem_command(path, addr, length)
+        response = await self.exec_command(cmd, timeout=timeout)
+        return memory.as_dtype(memory.map_dump(path, length, response=response), dtype)
+
+    async def prefill_disasm(self, start, end=None, timeout=None):
+        response = await self.exec_command(self._disasm_range_command(start, end), timeout=timeout)
+        table = self._parse_disasm_range(response)
+        self.disasm_cache.update(table)
+        return len(table)
+
+    async def read_disasm(self, pc=None, timeout=None):
+        if pc in self.disasm_cache:
+            return self.disasm_cache[pc]
+        if pc is None:
+            response = await self.exec_command(self.PC_COMMAND, timeout=timeout)
+            pc = self._parse_read_pc(response)
+            disasm = self._parse_read_disasm(response)
+        else:
+            cmd = self._disasm_range_command(pc, pc + 1)
+            disasm = self._parse_disasm_range(await self.exec_command(cmd, timeout=timeout)).get(pc)
+        if disasm is None:
+            raise Exception("disasm line not found")
+        if pc is not None:
+            self.disasm_cache[pc] = disasm
+        return disasm
+
+    async def read_return_address(self, timeout=None):
+        response = await self.exec_command(self.RETURN_ADDRESS_COMMAND, timeout=timeout)
+        return self._parse_return_address(response)
+
+    def read_function_range(self, symbol):
+        # [start, end) from the symbol table of the loaded ELF (link-time addresses)
+        if self.elf is None:
+            raise Exception("unknown size of function: {}".format(symbol))
+        return self.elf.function_range(symbol)
+
+    async def snapshot(self, regs=None, disasm=True, mem=(), step=None, timeout=None):
+        layout = (await self.read_reg_layout(timeout=timeout)).subset(regs)
+        cache = self.disasm_cache or None
+        cmds = self._snapshot_commands(layout, mem, step, cached=cache is not None)
+        responses = await self.exec_batch(cmds, timeout=timeout)
+        snap = self._parse_snapshot(responses, layout, disasm, step, cache=cache)
+        if disasm and snap.disasm is None and snap.pc is not None and cache is not None:
+            snap = snap._replace(disasm=await self.read_disasm(timeout=timeout))
+        return snap
+
+
+class AsyncGDBController(GDBParser, AsyncController):
+    pass
+
+
+class AsyncLLDBController(LLDBParser, AsyncController):
+    pass
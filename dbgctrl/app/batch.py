@@ -0,0 +1,87 @@
+import os
+import signal
+import sys
+import time
+import traceback
+import multiprocessing
+from collections import namedtuple
+from multiprocessing.connection import wait
+
+
+Job = namedtuple('Job', ['name', 'args', 'logpath'])
+JobResult = namedtuple('JobResult', ['name', 'status', 'seconds', 'error', 'value'])
+
+
+def _worker(func, args, logpath, conn):
+    # own process group, so a timeout also kills the debugger and its inferior
+    os.setpgrp()
+    if logpath:
+        with open(logpath, 'w') as log:
+            os.dup2(log.fileno(), sys.stdout.fileno())
+            os.dup2(log.fileno(), sys.stderr.fileno())
+    try:
+        value = func(args)
+    except BaseException as e:
+        traceback.print_exc()
+        conn.send(('error', '{}: {}'.format(type(e).__name__, e), None))
+    else:
+        conn.send(('ok', '', value))
+    finally:
+        conn.close()
+
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        # not a group leader yet
+        proc.kill()
+    proc.join()
+
+
+def run_jobs(func, jobs, workers, timeout=None, callback=None):
+    # runs func(job.args) for every job in its own process, at most `workers`
+    # at a time. A job running longer than `timeout` is killed with its
+    # debugger; the others keep going. Results (with the picklable return
+    # value of func) are returned in job order.
+    pending = list(reversed(jobs))
+    running: dict = {}
+    results = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.pop()
+            reader, writer = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(
+                target=_worker, args=(func, job.args, job.logpath, writer), daemon=True)
+            proc.start()
+            writer.close()
+            running[proc.sentinel] = (job, proc, reader, time.monotonic())
+
+        now = time.monotonic()
+        wait_time = None
+        if timeout is not None:
+            wait_time = max(min(start + timeout for _, _, _, start in running.values()) - now, 0)
+        ready = wait(list(running), timeout=wait_time)
+
+        now = time.monotonic()
+        for sentinel in list(running):
+            job, proc, reader, start = running[sentinel]
+            if sentinel in ready:
+                proc.join()
+                if reader.poll():
+                    status, error, value = reader.recv()
+                else:
+                    status, error, value = 'error', 'worker exited with code {}'.format(
+                        proc.exitcode), None
+            elif timeout is not None and now - start >= timeout:
+                _kill(proc)
+                status, error, value = 'timeout', 'killed after {}s'.format(timeout), None
+            else:
+                continue
+            reader.close()
+            del running[sentinel]
+            result = JobResult(job.name, status, now - start, error, value)
+            results[job.name] = result
+            if callback:
+                callback(result)
+    return [results[job.name] for job in jobs]
@@ -1,13 +1,21 @@
 import sys
 import os
 import re
+import csv
+import shlex
 import time
 import argparse
+import tempfile
 from collections import namedtuple
 
 import dbgctrl
-from dbgctrl.logging import logging
+from dbgctrl.logging import logging, getLogger
 from dbgctrl import __version__
+from dbgctrl.agent import read_trace
+from dbgctrl.blocks import find_blocks
+from dbgctrl.stats import log_report
+from dbgctrl.trace import CODECS, RecordWriter, TraceIndexWriter, TraceReader, TraceWriter
+from dbgctrl.app.batch import Job, run_jobs
 
 NAMESPACE = 'dbgctrl'
 
@@ -15,6 +23,11 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 RegName = namedtuple('RegName', ['type', 'names'])
+# a register (reg) or memory (addr, size) input written at the range start
+Patch = namedtuple('Patch', ['reg', 'addr', 'size', 'values'])
+# columns before the registers in watch mode; hw is 0 for a change found by
+# comparing at a later stop
+WATCH_COLUMNS = ('watch', 'old', 'new', 'hw')
 # PcRange = namedtuple('PcRange', ['type', 'name', 'start', 'end'])
 class PcRange():
     _attrs = ['type', 'name', 'start', 'end']
@@ -26,7 +39,7 @@ class PcRange():
             setattr(self, key, args[i])
 
 
-def arg_parse():
+def arg_parse(argv=None, defaults=None):
     argparser = argparse.ArgumentParser(
         prog=NAMESPACE,
     )
@@ -36,7 +49,10 @@ def arg_parse():
         help='display version and exit')
     argparser.add_argument(
         '--debugger', '-d', metavar='PATH', default=None,
-        help='debugger path')
+        help='debugger path (host:port of a remote stub with --backend rsp)')
+    argparser.add_argument(
+        '--backend', '-b', metavar='BACKEND', default=None, choices=['mi', 'rsp', 'ptrace'],
+        help='debugger backend (default: chosen from debugger path)')
     argparser.add_argument(
         '--regname', '-n', metavar='NAMES', default=None,
         help='regisger name list')
@@ -50,15 +66,77 @@ def arg_parse():
         '--step', '-s', metavar='STEP', default='ni', choices=['s', 'si', 'n', 'ni'],
         help='debugger step command')
     argparser.add_argument(
-        '--max', '-M', metavar='COUNT', default=1000,
+        '--granularity', '-g', metavar='GRANULARITY', default='insn', choices=['insn', 'block'],
+        help='dump every instruction, or only basic block entries (step engine)')
+    argparser.add_argument(
+        '--engine', '-E', metavar='ENGINE', default='step', choices=['step', 'inproc'],
+        help='step from python, or trace inside the debugger (inproc)')
+    argparser.add_argument(
+        '--watch', '-w', metavar='ADDR[:LEN],...', default=None,
+        help='record the writes to these regions with watchpoints instead of stepping')
+    argparser.add_argument(
+        '--watch-hw', metavar='N', default=4, type=int,
+        help='watch: hardware watchpoints available at once (x86: 4 debug registers)')
+    argparser.add_argument(
+        '--mem-diff', '-m', metavar='REGIONS', default=None,
+        help='also record memory changes in these regions (stack,heap,data,ADDR:LEN,...)')
+    argparser.add_argument(
+        '--mem-diff-output', metavar='FILE', default=None,
+        help='output of the memory changes (default: <output>.mem.csv)')
+    argparser.add_argument(
+        '--repeat', metavar='N', default=1, type=int,
+        help='trace the range N times, rewinding to a checkpoint at its start')
+    argparser.add_argument(
+        '--patch', '-p', metavar='SPEC', default=None, action='append',
+        help='write REG=V1,V2,... or ADDR[:SIZE]=V1,... at the range start, '
+             'value i %% count in iteration i')
+    argparser.add_argument(
+        '--max', '-M', metavar='COUNT', default=1000, type=int,
         help='max operator count')
+    argparser.add_argument(
+        '--format', '-f', metavar='FORMAT', default='csv', choices=['csv', 'bin'],
+        help='output format (bin: columnar trace, read with dbgctrl.trace)')
+    argparser.add_argument(
+        '--compress', metavar='CODEC', default='none', choices=list(CODECS),
+        help='chunk compression of the bin format')
+    argparser.add_argument(
+        '--index', action='store_true',
+        help='also write the query index <output>.idx (see dbgctrl-trace query)')
+    argparser.add_argument(
+        '--timeout', '-t', metavar='SEC', default=60.0, type=float,
+        help='timeout for starting and running to the range start')
+    argparser.add_argument(
+        '--stats', action='store_true',
+        help='print steps per second and time per phase at the end')
     argparser.add_argument(
         '--output', '-o', metavar='FILE', default=None,
         help='output file')
+    argparser.add_argument(
+        '--jobs', '-j', metavar='N', default=None, type=int,
+        help='batch mode: input is a manifest, traced by N worker processes')
+    argparser.add_argument(
+        '--job-timeout', metavar='SEC', default=None, type=float,
+        help='batch mode: kill a job running longer than this')
+    argparser.add_argument(
+        '--outdir', metavar='DIR', default='regdump-out',
+        help='batch mode: directory for outputs, logs and summary.csv')
+    argparser.add_argument(
+        '--segments', '-k', metavar='K', default=None, type=int,
+        help='trace K segments of a deterministic program in parallel and join them')
+    argparser.add_argument(
+        '--segment-at', metavar='ADDR', default=None,
+        help='segments: cut at hits of this pc (default: at step counts of --max)')
+    argparser.add_argument(
+        '--segment-hits', metavar='N', default=None, type=int,
+        help='segments: hits of --segment-at per segment')
     argparser.add_argument(
         'input',
-        help='input file')
-    args = argparser.parse_args()
+        help='input file (manifest file with --jobs)')
+    # index of the segment traced by a segment job
+    argparser.set_defaults(segment=None)
+    if defaults:
+        argparser.set_defaults(**defaults)
+    args = argparser.parse_args(argv)
 
     return args
 
@@ -69,11 +147,16 @@ def regname_parse(dbg, regname):
     if m:
         tp = m.group(1)
         if tp == 'l':
-            _regname = RegName('list', m.group(2).split(','))
+            names = m.group(2).split(',')
+            layout = dbg.read_reg_layout()
+            unknown = [n for n in names if n not in layout]
+            if unknown:
+                raise ValueError('unknown register: {}'.format(','.join(unknown)))
+            _regname = RegName('list', names)
         elif tp == 'r':
-            regs = dbg.read_reg()
+            layout = dbg.read_reg_layout()
             names = []
-            for v in regs:
+            for v in layout.names:
                 m2 = re.match(r'{}$'.format(m.group(2)), v)
                 if m2:
                     names.append(v)
@@ -84,8 +167,8 @@ def regname_parse(dbg, regname):
                 raise ValueError('regname file not exists: {}'.format(regfpath))
             _regname = RegName('file', [])
     else:
-        regs = dbg.read_reg()
-        _regname = RegName('regular', tuple(regs.keys()))
+        layout = dbg.read_reg_layout()
+        _regname = RegName('regular', layout.names)
     return _regname
 
 
@@ -96,18 +179,481 @@ def range_parse(dbg, pc_range):
         _pc_range = PcRange('pc', '-', int(m.group(1), 16), int(m.group(2), 16))
     # elif m := re.match(r'\d+,\d+', pc_range):
     #     _pc_range = PcRange('cycle', '-', int(m.group(1)), int(m.group(2)))
+    elif dbg.elf and dbg.elf.symbol(pc_range):
+        # link-time range from the symbol table, known before the target runs
+        start, end = dbg.read_function_range(pc_range)
+        _pc_range = PcRange('func', pc_range, start, end)
     else:
         _pc_range = PcRange('func', pc_range, -1, -1)
     return _pc_range
 
 
-def main():
-    args = arg_parse()
-    dbg = dbgctrl.controller(args.debugger)
+def watch_parse(watch):
+    # 'ADDR[:LEN],...' -> aligned (addr, size) pieces of 1, 2, 4 or 8 bytes,
+    # what one debug register can watch. LEN defaults to 8
+    chunks = []
+    for item in watch.split(','):
+        addr, _, length = item.partition(':')
+        addr, length = int(addr, 0), int(length or '8', 0)
+        if length <= 0:
+            raise ValueError('invalid watch length: {}'.format(item))
+        end = addr + length
+        while addr < end:
+            size = 8
+            while addr % size or addr + size > end:
+                size //= 2
+            chunks.append((addr, size))
+            addr += size
+    return chunks
+
+
+def patch_parse(dbg, specs):
+    # ['REG=V1,V2,...' or 'ADDR[:SIZE]=V1,...'] -> [Patch]. SIZE is 1, 2, 4
+    # or 8 bytes and defaults to 8
+    patches = []
+    for spec in specs or []:
+        target, sep, values = spec.partition('=')
+        if not sep or not values:
+            raise ValueError('invalid patch: {}'.format(spec))
+        values = [int(v, 0) for v in values.split(',')]
+        if re.match(r'(0x[0-9A-Fa-f]+|\d+)(:\d+)?$', target):
+            addr, _, size = target.partition(':')
+            size = int(size or '8')
+            if size not in (1, 2, 4, 8):
+                raise ValueError('invalid patch size: {}'.format(spec))
+            patches.append(Patch(None, int(addr, 0), size, values))
+        elif target in dbg.read_reg_layout():
+            patches.append(Patch(target, None, None, values))
+        else:
+            raise ValueError('unknown register: {}'.format(target))
+    return patches
+
+
+def apply_patches(dbg, patches, iteration):
+    for patch in patches:
+        value = patch.values[iteration % len(patch.values)]
+        if patch.reg is None:
+            dbg.write_mem(patch.addr, value, patch.size)
+        else:
+            dbg.write_reg(patch.reg, value)
+
+
+def iteration_output(path, iteration, repeat):
+    # trace.csv -> trace.0.csv, trace.1.csv, ... when the range is repeated
+    if not path or repeat == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, iteration, ext)
+
+
+def memdiff_parse(dbg, spec):
+    # [(addr, length)]: stack and heap are the mappings of the process at the
+    # range start, data the writable sections of the ELF file
+    regions = []
+    items = spec.split(',')
+    mappings = dbg.read_mappings() if {'stack', 'heap', 'data'} & set(items) else []
+    for item in items:
+        if item in ('stack', 'heap'):
+            found = [(m.start, m.end - m.start) for m in mappings if m.name == '[{}]'.format(item)]
+            if not found:
+                raise ValueError('no {} mapping in the process'.format(item))
+            regions += found
+        elif item == 'data':
+            if dbg.elf is None:
+                raise ValueError('--mem-diff data needs an ELF input')
+            name = os.path.basename(dbg.elfpath)
+            starts = [m.start for m in mappings if os.path.basename(m.name) == name]
+            bias = dbg.elf.load_bias(0, min(starts)) if starts else 0
+            regions += [(start + bias, end - start) for start, end in dbg.elf.writable_ranges()]
+        else:
+            addr, _, length = item.partition(':')
+            regions.append((int(addr, 0), int(length or '4096', 0)))
+    return regions
+
+
+class MemDiffWriter():
+    # changed byte runs of a dbgctrl.memory.MemorySnapshot, by the number of
+    # the record at which they are first seen
+    def __init__(self, path, snapshot):
+        self.fout = open(path, 'w')
+        self.snapshot = snapshot
+        self.count = 0
+        print('No.,addr,old,new', file=self.fout)
+
+    def append(self, number):
+        for diff in self.snapshot.update():
+            self.count += 1
+            print('{},{},{},{}'.format(
+                number, hex(diff.addr), diff.old.hex(), diff.new.hex()), file=self.fout)
+
+    def close(self):
+        self.fout.close()
+
+
+def open_memdiff(dbg, args):
+    path = args.mem_diff_output
+    if path is None:
+        if not args.output:
+            raise ValueError('--mem-diff needs --output or --mem-diff-output')
+        path = args.output + '.mem.csv'
+    regions = memdiff_parse(dbg, args.mem_diff)
+    logger.info('mem-diff: {} regions, {} bytes'.format(
+        len(regions), sum(length for _, length in regions)))
+    return MemDiffWriter(path, dbg.mem_snapshot(regions))
+
+
+def write_row(fout, count, pc, dis, regvalues):
+    print('{},{},"{}",{}'.format(
+        count, hex(pc), dis, ','.join([hex(v) for v in regvalues])),
+        file=fout)
+
+
+class CsvWriter(RecordWriter):
+    def __init__(self, path, names):
+        super().__init__()
+        self.fout = open(path, 'w') if path else sys.stdout
+        print('No.,pc,dis,{}'.format(','.join([n for n in names])), file=self.fout)
+
+    def append(self, pc, disasm, values):
+        self.count += 1
+        write_row(self.fout, self.count, pc, disasm, values)
+
+    def append_row(self, row):
+        # a row of another csv output, without its number
+        self.count += 1
+        print('{},{}'.format(self.count, row), file=self.fout)
+
+    def close(self):
+        if self.fout is not sys.stdout:
+            self.fout.close()
+
+
+class IndexedWriter(RecordWriter):
+    # a trace writer that also feeds a dbgctrl.trace.TraceIndexWriter
+    def __init__(self, writer, index):
+        super().__init__()
+        self.writer = writer
+        self.index = index
+
+    def append(self, pc, disasm, values):
+        self.writer.append(pc, disasm, values)
+        self.index.append(pc, disasm, values)
+        self.count = self.writer.count
+
+    def append_row(self, row):
+        self.writer.append_row(row)
+        self.count = self.writer.count
+        fields = next(csv.reader([row]))
+        self.index.append(int(fields[0], 16), fields[1], [int(v, 16) for v in fields[2:]])
+
+    def close(self):
+        try:
+            self.writer.close()
+        finally:
+            self.index.close()
+
+
+def open_writer(args, names, output=None):
+    output = output or args.output
+    if args.index and not output:
+        raise ValueError('--index needs --output')
+    if args.format == 'bin':
+        if not output:
+            raise ValueError('--format bin needs --output')
+        writer: RecordWriter = TraceWriter(output, names, compress=args.compress)
+    else:
+        writer = CsvWriter(output, names)
+    if args.index:
+        return IndexedWriter(writer, TraceIndexWriter(output + '.idx', names))
+    return writer
+
+
+def check_exit(args, pcrange, pc):
+    if args.exit == 'reach' and pc == pcrange.end:
+        print('reached end  : {}'.format(hex(pcrange.end)))
+        return True
+    elif args.exit == 'out' and (pc < pcrange.start or pcrange.end <= pc):
+        print('out range: [{}, {}]'.format(hex(pcrange.start), hex(pcrange.end)))
+        return True
+    return False
+
+
+def dump_step(dbg, args, regname, pcrange, maxcount, writer, until=None, memdiff=None):
+    # until: (pc, n) also ends the dump when pc is reached for the n-th time
+    # after the first record. True when the range or the program has ended.
+    # memdiff: a MemDiffWriter, updated at every record
+    prev_progress, progress = 0, 0
+    hits = 0
+    # every step is one round trip: step, then read pc, registers and disasm
+    snap = dbg.snapshot(regs=regname.names, disasm=True)
+    for count in range(1, maxcount + 1):
+        prev_progress = progress
+        progress = count * 100 // maxcount
+        if progress != prev_progress:
+            logger.info('count: {}'.format(count))
+        pc = snap.pc
+        if pc is None:
+            return True
+        writer.append(pc, snap.disasm, snap.regs.values)
+        if memdiff is not None:
+            memdiff.append(count)
+        if check_exit(args, pcrange, pc):
+            return True
+        if until is not None and count > 1 and pc == until[0]:
+            hits += 1
+            if hits == until[1]:
+                return False
+        snap = dbg.snapshot(regs=regname.names, disasm=True, step=args.step)
+    return False
+
+
+def dump_block(dbg, args, regname, pcrange, maxcount, writer):
+    # breakpoints at the basic block entries of the traced code and `continue`
+    # in between; indirect branches and returns are stepped to find their target
+    if dbg.elf is None:
+        raise ValueError('--granularity block needs an ELF input')
+    leaders, indirect = find_blocks(dbg.disasm_cache, dbg.elf.machine)
+    stops = sorted(leaders | indirect | {pcrange.end})
+    logger.info('blocks: {}, breakpoints: {}'.format(len(leaders), len(stops)))
+    dbg.exec_batch(['b *{}'.format(hex(addr)) for addr in stops])
+    count = 0
+    prev_progress, progress = 0, 0
+    entry = True
+    snap = dbg.snapshot(regs=regname.names, disasm=True)
+    while count < maxcount:
+        pc = snap.pc
+        if pc is None:
+            break
+        if entry or pc in leaders:
+            count += 1
+            prev_progress = progress
+            progress = count * 100 // maxcount
+            if progress != prev_progress:
+                logger.info('count: {}'.format(count))
+            writer.append(pc, snap.disasm, snap.regs.values)
+        if check_exit(args, pcrange, pc):
+            break
+        # a pc reached by stepping an indirect branch is a block entry too
+        entry = pc in indirect
+        snap = dbg.snapshot(regs=regname.names, disasm=True, step='si' if entry else 'c')
+
+
+def dump_watch(dbg, args, regname, pcrange, maxcount, writer):
+    # `continue` between watchpoint hits and record every changed piece with
+    # pc and registers. With more pieces than debug registers, the others are
+    # compared at every stop, and a piece found changed takes the watchpoint of
+    # the piece that fired least recently (its change is recorded with hw=0)
+    chunks = watch_parse(args.watch)
+    if args.watch_hw < 1:
+        raise ValueError('--watch-hw must be at least 1')
+    mem = [(addr, size, 1) for addr, size in chunks]
+    snap = dbg.snapshot(regs=regname.names, disasm=False, mem=mem)
+    values = [words[0] for words in snap.mem]
+    # the range start breakpoint would stop every iteration; the trace ends
+    # at the range end (stops elsewhere are writes, also outside the range)
+    dbg.exec_command(dbg.DELETE_COMMAND)
+    if pcrange.end > 0:
+        dbg.exec_command('b *{}'.format(hex(pcrange.end)))
+    armed = {}
+    for i in range(min(args.watch_hw, len(chunks))):
+        armed[dbg.watch(*chunks[i])] = i
+    logger.info('watch: {} pieces, {} hardware watchpoints'.format(len(chunks), len(armed)))
+    fired = [0] * len(chunks)
+    stops = 0
+    count = 0
+    prev_progress, progress = 0, 0
+    while count < maxcount:
+        if dbg.run_to_watch() is None:
+            break
+        stops += 1
+        snap = dbg.snapshot(regs=regname.names, disasm=True, mem=mem)
+        if snap.pc is None:
+            break
+        hot = set(armed.values())
+        for i, words in enumerate(snap.mem):
+            if words[0] == values[i]:
+                continue
+            hw = int(i in hot)
+            writer.append(snap.pc, snap.disasm,
+                          [chunks[i][0], values[i], words[0], hw] + list(snap.regs.values))
+            values[i] = words[0]
+            fired[i] = stops
+            count += 1
+            prev_progress = progress
+            progress = count * 100 // maxcount
+            if progress != prev_progress:
+                logger.info('count: {}'.format(count))
+            if not hw:
+                number = min(armed, key=lambda n: fired[armed[n]])
+                dbg.unwatch(number)
+                del armed[number]
+                armed[dbg.watch(*chunks[i])] = i
+        if snap.pc == pcrange.end and check_exit(args, pcrange, snap.pc):
+            break
+
+
+def dump_inproc(dbg, args, regname, pcrange, maxcount, writer):
+    # the debugger steps by itself and writes the records to a (tmpfs) file
+    tmpdir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    fd, path = tempfile.mkstemp(prefix='dbgctrl-', suffix='.trace', dir=tmpdir)
+    os.close(fd)
+    try:
+        total = dbg.trace(
+            path, regname.names, pcrange.start, pcrange.end,
+            exit=args.exit, step=args.step, maxcount=maxcount)
+        logger.info('count: {}'.format(total))
+        pc = None
+        for record in read_trace(path, len(regname.names)):
+            pc = record.pc
+            writer.append(pc, record.disasm, record.regs)
+        if pc is not None:
+            check_exit(args, pcrange, pc)
+    finally:
+        os.remove(path)
+
+
+def seek_segment(dbg, args, maxcount):
+    # fast-forward from the range start to segment args.segment. Returns the
+    # records to dump and the stop condition of dump_step(). Neighbouring
+    # segments share one record, which is checked when they are joined
+    if args.segment_at is not None:
+        addr = int(args.segment_at, 0)
+        if args.segment > 0:
+            dbg.run_to_hit(addr, args.segment * args.segment_hits)
+        return maxcount, (addr, args.segment_hits)
+    length = -(-(maxcount - 1) // args.segments)
+    offset = args.segment * length
+    if offset > 0:
+        dbg.run_steps(args.step, offset)
+    return min(length + 1, maxcount - offset), None
+
+
+def read_part(args, path):
+    # records of a segment output: TraceRecords, or csv rows without their number
+    if args.format == 'bin':
+        with TraceReader(path) as trace:
+            yield from trace
+    else:
+        with open(path) as f:
+            next(f, None)
+            for line in f:
+                yield line.rstrip('\n').split(',', 1)[1]
+
+
+def join_segments(args, jobs, results):
+    names = results[0].value['names']
+    writer = open_writer(args, names)
+    if args.format == 'bin':
+        append = lambda record: writer.append(record.pc, record.disasm, record.regs)  # noqa: E731
+    else:
+        append = writer.append_row
+    last = None
+    try:
+        for i, (job, result) in enumerate(zip(jobs, results)):
+            records = read_part(args, job.args.output)
+            if i > 0:
+                first = next(records, None)
+                if first is not None and first != last:
+                    raise Exception(
+                        'segment {} does not start where segment {} ended, '
+                        'is the program deterministic?'.format(i, i - 1))
+            for record in records:
+                append(record)
+                last = record
+            # the following segments were run past the end of the trace
+            if result.value['ended']:
+                break
+    finally:
+        writer.close()
+    return writer.count
+
+
+def main_segments(args):
+    # the same program traced by K sessions in parallel, each one from its
+    # own starting point; the outputs are joined in order
+    if args.engine != 'step' or args.granularity != 'insn' or args.watch or args.mem_diff:
+        raise ValueError('--segments needs the step engine and --granularity insn')
+    if args.segment_at is not None and not args.segment_hits:
+        raise ValueError('--segment-at needs --segment-hits')
+    outdir = os.path.dirname(os.path.abspath(args.output)) if args.output else None
+    with tempfile.TemporaryDirectory(prefix='regdump-', dir=outdir) as tmpdir:
+        jobs = []
+        for i in range(args.segments):
+            name = 'segment{:03d}'.format(i)
+            job_args = argparse.Namespace(**dict(
+                vars(args), segment=i, stats=False, index=False,
+                output=os.path.join(tmpdir, name + '.' + args.format)))
+            jobs.append(Job(name, job_args, os.path.join(tmpdir, name + '.log')))
+        logger.info('segments: {}'.format(len(jobs)))
+        results = run_jobs(
+            regdump, jobs, len(jobs), timeout=args.job_timeout, callback=print_result)
+        failed = [r for r in results if r.status != 'ok']
+        if failed:
+            raise Exception('{} failed: {}'.format(failed[0].name, failed[0].error))
+        count = join_segments(args, jobs, results)
+    print('{} segments, {} records'.format(len(jobs), count), file=sys.stderr)
+    return 0
+
+
+def job_parse(args):
+    # one job per manifest line: an input file followed by regdump options,
+    # which override the ones given on the command line
+    defaults = dict(vars(args), output=None, jobs=None)
+    jobs: list = []
+    with open(args.input) as f:
+        for line in f:
+            argv = shlex.split(line, comments=True)
+            if not argv:
+                continue
+            job_args = arg_parse(argv, defaults)
+            name = '{:04d}-{}'.format(len(jobs), os.path.basename(job_args.input))
+            if job_args.output is None:
+                job_args.output = os.path.join(args.outdir, name + '.' + job_args.format)
+            logpath = os.path.join(args.outdir, name + '.log')
+            jobs.append(Job(name, job_args, logpath))
+    return jobs
+
+
+def print_result(result):
+    print('{:8} {:8.2f}s {} {}'.format(
+        result.status, result.seconds, result.name, result.error).rstrip())
+
+
+def main_batch(args):
+    os.makedirs(args.outdir, exist_ok=True)
+    jobs = job_parse(args)
+    logger.info('jobs: {}, workers: {}'.format(len(jobs), args.jobs))
+    results = run_jobs(
+        regdump, jobs, max(args.jobs, 1), timeout=args.job_timeout, callback=print_result)
+
+    summary = os.path.join(args.outdir, 'summary.csv')
+    with open(summary, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['job', 'input', 'output', 'status', 'seconds', 'error'])
+        for job, result in zip(jobs, results):
+            writer.writerow([
+                job.name, job.args.input, job.args.output,
+                result.status, '{:.3f}'.format(result.seconds), result.error])
+    failed = [r for r in results if r.status != 'ok']
+    print('{} jobs, {} failed, summary: {}'.format(len(results), len(failed), summary))
+    return 1 if failed else 0
+
+
+def regdump(args):
+    if args.repeat < 1:
+        raise ValueError('invalid --repeat: {}'.format(args.repeat))
+    if (args.repeat > 1 or args.patch) and (
+            args.watch or args.engine != 'step' or args.mem_diff or args.segment is not None):
+        raise ValueError('--repeat and --patch need the step engine, '
+                         'without --watch, --mem-diff and --segments')
+    dbg = dbgctrl.controller(args.debugger, backend=args.backend)
+    if args.stats:
+        stats = dbg.enable_stats()
     dbg.load(args.input)
 
-    dbg.run_stop_at_start()
-    time.sleep(2)
+    dbg.run_stop_at_start(timeout=args.timeout)
+    if not dbg.wait_until_stopped(timeout=args.timeout):
+        raise Exception('program exited before start: {}'.format(args.input))
 
     # set breakpoint before running program
     pcrange = range_parse(dbg, args.range)
@@ -118,58 +664,97 @@ def main():
 
     # run and break at start
     regname = regname_parse(dbg, args.regname)
-    dbg.exec_command('c', timeout=20)
+    dbg.exec_command('c', timeout=args.timeout)
+    if not dbg.wait_until_stopped(timeout=args.timeout):
+        raise Exception('program exited before reaching the range')
 
     if pcrange.type == 'func':
-        pcrange.start = dbg.read_pc()
-        pcrange.end = dbg.read_return_address()
+        pc = dbg.read_pc()
+        if pcrange.start < 0 or args.exit == 'reach':
+            # reaching the end of a function means returning to the caller
+            pcrange.start = pc
+            pcrange.end = dbg.read_return_address()
+        else:
+            bias = dbg.elf.load_bias(pcrange.start, pc)
+            pcrange.start += bias
+            pcrange.end += bias
     print('reached start: {}'.format(hex(pcrange.start)))
+    patches = patch_parse(dbg, args.patch)
+
+    if args.engine == 'step':
+        # disassemble the traced code once instead of on every step
+        if pcrange.type == 'func':
+            dbg.prefill_disasm(pcrange.start)
+        elif pcrange.start < pcrange.end:
+            dbg.prefill_disasm(pcrange.start, pcrange.end)
+
+    memdiff = None
+    if args.mem_diff:
+        if args.engine != 'step' or args.granularity != 'insn' or args.watch:
+            raise ValueError('--mem-diff needs the step engine and --granularity insn')
+        memdiff = open_memdiff(dbg, args)
+
+    # the range start is kept once; every further iteration rewinds to it
+    # instead of running the program again
+    base = dbg.checkpoint(timeout=args.timeout) if args.repeat > 1 else None
+    restart = dbg.restart
 
     # step and write register values
-    if args.output:
-        fout = open(args.output, 'w')
-    else:
-        fout = sys.stdout
+    names = tuple(regname.names)
+    if args.watch:
+        names = WATCH_COLUMNS + names
+    if args.stats:
+        restart = stats.timed('rewind', restart)
+        if memdiff is not None:
+            memdiff.append = stats.timed('memdiff', memdiff.append)
+        stats.add_phase('setup', time.perf_counter() - stats.start_time)
+        trace_start = time.perf_counter()
 
     maxcount = max(args.max, 10)
+    until = None
+    if args.segment is not None:
+        maxcount, until = seek_segment(dbg, args, maxcount)
     logger.info('maxcount: {}'.format(maxcount))
-    prev_progress, progress = 0, 0
-    print('No.,pc,dis,{}'.format(','.join([n for n in regname.names])), file=fout)
-    for count in range(1, maxcount + 1):
-        prev_progress = progress
-        progress = count * 100 // maxcount
-        if progress != prev_progress:
-            logger.info('count: {}'.format(count))
+    ended = True
+    records = 0
+    for iteration in range(args.repeat):
+        if iteration > 0:
+            restart(base, timeout=args.timeout)
+        apply_patches(dbg, patches, iteration)
+        writer = open_writer(args, names, iteration_output(args.output, iteration, args.repeat))
+        if args.stats:
+            writer.append = stats.timed('write', writer.append)
         try:
-            pc = dbg.read_pc()
-        except Exception:
-            break
-        regs = dbg.read_reg(names=regname.names)
-        regvalues = [reg['value'] for reg in regs.values()]
-        dis = dbg.read_disasm()
-        print('{},{},"{}",{}'.format(
-            count, hex(pc), dis, ','.join([hex(v) for v in regvalues])),
-            file=fout)
-        if args.exit == 'reach' and pc == pcrange.end:
-            print('reached end  : {}'.format(hex(pcrange.end)))
-            break
-        elif args.exit == 'out' and (pc < pcrange.start or pcrange.end <= pc):
-            print('out range: [{}, {}]'.format(hex(pcrange.start), hex(pcrange.end)))
-            break
-        if args.step == 'ni':
-            dbg.step_over(inst=True)
-        elif args.step == 'n':
-            dbg.step_over(inst=False)
-        elif args.step == 'si':
-            dbg.step_in(inst=True)
-        else:
-            dbg.step_in(inst=False)
-        count += 1
+            if args.watch:
+                dump_watch(dbg, args, regname, pcrange, maxcount, writer)
+            elif args.engine == 'inproc':
+                dump_inproc(dbg, args, regname, pcrange, maxcount, writer)
+            elif args.granularity == 'block':
+                dump_block(dbg, args, regname, pcrange, maxcount, writer)
+            else:
+                ended = dump_step(
+                    dbg, args, regname, pcrange, maxcount, writer, until=until, memdiff=memdiff)
+        finally:
+            writer.close()
+            if memdiff is not None:
+                memdiff.close()
+        records += writer.count
 
-    if args.output:
-        fout.close()
+    if args.stats:
+        getLogger().setLevel(logging.INFO)
+        log_report(dbg.stats(), steps=records, seconds=time.perf_counter() - trace_start)
 
     dbg.quit()
+    return dict(names=names, records=records, ended=ended, iterations=args.repeat)
+
+
+def main():
+    args = arg_parse()
+    if args.jobs is not None:
+        return main_batch(args)
+    if args.segments is not None:
+        return main_segments(args)
+    regdump(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+import sys
+import os
+import argparse
+
+from dbgctrl import __version__
+from dbgctrl.trace import DEFAULT_INDEX_BLOCK, TraceIndex, build_index
+
+NAMESPACE = 'dbgctrl-trace'
+QUERIES = ['count', 'steps', 'first', 'changes', 'state', 'hot']
+
+
+def arg_parse(argv=None):
+    argparser = argparse.ArgumentParser(
+        prog=NAMESPACE,
+    )
+    argparser.add_argument(
+        '--version', '-v', action='version',
+        version='{} {}'.format(NAMESPACE, __version__),
+        help='display version and exit')
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+
+    index = subparsers.add_parser('index', help='build the query index of a trace')
+    index.add_argument(
+        '--output', '-o', metavar='FILE', default=None,
+        help='index file (default: <trace>.idx)')
+    index.add_argument(
+        '--block', metavar='STEPS', default=DEFAULT_INDEX_BLOCK, type=int,
+        help='steps between sampled register states')
+    index.add_argument(
+        'trace',
+        help='regdump output (csv or bin)')
+
+    query = subparsers.add_parser(
+        'query', help='query a trace through its index (built when missing or outdated)',
+        description='count PC: executions of PC. steps PC: steps at which PC was executed. '
+                    'first REG VALUE: first step at which REG holds VALUE. '
+                    'changes REG: steps at which REG changed. '
+                    'state STEP: pc, disassembly and registers at STEP. '
+                    'hot [N]: the N most executed pcs. '
+                    'steps are the record numbers (No.) of the trace.')
+    query.add_argument(
+        '--index', '-i', metavar='FILE', default=None,
+        help='index file (default: <trace>.idx)')
+    query.add_argument(
+        '--start', '-s', metavar='STEP', default=1, type=int,
+        help='first, changes: search from this step')
+    query.add_argument(
+        '--stop', metavar='STEP', default=None, type=int,
+        help='changes: search before this step')
+    query.add_argument(
+        '--limit', '-l', metavar='N', default=None, type=int,
+        help='print at most N results')
+    query.add_argument(
+        'trace',
+        help='regdump output (csv or bin)')
+    query.add_argument(
+        'query', metavar='QUERY', choices=QUERIES,
+        help=', '.join(QUERIES))
+    query.add_argument(
+        'operands', metavar='ARG', nargs='*',
+        help='operands of the query')
+    return argparser.parse_args(argv)
+
+
+def open_index(args):
+    path = args.index or args.trace + '.idx'
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(args.trace):
+        build_index(args.trace, path)
+    return TraceIndex(path)
+
+
+def operands(args, count):
+    if len(args.operands) not in count:
+        raise ValueError('{} takes {} operands'.format(
+            args.query, ' or '.join(str(n) for n in count)))
+    return args.operands
+
+
+def query(index, args):
+    # lines of the answer
+    limit = args.limit
+    if args.query == 'count':
+        pc, = operands(args, [1])
+        yield str(index.count(int(pc, 0)))
+    elif args.query == 'steps':
+        pc, = operands(args, [1])
+        for step in index.steps(int(pc, 0), stop=limit):
+            yield str(step)
+    elif args.query == 'first':
+        name, value = operands(args, [2])
+        step = index.first(name, int(value, 0), start=args.start)
+        yield 'None' if step is None else str(step)
+    elif args.query == 'changes':
+        name, = operands(args, [1])
+        for step, value in index.changes(name, start=args.start, stop=args.stop)[:limit]:
+            yield '{},{}'.format(step, hex(value))
+    elif args.query == 'state':
+        step, = operands(args, [1])
+        record = index.state(int(step, 0))
+        yield 'No.,pc,dis,{}'.format(','.join(index.names))
+        yield '{},{},"{}",{}'.format(
+            step, hex(record.pc), record.disasm, ','.join(hex(v) for v in record.regs))
+    elif args.query == 'hot':
+        n = int(operands(args, [0, 1])[0]) if args.operands else (limit or 10)
+        counts = sorted(index.pc_counts(), key=lambda item: -item[1])[:n]
+        yield 'pc,count,dis'
+        for pc, count in counts:
+            yield '{},{},"{}"'.format(hex(pc), count, index.disasm(pc))
+
+
+def main():
+    args = arg_parse()
+    if args.command == 'index':
+        print(build_index(args.trace, args.output, block=args.block))
+        return
+    with open_index(args) as index:
+        for line in query(index, args):
+            print(line)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import re
+
+
+# basic blocks of disassembled code, for tracing with breakpoints at
+# block entries instead of stepping every instruction
+EM_386, EM_X86_64, EM_AARCH64, EM_RISCV = 3, 62, 183, 243
+
+JUMP, BRANCH, CALL, RETURN = 'jump', 'branch', 'call', 'return'
+
+# (kind, mnemonic pattern) per architecture, first match wins
+_X86 = [
+    (JUMP, re.compile(r'l?jmp[lqw]?$')),
+    (BRANCH, re.compile(r'(j\w+|loop\w*)$')),
+    (CALL, re.compile(r'l?call[lqw]?$')),
+    (RETURN, re.compile(r'(l|i)?ret[lqwd]?$')),
+]
+_AARCH64 = [
+    (JUMP, re.compile(r'(b|br|bra\w*)$')),
+    (BRANCH, re.compile(r'(b\.\w+|cbn?z|tbn?z)$')),
+    (CALL, re.compile(r'(bl|blr|blra\w*)$')),
+    (RETURN, re.compile(r'(e?ret\w*)$')),
+]
+_RISCV = [
+    (RETURN, re.compile(r'ret$')),
+    (JUMP, re.compile(r'(c\.)?(j|jr|tail)$')),
+    (BRANCH, re.compile(r'(c\.)?b\w+$')),
+    (CALL, re.compile(r'(c\.)?(jal|jalr|call)$')),
+]
+ARCHS = {
+    EM_386: _X86,
+    EM_X86_64: _X86,
+    EM_AARCH64: _AARCH64,
+    EM_RISCV: _RISCV,
+}
+
+pattern_label = re.compile(r'(?:<[^>]*>:)?\s*')
+pattern_prefix = re.compile(r'(bnd|notrack|rep\w*|lock|data16|addr32|[c-gs]s)\s+')
+pattern_comment = re.compile(r'<|;|//|#\s')
+pattern_target = re.compile(r'(?:^|[\s,])(0x[0-9A-Fa-f]+)\b')
+
+
+def classify(disasm, machine):
+    # (kind, direct target or None) of a control transfer, (None, None) otherwise
+    kinds = ARCHS.get(machine)
+    if kinds is None:
+        raise ValueError('basic blocks are not supported for ELF machine {}'.format(machine))
+    insn = pattern_label.sub('', disasm, count=1)
+    while True:
+        m = pattern_prefix.match(insn)
+        if m is None:
+            break
+        insn = insn[m.end():]
+    parts = insn.split(None, 1)
+    if not parts:
+        return None, None
+    mnemonic = parts[0]
+    operands = parts[1] if len(parts) > 1 else ''
+    for kind, pattern in kinds:
+        if pattern.match(mnemonic):
+            break
+    else:
+        return None, None
+    if kind == RETURN or '*' in operands or '[' in operands:
+        return kind, None
+    # anything after the operands (symbol, comment) is not part of them
+    m = pattern_target.search(pattern_comment.split(operands, 1)[0])
+    return kind, int(m.group(1), 16) if m else None
+
+
+def find_blocks(table, machine):
+    # table: {pc: disasm} of the traced code. Returns the block entries
+    # (direct branch targets and fall-through successors, including targets
+    # outside the table) and the pcs of indirect branches and returns, whose
+    # successor is only known after stepping them.
+    addrs = sorted(table)
+    leaders = set()
+    indirect = set()
+    for i, pc in enumerate(addrs):
+        kind, target = classify(table[pc], machine)
+        if kind is None:
+            continue
+        if kind == CALL:
+            # calls are stepped over, unless they stay in the traced code
+            if target in table:
+                leaders.add(target)
+            continue
+        if target is None:
+            indirect.add(pc)
+        else:
+            leaders.add(target)
+        if i + 1 < len(addrs):
+            leaders.add(addrs[i + 1])
+    return leaders, indirect
@@ -0,0 +1,752 @@
+import json
+import os
+import re
+import select
+import subprocess
+import time
+from typing import Any, Optional
+
+import fcntl
+
+from dbgctrl import agent, elf, memory, stats, stream
+from dbgctrl.register import MASK64, RegisterFile, RegisterLayout
+from dbgctrl.snapshot import Snapshot
+
+
+class Parser():
+    # commands and reply parsing of a debugger. the subclasses (GDBParser,
+    # LLDBParser, GDBMIController) set the command strings and the patterns,
+    # and build the commands whose syntax differs
+    NAME = 'debugger'
+    PROMPT = ''
+    INIT_COMMANDS: tuple = ()
+    START_COMMAND = ''
+    PC_COMMAND = ''
+    PC_VALUE_COMMAND = ''
+    REG_LAYOUT_COMMAND = ''
+    RETURN_ADDRESS_COMMAND = ''
+    STATUS_COMMAND = ''
+    RESET_COMMANDS: tuple = ()
+    DELETE_COMMAND = ''
+    MAPPINGS_COMMAND = ''
+
+    pattern_readonly_command: re.Pattern
+    pattern_exited: re.Pattern
+    pattern_stopped: re.Pattern
+    # the reply of STATUS_COMMAND without a live process
+    pattern_not_running: re.Pattern
+    pattern_watchpoint: re.Pattern
+    pattern_watch_hit: re.Pattern
+    pattern_pc: re.Pattern
+    pattern_reg_category: Optional[re.Pattern] = None
+    pattern_reg_namevalue: re.Pattern
+    pattern_mem_value: re.Pattern
+    pattern_disasm: re.Pattern
+    pattern_pc_value: re.Pattern
+    pattern_disasm_line: re.Pattern
+    pattern_disasm_function: Optional[re.Pattern] = None
+    pattern_return_address: re.Pattern
+    # the reply of MAPPINGS_COMMAND: start, end, perms, name
+    pattern_mapping: re.Pattern
+    pattern_pc_line: re.Pattern
+    pattern_reg_line: re.Pattern
+    pattern_mem_line: re.Pattern
+    # the reply of the agent's page hash command
+    pattern_page_hashes = re.compile(r'dbgctrl_pagehash: ?(.*)')
+
+    def _step_command(self, step, inst):
+        if step == 'in':
+            return 'si' if inst else 's'
+        elif step == 'over':
+            return 'ni' if inst else 'n'
+        return 'finish'
+
+    def _step_count_command(self, step, count):
+        raise NotImplementedError
+
+    def _break_hit_commands(self, addr, hits):
+        # a breakpoint that stops at its `hits`-th hit
+        raise NotImplementedError
+
+    def _watch_command(self, addr, size):
+        raise NotImplementedError
+
+    def _unwatch_command(self, number):
+        raise NotImplementedError
+
+    def _write_reg_command(self, name, value):
+        raise NotImplementedError
+
+    def _write_mem_command(self, addr, value, size):
+        raise NotImplementedError
+
+    def _read_reg_command(self, layout):
+        raise NotImplementedError
+
+    def _read_mem_command(self, addr, size, count):
+        raise NotImplementedError
+
+    def _dump_mem_command(self, path, addr, length):
+        raise NotImplementedError
+
+    def _disasm_range_command(self, start, end=None):
+        # without `end`, the whole function containing `start`
+        raise NotImplementedError
+
+    def _parse_watchpoint(self, response):
+        m = self.pattern_watchpoint.search(response)
+        if m is None:
+            raise Exception('watchpoint not set: {}'.format(response.strip()))
+        return int(m.group(1))
+
+    def _parse_watch_hits(self, response):
+        return [int(m.group(1)) for m in self.pattern_watch_hit.finditer(response)]
+
+    def _parse_read_pc(self, response):
+        for line in response.splitlines():
+            m = self.pattern_pc.match(line)
+            if m:
+                return str2int(m.group(1))
+        return None
+
+    def _parse_reg_layout(self, response):
+        registers = {}
+        category = '-'
+        for line in response.splitlines():
+            if self.pattern_reg_category:
+                m = self.pattern_reg_category.match(line)
+                if m:
+                    category = m.group(1)
+                    continue
+            m = self.pattern_reg_namevalue.match(line)
+            if m:
+                registers[m.group(1)] = category
+        return RegisterLayout(registers.keys(), registers.values())
+
+    def _parse_read_reg(self, response, layout):
+        registers = RegisterFile(layout)
+        index = layout.index
+        values = registers.values
+        for line in response.splitlines():
+            m = self.pattern_reg_namevalue.match(line)
+            if m:
+                i = index.get(m.group(1))
+                if i is not None:
+                    values[i] = str2int(m.group(2)) & MASK64
+        return registers
+
+    def _pc_parser(self):
+        return stream.ValueParser(self.pattern_pc_line)
+
+    def _reg_parser(self, layout):
+        return stream.RegisterParser(self.pattern_reg_line, layout)
+
+    def _mem_parser(self):
+        return stream.WordParser(self.pattern_mem_line)
+
+    def _parse_read_mem(self, response):
+        mems = []
+        for line in response.splitlines():
+            m = self.pattern_mem_value.match(line)
+            if m:
+                mems += [str2int(n) for n in m.group(1).split()]
+        return mems
+
+    def _parse_read_disasm(self, response):
+        for line in response.splitlines():
+            m = self.pattern_disasm.match(line)
+            if m:
+                return m.group(1)
+        return None
+
+    def _parse_disasm_range(self, response):
+        table = {}
+        function = None
+        for line in response.splitlines():
+            if self.pattern_disasm_function:
+                m = self.pattern_disasm_function.match(line)
+                if m:
+                    function = m.group(1)
+                    continue
+            m = self.pattern_disasm_line.match(line)
+            if m:
+                disasm = m.group(2)
+                if function and disasm.startswith('<+'):
+                    # function dumps leave the name out: match the $pc,$pc+1 form
+                    disasm = '<' + function + disasm[1:]
+                table[str2int(m.group(1))] = disasm
+        return table
+
+    def _parse_pc_value(self, response):
+        m = self.pattern_pc_value.match(response)
+        if m:
+            return str2int(m.group(1))
+        return None
+
+    def _snapshot_commands(self, layout, mem, step, cached=False):
+        # with a disassembly table only the pc value is asked for
+        pc_command = self.PC_VALUE_COMMAND if cached else self.PC_COMMAND
+        cmds = [pc_command, self._read_reg_command(layout)]
+        cmds += [self._read_mem_command(*m) for m in mem]
+        if step is not None:
+            cmds.insert(0, step)
+        return cmds
+
+    def _snapshot_parsers(self, layout, mem, step):
+        # registers and memory of _snapshot_commands() are parsed while they arrive
+        parsers = [None, self._reg_parser(layout)] + [self._mem_parser() for _ in mem]
+        if step is not None:
+            parsers.insert(0, None)
+        return parsers
+
+    def _parse_snapshot(self, responses, layout, disasm, step, cache=None, parsed=False):
+        # parsed: registers and memory come from _snapshot_parsers()
+        if step is not None:
+            responses = responses[1:]
+        if cache is None:
+            pc = self._parse_read_pc(responses[0])
+            dis = self._parse_read_disasm(responses[0]) if disasm else None
+        else:
+            pc = self._parse_pc_value(responses[0])
+            dis = cache.get(pc) if disasm else None
+        if parsed:
+            regs, mems = responses[1], list(responses[2:])
+        else:
+            regs = self._parse_read_reg(responses[1], layout)
+            mems = [self._parse_read_mem(r) for r in responses[2:]]
+        return Snapshot(pc, regs, dis, mems)
+
+    def _parse_page_hashes(self, response):
+        return [[None if h == '-' else int(h, 16) for h in m.group(1).split()]
+                for m in self.pattern_page_hashes.finditer(response)]
+
+    def _parse_mappings(self, response):
+        return [memory.Mapping(int(m.group(1), 16), int(m.group(2), 16), m.group(3) or '',
+                               m.group(4).strip())
+                for m in self.pattern_mapping.finditer(response)]
+
+    def _parse_stopped(self, response):
+        if self.pattern_stopped.search(response):
+            return True
+        if self.pattern_exited.search(response) or self.pattern_not_running.search(response):
+            return False
+        return None
+
+    def _parse_return_address(self, response):
+        for line in response.splitlines():
+            m = self.pattern_return_address.search(line)
+            if m:
+                return str2int(m.group(1))
+        raise Exception("return address not found")
+
+
+class Controller(Parser):
+    # a debugger process: the ELF, caches, stats and dump files of one session.
+    # the subclasses send the commands (exec_command, _request) and frame the replies
+    DEFAULT_TIMEOUT = 1.0
+    DEFAULT_TRACE_TIMEOUT = 24 * 60 * 60.0
+    QUIT_TIMEOUT = 1.0
+    LOAD_COMMAND = ''
+    QUIT_COMMAND = ''
+    AGENT_COMMAND = ''
+
+    pattern_trace = re.compile(r'dbgctrl_trace: (\d+) records')
+
+    def __init__(self, dbgpath):
+        self.dbgpath = dbgpath
+        self.elfpath = None
+        self.elf = None
+        self.mem_cache = None
+        self.disasm_cache = {}
+        # set by _spawn()
+        self.stdout: Any = None
+        self._process: Any = None
+        self._agent_loaded = False
+        self._dump_dir = None
+        self._reg_layout = None
+        self._byteorder = 'little'
+        self._stats = None
+
+    def __del__(self):
+        if self._process:
+            self._process.terminate()
+            self._process.wait()
+            self._process.communicate()
+            self._process = None
+        memory.remove_dump_dir(self._dump_dir)
+
+    def check_debugger_exists(self):
+        if os.path.exists(self.dbgpath):
+            return
+        raise Exception('debugger not found: {}'.format(self.dbgpath))
+
+    def _spawn(self, args):
+        self._process = subprocess.Popen(
+            args,
+            shell=False,
+            stdout=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+        )
+        self.stdout = self._process.stdout
+        fcntl.fcntl(self.stdout.fileno(), fcntl.F_SETFL, os.O_NONBLOCK)
+
+    def exec_command(self, cmd, timeout=None):
+        raise NotImplementedError
+
+    def _request(self, cmd, timeout=None):
+        # the reply of cmd in the form the _parse_* methods take
+        raise NotImplementedError
+
+    def _request_batch(self, cmds, timeout=None, parsers=None):
+        # the replies of cmds sent at once; with parsers (from _snapshot_parsers)
+        # those replies come back parsed
+        raise NotImplementedError
+
+    def read_reg_layout(self, timeout=5):
+        raise NotImplementedError
+
+    def enable_stats(self):
+        # per-command latency, bytes read and time per phase, see stats()
+        self._stats = stats.Stats()
+        stats.instrument(self, self._stats)
+        return self._stats
+
+    def disable_stats(self):
+        stats.uninstrument(self)
+        self._stats = None
+
+    def stats(self):
+        return self._stats.report() if self._stats is not None else {}
+
+    def load(self, elfpath, timeout=None):
+        self.elfpath = elfpath
+        self._reg_layout = None
+        if self.elf:
+            self.elf.close()
+        self.elf = elf.open_elf(elfpath)
+        self._byteorder = self.elf.byteorder if self.elf else 'little'
+        if self.mem_cache:
+            self.mem_cache.clear()
+        self.disasm_cache.clear()
+        self._request(self.LOAD_COMMAND.format(elfpath), timeout=timeout)
+
+    def quit(self):
+        try:
+            self._request(self.QUIT_COMMAND, timeout=self.QUIT_TIMEOUT)
+        except (TimeoutError, EOFError):
+            pass
+        print('{} exited.'.format(self.NAME))
+        if self._process:
+            self._process.terminate()
+            self._process.wait()
+            self._process.communicate()
+            self._process = None
+        memory.remove_dump_dir(self._dump_dir)
+        self._dump_dir = None
+        if self.elf:
+            self.elf.close()
+            self.elf = None
+
+    def read_mem_bytes(self, addr, length, dtype=None, timeout=None):
+        # raw bytes as a memoryview over an mmap (or a numpy array of `dtype`)
+        if self.mem_cache:
+            view = memoryview(self.mem_cache.read(addr, length))
+        else:
+            view = self._dump_mem(addr, length, timeout=timeout)
+        return memory.as_dtype(view, dtype)
+
+    def _dump_mem(self, addr, length, timeout=None):
+        if self._dump_dir is None:
+            self._dump_dir = memory.make_dump_dir()
+        path = memory.dump_path(self._dump_dir)
+        response = self.exec_command(self._dump_mem_command(path, addr, length), timeout=timeout)
+        return memory.map_dump(path, length, response=response)
+
+    def enable_mem_cache(self, max_bytes=memory.MemoryCache.DEFAULT_MAX_BYTES,
+                         page_size=memory.MemoryCache.PAGE_SIZE, readonly=()):
+        # opt-in page cache for read_mem/read_mem_bytes, dropped when the target runs
+        self.mem_cache = memory.MemoryCache(
+            self._dump_mem,
+            page_size=page_size, max_bytes=max_bytes)
+        for start, end in readonly:
+            self.mem_cache.add_readonly(start, end)
+        return self.mem_cache
+
+    def disable_mem_cache(self):
+        self.mem_cache = None
+
+    def prefill_disasm(self, start, end=None, timeout=None):
+        # disassemble [start, end) (or the function containing start) at once;
+        # read_disasm() and snapshot() then answer those pcs from the table
+        response = self._request(self._disasm_range_command(start, end), timeout=timeout)
+        table = self._parse_disasm_range(response)
+        self.disasm_cache.update(table)
+        return len(table)
+
+    def read_disasm(self, pc=None, timeout=None):
+        if pc in self.disasm_cache:
+            return self.disasm_cache[pc]
+        if pc is None:
+            response = self._request(self.PC_COMMAND, timeout=timeout)
+            pc = self._parse_read_pc(response)
+            disasm = self._parse_read_disasm(response)
+        else:
+            response = self._request(self._disasm_range_command(pc, pc + 1), timeout=timeout)
+            disasm = self._parse_disasm_range(response).get(pc)
+        if disasm is None:
+            raise Exception("disasm line not found")
+        if pc is not None:
+            self.disasm_cache[pc] = disasm
+        return disasm
+
+    def snapshot(self, regs=None, disasm=True, mem=(), step=None, timeout=None):
+        # read pc, registers, disassembly and memory (after an optional step
+        # command) in a single round trip. pc is None when the target is gone.
+        # disassembly comes from disasm_cache once it is filled; a pc missing
+        # from it costs one more request.
+        layout = self.read_reg_layout(timeout=timeout).subset(regs)
+        cache = self.disasm_cache or None
+        cmds = self._snapshot_commands(layout, mem, step, cached=cache is not None)
+        parsers = self._snapshot_parsers(layout, mem, step)
+        responses = self._request_batch(cmds, timeout=timeout, parsers=parsers)
+        snap = self._parse_snapshot(
+            responses, layout, disasm, step, cache=cache, parsed=parsers is not None)
+        if disasm and snap.disasm is None and snap.pc is not None and cache is not None:
+            snap = snap._replace(disasm=self.read_disasm(timeout=timeout))
+        return snap
+
+    def _load_agent(self):
+        if not self._agent_loaded:
+            self.exec_command(self.AGENT_COMMAND)
+            self._agent_loaded = True
+
+    def trace(self, path, regs, start, end, exit='reach', step='ni', maxcount=1000,
+              disasm=True, timeout=None):
+        # step inside the debugger and write records to `path`,
+        # to be read back with dbgctrl.agent.read_trace()
+        if timeout is None:
+            timeout = self.DEFAULT_TRACE_TIMEOUT
+        self._load_agent()
+        opts = json.dumps(dict(
+            path=path, regs=list(regs), start=start, end=end, exit=exit, step=step,
+            maxcount=maxcount, disasm=disasm))
+        response = self.exec_command(f'{agent.TRACE_COMMAND} {opts}', timeout=timeout)
+        m = self.pattern_trace.search(response)
+        if m is None:
+            raise Exception('trace failed: {}'.format(response.strip()))
+        return int(m.group(1))
+
+    def page_hashes(self, regions, page_size=memory.MemorySnapshot.PAGE_SIZE, timeout=None):
+        # crc32 of every page of every (addr, length) region, computed inside
+        # the debugger; None for an unreadable page
+        self._load_agent()
+        opts = json.dumps(dict(regions=[list(r) for r in regions], page_size=page_size))
+        response = self.exec_command(f'{agent.PAGEHASH_COMMAND} {opts}', timeout=timeout)
+        hashes = self._parse_page_hashes(response)
+        if len(hashes) != len(regions):
+            raise Exception('page hashes failed: {}'.format(response.strip()))
+        return hashes
+
+    def mem_snapshot(self, regions, page_size=memory.MemorySnapshot.PAGE_SIZE):
+        # copies of the regions, re-read by page when its hash changes
+        return memory.MemorySnapshot(
+            self.read_mem_bytes, regions, hashes=self.page_hashes, page_size=page_size)
+
+    def read_mappings(self, timeout=None):
+        # memory.Mappings of the target process ([heap], [stack], files)
+        response = self.exec_command(self.MAPPINGS_COMMAND, timeout=timeout)
+        return self._parse_mappings(response)
+
+    def read_return_address(self, timeout=None):
+        response = self._request(self.RETURN_ADDRESS_COMMAND, timeout=timeout)
+        return self._parse_return_address(response)
+
+    def read_function_range(self, symbol, timeout=None):
+        # [start, end) from the symbol table of the loaded ELF (link-time addresses)
+        if self.elf is None:
+            raise Exception("unknown size of function: {}".format(symbol))
+        return self.elf.function_range(symbol)
+
+
+class TextController(Controller):
+    # a command line debugger (gdb, lldb) whose replies end with its prompt
+    DEFAULT_ROUNDUP_TIME = 0.2
+    DEFAULT_PROMPT_TIMEOUT = 30.0
+    POLL_INTERVAL = 0.01
+    RECV_SIZE = 64 * 1024
+    FRAMINGS = ('prompt', 'roundup')
+    LOAD_COMMAND = 'file {}'
+    QUIT_COMMAND = 'q'
+
+    def __init__(self, dbgpath, framing='prompt'):
+        if framing not in self.FRAMINGS:
+            raise ValueError('unknown framing: {}'.format(framing))
+        super().__init__(dbgpath)
+        self.framing = framing
+        self.prompt = self.PROMPT
+        self.roundup_time = self.DEFAULT_ROUNDUP_TIME
+        self._reader = stream.ReplyReader(self.prompt)
+        self._recv = bytearray(self.RECV_SIZE)
+        # replies of timed-out commands that are still to arrive
+        self._late_replies = 0
+        self.check_debugger_exists()
+        self.open_debugger()
+        for cmd in self.INIT_COMMANDS:
+            self.exec_command(cmd)
+
+    def open_debugger(self):
+        self._spawn(self.dbgpath)
+        if self.framing == 'prompt':
+            # consume the banner up to the first prompt
+            self.get_response()
+        print('{} start up.'.format(self.NAME))
+
+    def exec_command(self, cmd, timeout=None, parser=None):
+        # with a parser (dbgctrl.stream) its result is returned instead of the text
+        if self._stats is not None:
+            start = time.perf_counter()
+        self._invalidate_mem_cache([cmd])
+        self._process.stdin.write(f'{cmd}\n'.encode())
+        self._process.stdin.flush()
+        if parser is None:
+            response = self.get_response(timeout=timeout)
+        elif self.framing == 'prompt':
+            response = self._get_framed_responses(1, timeout=timeout, parsers=[parser])[0]
+        else:
+            response = parser.parse(self.get_response(timeout=timeout))
+        if self._stats is not None:
+            self._stats.add_command([cmd], time.perf_counter() - start)
+        return response
+
+    def exec_batch(self, cmds, timeout=None, parsers=None):
+        if parsers is None:
+            parsers = [None] * len(cmds)
+        if self.framing != 'prompt':
+            # replies can only be told apart by their prompts
+            return [self.exec_command(cmd, timeout=timeout, parser=parser)
+                    for cmd, parser in zip(cmds, parsers)]
+        if self._stats is not None:
+            start = time.perf_counter()
+        self._invalidate_mem_cache(cmds)
+        self._process.stdin.write(''.join([f'{cmd}\n' for cmd in cmds]).encode())
+        self._process.stdin.flush()
+        responses = self._get_framed_responses(len(cmds), timeout=timeout, parsers=parsers)
+        if self._stats is not None:
+            self._stats.add_command(cmds, time.perf_counter() - start)
+        return responses
+
+    def _request(self, cmd, timeout=None):
+        return self.exec_command(cmd, timeout=timeout)
+
+    def _request_batch(self, cmds, timeout=None, parsers=None):
+        return self.exec_batch(cmds, timeout=timeout, parsers=parsers)
+
+    def get_response(self, timeout=None):
+        if self.framing == 'prompt':
+            return self._get_framed_response(timeout=timeout)
+        if timeout is None:
+            timeout = self.DEFAULT_TIMEOUT
+        timeout_time = time.time() + timeout
+        responses: list = []
+        stats = self._stats
+        while True:
+            select_timeout = timeout_time - time.time()
+            if select_timeout <= 0:
+                select_timeout = 0
+            if stats is not None:
+                start = time.perf_counter()
+            rready, wready, xready = select.select(
+                [self._process.stdout.fileno()], [], [],
+                select_timeout
+            )
+            if stats is not None:
+                # waits after the reply has arrived are the roundup tail
+                phase = 'roundup' if responses and not rready else 'select'
+                stats.add_phase(phase, time.perf_counter() - start)
+            res = None
+            if rready:
+                for fileno in rready:
+                    if fileno == self._process.stdout.fileno():
+                        self._process.stdout.flush()
+                        res = self._process.stdout.read()
+                        responses += [res]
+                        if stats is not None and res:
+                            stats.bytes_read += len(res)
+                    else:
+                        raise Exception("Unknown fd: {}".format(fileno))
+            if timeout == 0:
+                break
+            elif res and (self.roundup_time > 0):
+                timeout_time = min(time.time() + self.roundup_time, timeout_time)
+            elif time.time() > timeout_time:
+                break
+        if stats is not None:
+            start = time.perf_counter()
+        response = ''.join([r.decode() for r in responses])
+        if stats is not None:
+            stats.add_phase('decode', time.perf_counter() - start)
+        return response
+
+    def _get_framed_response(self, timeout=None):
+        return self._get_framed_responses(1, timeout=timeout)[0]
+
+    def _get_framed_responses(self, count, timeout=None, parsers=None):
+        # each reply is complete when the debugger prints its prompt again.
+        # replies with a parser (dbgctrl.stream) are parsed while they arrive
+        if timeout is None:
+            timeout = self.DEFAULT_PROMPT_TIMEOUT
+        timeout_time = time.time() + timeout
+        reader = self._reader
+        # the replies of a timed-out batch come first: they are skipped, so the
+        # debugger and this session stay in step
+        late, self._late_replies = self._late_replies, 0
+        reader.start(parsers or [None] * count, late=late)
+        stats = self._stats
+        while not reader.done:
+            select_timeout = timeout_time - time.time()
+            if select_timeout <= 0:
+                if stats is not None:
+                    stats.timeouts += 1
+                self._late_replies = reader.missing()
+                raise TimeoutError('{} not responding: {!r}'.format(
+                    self.NAME, reader.pending()[-200:]))
+            if stats is not None:
+                wait_start = time.perf_counter()
+            rready, wready, xready = select.select(
+                [self._process.stdout.fileno()], [], [],
+                select_timeout
+            )
+            if stats is not None:
+                stats.add_phase('select', time.perf_counter() - wait_start)
+            if not rready:
+                continue
+            # read into the same buffer every time, a large reply arrives in pieces
+            n = self._process.stdout.readinto(self._recv)
+            if n is None:
+                continue
+            if not n:
+                # EOF: the debugger has exited
+                reader.close()
+                break
+            if stats is not None:
+                stats.bytes_read += n
+                parse_start = time.perf_counter()
+            with memoryview(self._recv) as view:
+                reader.feed(view[:n])
+            if stats is not None:
+                stats.add_phase('parse', time.perf_counter() - parse_start)
+        return reader.replies[late:]
+
+    def run_stop_at_start(self, timeout=None):
+        return self.exec_command(self.START_COMMAND, timeout=timeout)
+
+    def wait_until_stopped(self, timeout=None):
+        # True as soon as the target is stopped, False when there is no live process
+        if timeout is None:
+            timeout = self.DEFAULT_PROMPT_TIMEOUT
+        timeout_time = time.time() + timeout
+        while True:
+            remaining = max(timeout_time - time.time(), self.POLL_INTERVAL)
+            response = self.exec_command(self.STATUS_COMMAND, timeout=remaining)
+            stopped = self._parse_stopped(response)
+            if stopped is not None:
+                return stopped
+            if time.time() >= timeout_time:
+                raise TimeoutError('{} target not stopped'.format(self.NAME))
+            time.sleep(self.POLL_INTERVAL)
+
+    def reset(self, timeout=None):
+        # kill the target and drop breakpoints; the ELF and its symbols stay loaded
+        self.exec_batch(list(self.RESET_COMMANDS), timeout=timeout)
+
+    def step_in(self, inst=False, timeout=None):
+        return self.exec_command(self._step_command('in', inst), timeout=timeout)
+
+    def step_over(self, inst=False, timeout=None):
+        return self.exec_command(self._step_command('over', inst), timeout=timeout)
+
+    def step_out(self, inst=False, timeout=None):
+        return self.exec_command(self._step_command('out', inst), timeout=timeout)
+
+    def run_steps(self, step, count, timeout=None):
+        # `count` step commands run inside the debugger, without a round trip each.
+        # a breakpoint would end the run early, so all are deleted first
+        if timeout is None:
+            timeout = self.DEFAULT_TRACE_TIMEOUT
+        self.exec_command(self.DELETE_COMMAND)
+        return self.exec_command(self._step_count_command(step, count), timeout=timeout)
+
+    def run_to_hit(self, addr, hits, timeout=None):
+        # continue until addr is reached for the `hits`-th time, with an ignore
+        # count instead of a stop at every hit. False when the program ended first
+        if timeout is None:
+            timeout = self.DEFAULT_TRACE_TIMEOUT
+        self.exec_batch([self.DELETE_COMMAND] + self._break_hit_commands(addr, hits))
+        self.exec_command('c', timeout=timeout)
+        stopped = self.wait_until_stopped(timeout=timeout)
+        self.exec_command(self.DELETE_COMMAND)
+        return stopped
+
+    def watch(self, addr, size, timeout=None):
+        # a hardware watchpoint on writes of `size` (1, 2, 4 or 8) bytes at addr
+        response = self.exec_command(self._watch_command(addr, size), timeout=timeout)
+        return self._parse_watchpoint(response)
+
+    def unwatch(self, number, timeout=None):
+        self.exec_command(self._unwatch_command(number), timeout=timeout)
+
+    def run_to_watch(self, timeout=None):
+        # continue until the target stops: the numbers of the watchpoints that
+        # fired ([] for a breakpoint), None when the program ended
+        if timeout is None:
+            timeout = self.DEFAULT_TRACE_TIMEOUT
+        response = self.exec_command('c', timeout=timeout)
+        if not self.wait_until_stopped(timeout=timeout):
+            return None
+        hits = self._parse_watch_hits(response)
+        if not hits:
+            hits = self._parse_watch_hits(self.exec_command(self.STATUS_COMMAND))
+        return hits
+
+    def write_reg(self, name, value, timeout=None):
+        self.exec_command(self._write_reg_command(name, value), timeout=timeout)
+
+    def write_mem(self, addr, value, size=8, timeout=None):
+        # an integer of `size` (1, 2, 4 or 8) bytes at addr
+        self.exec_command(self._write_mem_command(addr, value, size), timeout=timeout)
+
+    def read_pc(self, timeout=5):
+        pc = self.exec_command(self.PC_COMMAND, timeout=timeout, parser=self._pc_parser())
+        if pc is None:
+            raise Exception("pc not found")
+        return pc
+
+    def read_reg_layout(self, timeout=5):
+        # the register list is read once per target and reused by every read_reg()
+        if self._reg_layout is None:
+            response = self.exec_command(self.REG_LAYOUT_COMMAND, timeout=timeout)
+            self._reg_layout = self._parse_reg_layout(response)
+        return self._reg_layout
+
+    def read_reg(self, names=None, timeout=5):
+        layout = self.read_reg_layout(timeout=timeout).subset(names)
+        return self.exec_command(
+            self._read_reg_command(layout), timeout=timeout, parser=self._reg_parser(layout))
+
+    def read_mem(self, addr, size=4, count=1, timeout=3):
+        if self.mem_cache and isinstance(addr, int):
+            data = self.mem_cache.read(addr, size * count)
+            return memory.words(data, size, self._byteorder)
+        return self.exec_command(
+            self._read_mem_command(addr, size, count), timeout=timeout, parser=self._mem_parser())
+
+    def _invalidate_mem_cache(self, cmds):
+        if self.mem_cache:
+            if not all(self.pattern_readonly_command.match(cmd) for cmd in cmds):
+                self.mem_cache.invalidate()
+
+
+def str2int(s):
+    return int(s, 16) if s[:2] == '0x' else int(s)
@@ -0,0 +1,271 @@
+import bisect
+import os
+import re
+import signal
+import sys
+import time
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from dbgctrl import elf, memory
+from dbgctrl.native import NativeController
+from dbgctrl.ptrace import ARCHS
+from dbgctrl.snapshot import Snapshot
+
+
+# post-mortem access to an ELF core file without a debugger: the core is
+# mapped, its PT_LOAD segments are indexed by address and its NT_PRSTATUS
+# notes give the registers of every thread. pages the kernel did not dump
+# (the code of the program) are read from the executable given to load().
+# Linux cores of 64-bit programs only
+NT_PRSTATUS, NT_AUXV, NT_FILE = 1, 6, 0x46494c45
+AT_NULL, AT_ENTRY = 0, 9
+# offsets in struct elf_prstatus of 64-bit Linux
+PRSTATUS_CURSIG = 12
+PRSTATUS_PID = 32
+PRSTATUS_REGS = 112
+
+CoreResult = namedtuple('CoreResult', ['path', 'status', 'seconds', 'error', 'value'])
+
+
+class CoreController(NativeController):
+    NAME = 'core'
+
+    pattern_thread = re.compile(r'thread\s+(\d+)$')
+
+    def __init__(self, corepath):
+        self.corepath = corepath
+        self.core = elf.open_elf(corepath)
+        if self.core is None or self.core.type != elf.ET_CORE:
+            raise Exception('not a core file: {}'.format(corepath))
+        if self.core.bits != 64:
+            raise Exception('only cores of 64-bit programs: {}'.format(corepath))
+        archs = [a for a in ARCHS.values() if a.machine == self.core.machine]
+        if not archs:
+            raise Exception('unknown machine of core file: {}'.format(self.core.machine))
+        super().__init__(archs[0])
+        self._byteorder = self.core.byteorder
+        self._thread = 0
+        # (start, end of the dumped bytes, end, file offset) by start address
+        self._segments = sorted(
+            (s.vaddr, s.vaddr + s.filesz, s.vaddr + s.memsz, s.offset)
+            for s in self.core.segments if s.type == elf.PT_LOAD and s.memsz)
+        self._starts = [s[0] for s in self._segments]
+        self._perms = {s.vaddr: s.flags for s in self.core.segments if s.type == elf.PT_LOAD}
+        self._threads = []
+        self._auxv = None
+        self._files = []
+        for note in self.core.notes():
+            if note.name != 'CORE':
+                continue
+            if note.type == NT_PRSTATUS:
+                self._threads.append(note)
+            elif note.type == NT_AUXV:
+                self._auxv = note
+            elif note.type == NT_FILE:
+                self._files = self._read_files(note)
+        if not self._threads:
+            raise Exception('no registers in core file: {}'.format(corepath))
+
+    def _read_files(self, note):
+        # (start, end, name) of the file mappings
+        count, _ = self.core.unpack('QQ', note.offset)
+        ranges = [self.core.unpack('QQQ', note.offset + 16 + 24 * i) for i in range(count)]
+        start = note.offset + 16 + 24 * count
+        with self.core.view(start, note.offset + note.size - start) as view:
+            names = view.tobytes().split(b'\0')
+        return [(s, e, name.decode(errors='replace')) for (s, e, _), name in zip(ranges, names)]
+
+    def load(self, elfpath, timeout=None):
+        # the executable, for the pages missing from the core and for symbols
+        super().load(elfpath, timeout=timeout)
+        self._byteorder = self.core.byteorder
+        self._bias = self._read_bias()
+
+    def _read_bias(self):
+        # shift of a PIE executable: AT_ENTRY of the auxiliary vector against e_entry
+        if self.elf is None or self.elf.type != elf.ET_DYN or self._auxv is None:
+            return 0
+        for i in range(0, self._auxv.size - 15, 16):
+            key, value = self.core.unpack('QQ', self._auxv.offset + i)
+            if key == AT_NULL:
+                break
+            if key == AT_ENTRY:
+                return value - self.elf.entry
+        return 0
+
+    def quit(self):
+        self.close()
+        print('core closed.')
+
+    def close(self):
+        for f in (self.elf, self.core):
+            if f is None:
+                continue
+            try:
+                f.close()
+            except BufferError:
+                # views returned by read_mem_bytes() are still alive
+                pass
+        self.elf = None
+
+    def run_stop_at_start(self, timeout=None):
+        # the state of a core file is fixed: where the program stopped
+        return self._status()
+
+    def wait_until_stopped(self, timeout=None):
+        return True
+
+    def reset(self, timeout=None):
+        self._thread = 0
+
+    def _exec(self, cmd, timeout):
+        # `info program` and `thread N` (1-based, in the order of the core)
+        if cmd == self.STATUS_COMMAND:
+            return self._status()
+        m = self.pattern_thread.match(cmd)
+        if m:
+            i = int(m.group(1)) - 1
+            if not 0 <= i < len(self._threads):
+                raise Exception('Invalid thread ID: {}'.format(m.group(1)))
+            self._thread = i
+            return '[Switching to thread {} (LWP {})]\n'.format(i + 1, self.read_thread_ids()[i])
+        raise Exception('not available for a core file: {}'.format(cmd))
+
+    def _status(self):
+        sig = self.core.unpack('h', self._threads[0].offset + PRSTATUS_CURSIG)[0]
+        try:
+            return 'Program terminated with signal {}, {}.\n'.format(
+                signal.Signals(sig).name, signal.strsignal(sig))
+        except ValueError:
+            return 'Program terminated with signal {}.\n'.format(sig)
+
+    def read_thread_ids(self):
+        # LWP of every thread; the first one received the signal
+        return [self.core.unpack('i', note.offset + PRSTATUS_PID)[0] for note in self._threads]
+
+    def _cannot_run(self, *args, **kwargs):
+        raise Exception('a core file cannot be run')
+
+    step_in = step_over = step_out = run_steps = run_to_hit = _cannot_run
+    watch = unwatch = run_to_watch = trace = _cannot_run
+    write_reg = write_mem = checkpoint = restart = _cannot_run
+    _step = _resume = _run_to = _insert_breakpoints = _remove_breakpoints = _cannot_run
+
+    def _read_words(self):
+        # the register set of the current thread in kernel order
+        note = self._threads[self._thread]
+        size = 8 * len(self.arch.names)
+        words = array('Q')
+        with self.core.view(note.offset + PRSTATUS_REGS, size) as view:
+            words.frombytes(view)
+        if self.core.byteorder != sys.byteorder:
+            words.byteswap()
+        return words
+
+    def read_pc(self, timeout=None):
+        return self._read_words()[self.arch.names.index(self.arch.pc)]
+
+    def _pieces(self, addr, length):
+        # (file, offset, length) pieces of [addr, addr + length): the core, or the
+        # executable for pages the core does not hold
+        pieces = []
+        end = addr + length
+        while addr < end:
+            i = bisect.bisect_right(self._starts, addr) - 1
+            segment = self._segments[i] if i >= 0 and addr < self._segments[i][2] else None
+            if segment is not None and addr < segment[1]:
+                n = min(end, segment[1]) - addr
+                pieces.append((self.core, segment[3] + addr - segment[0], n))
+                addr += n
+                continue
+            piece = self._exec_piece(addr, min(end, segment[2]) if segment else end)
+            if piece is None:
+                raise Exception('Cannot access memory at address {}'.format(hex(addr)))
+            pieces.append(piece)
+            addr += piece[2]
+        return pieces
+
+    def _exec_piece(self, addr, end):
+        if self.elf is None:
+            return None
+        link = addr - self._bias
+        for s in self.elf.segments:
+            if s.type == elf.PT_LOAD and s.vaddr <= link < s.vaddr + s.filesz:
+                return (self.elf, s.offset + link - s.vaddr,
+                        min(end - addr, s.vaddr + s.filesz - link))
+        return None
+
+    def _read_bytes(self, addr, length, timeout=None):
+        data = bytearray()
+        for f, offset, n in self._pieces(addr, length):
+            with f.view(offset, n) as view:
+                data += view
+        return data
+
+    def read_mem_bytes(self, addr, length, dtype=None, timeout=None):
+        # a view of the mapped file when the range is in one piece, else a copy.
+        # (or a numpy array of `dtype`)
+        pieces = self._pieces(addr, length)
+        if len(pieces) == 1:
+            f, offset, n = pieces[0]
+            view = f.view(offset, n)
+        else:
+            view = memoryview(self._read_bytes(addr, length))
+        return memory.as_dtype(view, dtype)
+
+    def read_mappings(self, timeout=None):
+        # the PT_LOAD segments, named after the files of the NT_FILE note
+        mappings = []
+        for start, _, end, _ in self._segments:
+            flags = self._perms[start]
+            perms = ''.join(c if flags & bit else '-' for c, bit in (
+                ('r', elf.PF_R), ('w', elf.PF_W), ('x', elf.PF_X))) + 'p'
+            name = ''
+            for s, e, path in self._files:
+                if s <= start < e:
+                    name = path
+                    break
+            mappings.append(memory.Mapping(start, end, perms, name))
+        return mappings
+
+    def snapshot(self, regs=None, disasm=True, mem=(), step=None, timeout=None):
+        if step is not None:
+            self._cannot_run()
+        layout = self.read_reg_layout().subset(regs)
+        words = self._read_words()
+        pc = words[self.arch.names.index(self.arch.pc)]
+        mems = [self.read_mem(addr, size=size, count=count) for addr, size, count in mem]
+        dis = self.read_disasm(pc) if disasm else None
+        return Snapshot(pc, self._parse_regs(words, layout), dis, mems)
+
+
+def _core_job(args):
+    # one core in a worker process: func(controller), as a CoreResult
+    func, corepath, elfpath = args
+    start = time.monotonic()
+    dbg = None
+    try:
+        dbg = CoreController(corepath)
+        if elfpath:
+            dbg.load(elfpath)
+        value = func(dbg)
+    except Exception as e:
+        return CoreResult(corepath, 'error', time.monotonic() - start,
+                          '{}: {}'.format(type(e).__name__, e), None)
+    finally:
+        if dbg is not None:
+            dbg.close()
+    return CoreResult(corepath, 'ok', time.monotonic() - start, '', value)
+
+
+def map_cores(func, corepaths, elfpath=None, workers=None):
+    # func(CoreController) for every core file in a pool of `workers` processes.
+    # func and its return value must be picklable (e.g. a module-level function).
+    # CoreResults in the order of corepaths; a failing core does not stop the others
+    workers = workers or os.cpu_count() or 1
+    jobs = [(func, path, elfpath) for path in corepaths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        return list(pool.map(_core_job, jobs, chunksize=chunksize))
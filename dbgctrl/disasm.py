@@ -0,0 +1,47 @@
+import re
+import subprocess
+from collections import namedtuple
+
+
+# disassembly without a debugger: one objdump run over a range of an ELF
+# file, for the controllers that do not drive gdb or lldb
+OBJDUMP = 'objdump'
+
+Insn = namedtuple('Insn', ['size', 'text'])
+
+pattern_symbol = re.compile(r'^[0-9A-Fa-f]+ <(.+)>:$')
+pattern_insn = re.compile(r'^ *([0-9A-Fa-f]+):\t([0-9A-Fa-f ]+)\t(.+)$')
+# direct branch targets, `call   1129 <g>`
+pattern_target = re.compile(r'(?<=\s)([0-9A-Fa-f]+)( <[^>]+>)$')
+
+
+def objdump(path, start, end, bias=0, objdump=OBJDUMP):
+    # {addr: Insn(size, '<symbol+offset>:\tinstruction')} of the link-time
+    # range [start, end), keyed by run-time address (+ bias). Empty when
+    # objdump is missing or does not know the architecture
+    try:
+        out = subprocess.run(
+            [objdump, '-d', '-w', '--insn-width=16',
+             '--start-address={}'.format(hex(start)), '--stop-address={}'.format(hex(end)),
+             path],
+            capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    table = {}
+    symbol, base = '??', start
+    for line in out.splitlines():
+        m = pattern_insn.match(line)
+        if m:
+            addr = int(m.group(1), 16)
+            size = len(m.group(2).replace(' ', '')) // 2
+            # targets are written like gdb does, `call   0x401129 <g>`, at run-time addresses
+            insn = pattern_target.sub(
+                lambda t: '{}{}'.format(hex(int(t.group(1), 16) + bias), t.group(2)),
+                m.group(3).strip())
+            text = '<{}+{}>:\t{}'.format(symbol, addr - base, insn)
+            table[addr + bias] = Insn(size, text)
+            continue
+        m = pattern_symbol.match(line)
+        if m:
+            symbol, base = m.group(1), int(line.split(' ', 1)[0], 16)
+    return table
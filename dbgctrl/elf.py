@@ -0,0 +1,228 @@
+import bisect
+import mmap
+import struct
+from collections import namedtuple
+from typing import Any
+
+
+# section and symbol tables of an ELF file, read without the debugger
+ElfSection = namedtuple('ElfSection', ['name', 'type', 'flags', 'addr', 'offset', 'size'])
+ElfSymbol = namedtuple('ElfSymbol', ['name', 'value', 'size', 'type', 'bind', 'section'])
+ElfSegment = namedtuple('ElfSegment', ['type', 'flags', 'offset', 'vaddr', 'filesz', 'memsz'])
+ElfNote = namedtuple('ElfNote', ['name', 'type', 'offset', 'size'])
+
+ET_EXEC, ET_DYN, ET_CORE = 2, 3, 4
+PT_LOAD, PT_NOTE = 1, 4
+PF_X, PF_W, PF_R = 0x1, 0x2, 0x4
+EM_ARM = 40
+SHT_SYMTAB, SHT_DYNSYM = 2, 11
+SHF_WRITE, SHF_ALLOC, SHF_EXECINSTR = 0x1, 0x2, 0x4
+STT_OBJECT, STT_FUNC, STT_GNU_IFUNC = 1, 2, 10
+SHN_UNDEF, SHN_LORESERVE, SHN_XINDEX = 0, 0xff00, 0xffff
+PAGE_SIZE = 0x1000
+
+# (header after e_ident, section header, symbol, program header) per ELF class
+_FORMATS = {
+    1: ('HHIIIIIHHHHHH', 'IIIIIIIIII', 'IIIBBH', 'IIIIIIII'),
+    2: ('HHIQQQIHHHHHH', 'IIQQQQIIQQ', 'IBBHQQ', 'IIQQQQQQ'),
+}
+
+
+class ElfFile():
+    # sections are read when the file is opened, symbols on the first lookup
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self._map
+        if buf[:4] != b'\x7fELF' or buf[4] not in _FORMATS or buf[5] not in (1, 2):
+            self._map.close()
+            raise ValueError('not an ELF file: {}'.format(path))
+        self.bits = 32 if buf[4] == 1 else 64
+        self.byteorder = 'little' if buf[5] == 1 else 'big'
+        endian = '<' if buf[5] == 1 else '>'
+        header, shdr, sym, phdr = _FORMATS[buf[4]]
+        (self.type, self.machine, _, self.entry, phoff, shoff, _, _, phentsize, phnum,
+         shentsize, shnum, shstrndx) = struct.unpack_from(endian + header, buf, 16)
+        self._headers = []
+        self._shdr = struct.Struct(endian + shdr)
+        self._sym = struct.Struct(endian + sym)
+        self._endian = endian
+        self.sections = self._read_sections(shoff, shentsize, shnum, shstrndx)
+        self.segments = self._read_segments(struct.Struct(endian + phdr), phoff, phentsize, phnum)
+        self._section_index = {s.name: s for s in reversed(self.sections)}
+        # name -> ElfSymbol, read by _load_symbols() on first use
+        self._symbols: Any = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def _cstring(self, offset):
+        end = self._map.find(b'\0', offset)
+        return self._map[offset:end].decode(errors='replace')
+
+    def _read_sections(self, shoff, shentsize, shnum, shstrndx):
+        if shoff == 0:
+            return []
+        headers = []
+        first = self._shdr.unpack_from(self._map, shoff)
+        # huge section counts and string table indexes live in section 0
+        if shnum == 0:
+            shnum = first[5]
+        if shstrndx == SHN_XINDEX:
+            shstrndx = first[6]
+        for i in range(shnum):
+            headers.append(self._shdr.unpack_from(self._map, shoff + i * shentsize))
+        self._headers = headers
+        strtab = headers[shstrndx][4] if shstrndx < len(headers) else None
+        sections = []
+        for name, tp, flags, addr, offset, size, link, info, align, entsize in headers:
+            name = self._cstring(strtab + name) if strtab is not None else ''
+            sections.append(ElfSection(name, tp, flags, addr, offset, size))
+        return sections
+
+    def _read_segments(self, phdr, phoff, phentsize, phnum):
+        segments = []
+        for i in range(phnum if phoff else 0):
+            entry = phdr.unpack_from(self._map, phoff + i * phentsize)
+            if self.bits == 64:
+                tp, flags, offset, vaddr, _, filesz, memsz, _ = entry
+            else:
+                tp, offset, vaddr, _, filesz, memsz, flags, _ = entry
+            segments.append(ElfSegment(tp, flags, offset, vaddr, filesz, memsz))
+        return segments
+
+    def _read_symbols(self):
+        symbols = []
+        # .symtab before .dynsym: its entries win when a name is in both
+        tables = [h for h in self._headers if h[1] == SHT_SYMTAB] + \
+            [h for h in self._headers if h[1] == SHT_DYNSYM]
+        for _, _, _, _, offset, size, link, _, _, entsize in tables:
+            if entsize == 0:
+                continue
+            strtab = self._headers[link][4]
+            view = memoryview(self._map)[offset:offset + size - size % entsize]
+            for entry in self._sym.iter_unpack(view):
+                if self.bits == 64:
+                    name, info, _, shndx, value, symsize = entry
+                else:
+                    name, value, symsize, info, _, shndx = entry
+                if name == 0 or shndx == SHN_UNDEF:
+                    continue
+                symtype = info & 0xf
+                if self.machine == EM_ARM and symtype == STT_FUNC:
+                    # thumb functions have the low bit set
+                    value &= ~1
+                section = self.sections[shndx].name if shndx < SHN_LORESERVE else None
+                symbols.append(ElfSymbol(
+                    self._cstring(strtab + name), value, symsize, symtype, info >> 4, section))
+            view.release()
+        return symbols
+
+    def _load_symbols(self):
+        if self._symbols is not None:
+            return
+        symbols = self._read_symbols()
+        self._symbols = {}
+        for symbol in symbols:
+            self._symbols.setdefault(symbol.name, symbol)
+        located: dict = {}
+        for symbol in symbols:
+            if symbol.type not in (STT_OBJECT, STT_FUNC, STT_GNU_IFUNC):
+                continue
+            # aliases share an address: keep the widest one
+            other = located.get(symbol.value)
+            if other is None or symbol.size > other.size:
+                located[symbol.value] = symbol
+        self._sorted = sorted(located.values(), key=lambda s: s.value)
+        self._addrs = [s.value for s in self._sorted]
+
+    def notes(self):
+        # ElfNotes of the PT_NOTE segments; offset and size locate the descriptor
+        notes = []
+        header = struct.Struct(self._endian + 'III')
+        for segment in self.segments:
+            if segment.type != PT_NOTE:
+                continue
+            pos, end = segment.offset, segment.offset + segment.filesz
+            while pos + header.size <= end:
+                namesz, descsz, tp = header.unpack_from(self._map, pos)
+                pos += header.size
+                name = self._map[pos:pos + namesz].rstrip(b'\0').decode(errors='replace')
+                pos += -(-namesz // 4) * 4
+                notes.append(ElfNote(name, tp, pos, descsz))
+                pos += -(-descsz // 4) * 4
+        return notes
+
+    def unpack(self, fmt, offset):
+        # struct fields in the byte order of the file
+        return struct.unpack_from(self._endian + fmt, self._map, offset)
+
+    def view(self, offset, size):
+        # bytes of the file without a copy; release the view before close()
+        return memoryview(self._map)[offset:offset + size]
+
+    def section(self, name):
+        return self._section_index.get(name)
+
+    def section_at(self, addr):
+        for section in self.sections:
+            if section.flags & SHF_ALLOC and section.addr <= addr < section.addr + section.size:
+                return section
+        return None
+
+    def readonly_ranges(self):
+        # loaded sections that cannot change at run time (e.g. for MemoryCache)
+        return [(s.addr, s.addr + s.size) for s in self.sections
+                if s.flags & SHF_ALLOC and not s.flags & SHF_WRITE and s.size]
+
+    def writable_ranges(self):
+        # loaded sections the program can write (.data, .bss, ...)
+        return [(s.addr, s.addr + s.size) for s in self.sections
+                if s.flags & SHF_ALLOC and s.flags & SHF_WRITE and s.size]
+
+    def symbol(self, name):
+        self._load_symbols()
+        return self._symbols.get(name)
+
+    def symbol_at(self, addr):
+        # (symbol, offset) of the function or object containing addr, or None
+        self._load_symbols()
+        i = bisect.bisect_right(self._addrs, addr) - 1
+        if i < 0:
+            return None
+        symbol = self._sorted[i]
+        offset = addr - symbol.value
+        if offset < symbol.size or offset == 0:
+            return symbol, offset
+        return None
+
+    def load_bias(self, addr, runtime_addr):
+        # shift of a PIE executable, from a runtime address less than a page
+        # after the link-time address `addr` (e.g. a breakpoint past a prologue)
+        if self.type != ET_DYN:
+            return 0
+        offset = runtime_addr - addr
+        return offset - offset % PAGE_SIZE
+
+    def function_range(self, name):
+        symbol = self.symbol(name)
+        if symbol is None or symbol.type not in (STT_FUNC, STT_GNU_IFUNC):
+            raise Exception('function not found: {}'.format(name))
+        if symbol.size == 0:
+            raise Exception('unknown size of function: {}'.format(name))
+        return (symbol.value, symbol.value + symbol.size)
+
+
+def open_elf(path):
+    # None when the file cannot be read or is not an ELF file
+    try:
+        return ElfFile(path)
+    except (OSError, ValueError, TypeError, struct.error):
+        return None
@@ -1,158 +1,88 @@
-import os
 import re
-import select
-import subprocess
-import time
-
-import fcntl
-
-
-class GDBController():
-    DEFAULT_TIMEOUT = 1.0
-    DEFAULT_ROUNDUP_TIME = 0.2
 
+from dbgctrl import agent
+from dbgctrl.controller import Controller, Parser, TextController
+
+
+class GDBParser(Parser):
+    # gdb commands and reply patterns, shared by GDBController and AsyncGDBController.
+    # GDBMIController runs the console commands among them
+    NAME = 'gdb'
+    PROMPT = '(gdb) '
+    INIT_COMMANDS = ('set confirm 0', 'set pagination 0')
+    START_COMMAND = 'starti'
+    PC_COMMAND = 'disassemble $pc,$pc+1'
+    PC_VALUE_COMMAND = 'output/x $pc'
+    REG_LAYOUT_COMMAND = 'info all-registers'
+    RETURN_ADDRESS_COMMAND = 'bt'
+    STATUS_COMMAND = 'info program'
+    RESET_COMMANDS = ('kill', 'delete')
+    DELETE_COMMAND = 'delete'
+    MAPPINGS_COMMAND = 'info proc mappings'
+    # types of the watched (or written) expression by size, one debug register each
+    WATCH_TYPES = {1: 'unsigned char', 2: 'unsigned short', 4: 'unsigned int',
+                   8: 'unsigned long long'}
+
+    # commands that neither resume the target nor write its memory
+    pattern_readonly_command = re.compile(
+        r'\s*(disassemble|info|x(/\S*)?|output(/\S*)?|bt|backtrace|where|dump|show|echo|list|help'
+        r'|b|break|tbreak|hbreak|watch|delete|disable|enable|frame|up|down)(\s|$)')
+    # start, end, size, offset, [perms (gdb 12)], objfile
+    pattern_mapping = re.compile(
+        r'^\s*(0x[0-9A-Fa-f]+)\s+(0x[0-9A-Fa-f]+)\s+0x[0-9A-Fa-f]+\s+0x[0-9A-Fa-f]+'
+        r'(?:[ \t]+([r-][w-][x-][ps-]))?(.*)$', re.M)
     pattern_exited = re.compile(r'.+ exited with')
     pattern_invalid = re.compile(r'error: invalid process')
+    pattern_stopped = re.compile(r'(Program|It) stopped')
+    pattern_not_running = re.compile(r'not being run')
+    pattern_watchpoint = re.compile(r'(?:Hardware w|W)atchpoint (\d+): ')
+    # a watchpoint hit, in the reply of `c` or (numbered as a breakpoint) `info program`
+    pattern_watch_hit = re.compile(r'(?:Hardware watchpoint|It stopped at breakpoint) (\d+)')
     pattern_pc = re.compile(r'=\> +([0-9A-Fa-fx]+)')
     # pattern_reg_category = re.compile(r'^(.+): *$')
     pattern_reg_namevalue = re.compile(r'\s*([^ ]+)\s+([0-9A-Fa-fx]+)\s*+')
     pattern_mem_value = re.compile(r'[0-9A-Fa-fx]+[^:]*:\s+((?:[0-9A-Fa-fx]+\s*)+)')
     pattern_disasm = re.compile(r'=\> +(?:[0-9A-Fa-fx]+)(?:\s)+(.+)')
+    pattern_pc_value = re.compile(r'\s*(0x[0-9A-Fa-f]+)')
+    pattern_disasm_line = re.compile(r'(?:=\>)? +(0x[0-9A-Fa-f]+)(?:\s)+(.+)')
+    pattern_disasm_function = re.compile(r'Dump of assembler code for function (\S+):')
+    pattern_return_address = re.compile(r'#1 +([0-9A-Fa-fx]+)')
     # pattern_func_range = re.compile(r'range = \[([0-9A-Fa-fx]+)-([0-9A-Fa-fx]+)\)')
+    # the same, on the bytes of a reply while it arrives
+    pattern_pc_line = re.compile(rb'^=> +([0-9A-Fa-fx]+)', re.M)
+    pattern_reg_line = re.compile(rb'^[ \t]*([^ \t\n]+)[ \t]+([0-9A-Fa-fx]+)', re.M)
+    pattern_mem_line = re.compile(
+        rb'^[0-9A-Fa-fx]+[^:\n]*:[ \t]+((?:[0-9A-Fa-fx]+[ \t]*)+)', re.M)
 
-    def __init__(self, dbgpath):
-        self.dbgpath = dbgpath
-        self.elfpath = None
-        self._process = None
-        self._stdout = None
-        self.roundup_time = GDBController.DEFAULT_ROUNDUP_TIME
-        self.check_debugger_exists()
-        self.open_debugger()
-        self.exec_command('set confirm 0')
-        self.exec_command('set pagination 0')
-
-    def __del__(self):
-        if self._process:
-            self._process.terminate()
-            self._process.wait()
-            self._process.communicate()
-            self._process = None
-
-    def check_debugger_exists(self):
-        if os.path.exists(self.dbgpath):
-            return
-        raise Exception('debugger not found: {}'.format(self.dbgpath))
-
-    def open_debugger(self):
-        self._process = subprocess.Popen(
-            self.dbgpath,
-            shell=False,
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            bufsize=0,
-        )
-        self.stdout = self._process.stdout
-        # self.stderr = self._process.stderr
-        fcntl.fcntl(self.stdout.fileno(), fcntl.F_SETFL, os.O_NONBLOCK)
-        # fcntl.fcntl(self.stderr.fileno(), fcntl.F_SETFL, os.O_NONBLOCK)
-        print('gdb start up.')
-
-    def exec_command(self, cmd, timeout=None):
-        self._process.stdin.write(f'{cmd}\n'.encode())
-        self._process.stdin.flush()
-        return self.get_response(timeout=timeout)
-
-    def load(self, elfpath, timeout=None):
-        self.elfpath = elfpath
-        self.exec_command(f'file {elfpath}', timeout=timeout)
-
-    def quit(self):
-        self.exec_command('q')
-        print('gdb exited.')
-        if self._process:
-            self._process.terminate()
-            self._process.wait()
-            self._process.communicate()
-            self._process = None
-
-    def get_response(self, timeout=None):
-        if timeout is None:
-            timeout = GDBController.DEFAULT_TIMEOUT
-        timeout_time = time.time() + timeout
-        responses = []
-        while True:
-            select_timeout = timeout_time - time.time()
-            if select_timeout <= 0:
-                select_timeout = 0
-            rready, wready, xready = select.select(
-                [self._process.stdout.fileno()], [], [],
-                select_timeout
-            )
-            res = None
-            if rready:
-                for fileno in rready:
-                    if fileno == self._process.stdout.fileno():
-                        self._process.stdout.flush()
-                        res = self._process.stdout.read()
-                        responses += [res]
-                    else:
-                        raise Exception("Unknown fd: {}".format(fileno))
-            if timeout == 0:
-                break
-            elif res and (self.roundup_time > 0):
-                timeout_time = min(time.time() + self.roundup_time, timeout_time)
-            elif time.time() > timeout_time:
-                break
-        response = ''.join([r.decode() for r in responses])
-        return response
+    def _step_count_command(self, step, count):
+        return f'{step} {count}'
 
-    def run_stop_at_start(self, timeout=None):
-        return self.exec_command('starti', timeout=timeout)
-
-    def step_in(self, inst=False, timeout=None):
-        cmd = 'si'if inst else 's'
-        return self.exec_command(cmd, timeout=timeout)
-
-    def step_over(self, inst=False, timeout=None):
-        cmd = 'ni'if inst else 'n'
-        return self.exec_command(cmd, timeout=timeout)
-
-    def step_out(self, inst=False, timeout=None):
-        return self.exec_command('finish', timeout=timeout)
-
-    def read_pc(self, timeout=5):
-        response = self.exec_command('disassemble $pc,$pc+1', timeout=timeout)
-        for line in response.splitlines():
-            m = self.pattern_pc.match(line)
-            if m:
-                return str2int(m.group(1))
-        raise Exception("pc not found")
-
-    def read_reg(self, names=None, timeout=5):
-        response = self.exec_command('info all-registers', timeout=timeout)
-        regs = self._parse_read_reg(response)
-        if names is not None:
-            regs = {k: v for k, v in regs.items() if k in names}
-        return regs
-
-    def _parse_read_reg(self, response):
-        registers = {}
-        category = '-'
-        for line in response.splitlines():
-            # m = self.pattern_reg_category.match(line)
-            # if m:
-            #     category = m.group(1)
-            #     continue
-            m = self.pattern_reg_namevalue.match(line)
-            if m:
-                regname = m.group(1)
-                value = str2int(m.group(2))
-                registers[regname] = {'category': category, 'value': value}
-        return registers
-
-    def read_mem(self, addr, size=4, count=1, timeout=3):
-        if type(addr) == int:
+    def _break_hit_commands(self, addr, hits):
+        # a breakpoint that stops at its `hits`-th hit
+        return [f'b *{hex(addr)}', f'ignore $bpnum {hits - 1}']
+
+    def _watch_command(self, addr, size):
+        # -location: the address is watched, not the expression
+        if size not in self.WATCH_TYPES:
+            raise ValueError('unsupported watch size: {}'.format(size))
+        return f'watch -l *({self.WATCH_TYPES[size]} *){hex(addr)}'
+
+    def _unwatch_command(self, number):
+        return f'delete {number}'
+
+    def _write_reg_command(self, name, value):
+        return f'set var ${name} = {hex(value)}'
+
+    def _write_mem_command(self, addr, value, size):
+        if size not in self.WATCH_TYPES:
+            raise ValueError('unsupported write size: {}'.format(size))
+        return f'set var *({self.WATCH_TYPES[size]} *){hex(addr)} = {hex(value)}'
+
+    def _read_reg_command(self, layout):
+        return 'info registers ' + ' '.join(layout.names)
+
+    def _read_mem_command(self, addr, size, count):
+        if isinstance(addr, int):
             addr = hex(addr)
         if size == 1:
             fmt = 'b'
@@ -160,44 +90,74 @@ class GDBController():
             fmt = 'h'
         elif size == 4:
             fmt = 'w'
-        else:
+        elif size == 8:
             fmt = 'g'
-        response = self.exec_command(f'x/{count}x{fmt} {addr}', timeout=timeout)
-        mems = []
-        for line in response.splitlines():
-            m = self.pattern_mem_value.match(line)
-            if m:
-                nums = m.group(1).split()
-                mems += [str2int(m) for m in nums[:]]
-        return mems
-
-    def read_disasm(self, timeout=None):
-        response = self.exec_command('disassemble $pc,$pc+1', timeout=timeout)
-        for line in response.splitlines():
-            m = self.pattern_disasm.match(line)
-            if m:
-                return m.group(1)
-        raise Exception("disasm line not found")
-
-    def read_return_address(self, timeout=None):
-        response = self.exec_command('bt', timeout=timeout)
-        for line in response.splitlines():
-            m = re.search(r'#1 +([0-9A-Fa-fx]+)', line)
-            if m:
-                retaddr = int(m.group(1)[2:], 16)
-                return retaddr
-        raise Exception("return address not found")
-
-    def read_function_range(self, symbol, timeout=None):
-        # response = self.exec_command('info functions ^{}$'.format(symbol), timeout=timeout)
-        # for line in response.splitlines():
-        #     m = self.pattern_func_range.match(line)
-        #     if m:
-        #         start = int(m.group(1)[2:], 16)
-        #         end = int(m.group(2)[2:], 16)
-        #         return (start, end)
-        raise Exception("unknown size of function: {}".format(symbol))
-
-
-def str2int(s):
-    return int(s, 16) if s[:2] == '0x' else int(s)
+        else:
+            raise ValueError('unsupported word size: {} (use read_mem_bytes)'.format(size))
+        return f'x/{count}x{fmt} {addr}'
+
+    def _dump_mem_command(self, path, addr, length):
+        return f'dump binary memory {path} {hex(addr)} {hex(addr + length)}'
+
+    def _disasm_range_command(self, start, end=None):
+        # without `end`, the whole function containing `start`
+        if end is None:
+            return f'disassemble {hex(start)}'
+        return f'disassemble {hex(start)},{hex(end)}'
+
+
+class GDBCheckpoints(Controller):
+    # gdb checkpoints, shared by GDBController and GDBMIController. both run
+    # these console commands through exec_command
+    CHECKPOINT_COMMAND = 'checkpoint'
+
+    pattern_checkpoint = re.compile(r'[Cc]heckpoint (\d+): fork returned pid (\d+)')
+
+    def _reset_checkpoints(self):
+        # checkpoint id -> gdb checkpoint number, and the number of the running fork
+        self._checkpoints = {}
+        self._fork = 0
+
+    def _restart_command(self, number):
+        return f'restart {number}'
+
+    def _delete_checkpoint_command(self, number):
+        return f'delete checkpoint {number}'
+
+    def _checkpoint(self, timeout=None):
+        response = self.exec_command(self.CHECKPOINT_COMMAND, timeout=timeout)
+        m = self.pattern_checkpoint.search(response)
+        if m is None:
+            raise Exception('checkpoint not taken: {}'.format(response.strip()))
+        return int(m.group(1))
+
+    def checkpoint(self, timeout=None):
+        # a fork of the stopped target (linux only), returned to by restart()
+        checkpoint = len(self._checkpoints) + 1
+        self._checkpoints[checkpoint] = self._checkpoint(timeout=timeout)
+        return checkpoint
+
+    def restart(self, checkpoint, timeout=None):
+        # switch to the fork of `checkpoint`. it runs from now on, so it is forked
+        # again to keep the checkpoint, and the fork left behind is deleted
+        number = self._checkpoints[checkpoint]
+        self.exec_command(self._restart_command(number), timeout=timeout)
+        left, self._fork = self._fork, number
+        if left not in self._checkpoints.values():
+            self.exec_command(self._delete_checkpoint_command(left), timeout=timeout)
+        self._checkpoints[checkpoint] = self._checkpoint(timeout=timeout)
+        # the other fork's memory
+        if self.mem_cache:
+            self.mem_cache.invalidate()
+
+
+class GDBController(GDBCheckpoints, GDBParser, TextController):
+    AGENT_COMMAND = 'source {}'.format(agent.GDB_AGENT)
+
+    def __init__(self, dbgpath, framing='prompt'):
+        self._reset_checkpoints()
+        super().__init__(dbgpath, framing=framing)
+
+    def run_stop_at_start(self, timeout=None):
+        self._reset_checkpoints()
+        return super().run_stop_at_start(timeout=timeout)
@@ -0,0 +1,493 @@
+import codecs
+import re
+import select
+import time
+from collections import deque, namedtuple
+from typing import Any
+
+from dbgctrl import memory
+from dbgctrl.controller import Controller, str2int
+from dbgctrl.gdb import GDBCheckpoints, GDBController, GDBParser
+from dbgctrl.register import MASK64, RegisterFile, RegisterLayout
+
+
+MIRecord = namedtuple('MIRecord', ['token', 'type', 'klass', 'results', 'output'])
+
+
+class GDBMIController(GDBCheckpoints, GDBParser, Controller):
+    # console commands (dumps, writes, step counts, checkpoints) are built by
+    # GDBParser and run through -interpreter-exec
+    NAME = 'gdb/mi'
+    DEFAULT_TIMEOUT = 30.0
+    MAX_NOTIFICATIONS = 256
+    STEP_COMMANDS = {
+        's': '-exec-step',
+        'si': '-exec-step-instruction',
+        'n': '-exec-next',
+        'ni': '-exec-next-instruction',
+        'finish': '-exec-finish',
+    }
+    PC_COMMAND = '-data-disassemble -s $pc -e "$pc + 1" -- 0'
+    PC_VALUE_COMMAND = '-data-evaluate-expression $pc'
+    RETURN_ADDRESS_COMMAND = '-stack-list-frames 1 1'
+    LOAD_COMMAND = '-file-exec-and-symbols {}'
+    QUIT_COMMAND = '-gdb-exit'
+    AGENT_COMMAND = GDBController.AGENT_COMMAND
+
+    pattern_record = re.compile(r'(\d*)([\^*+=])([\w-]+)')
+    pattern_cstring = re.compile(r'"((?:[^"\\]|\\.)*)"')
+    pattern_hex = re.compile(r'0x[0-9A-Fa-f]+')
+
+    def __init__(self, dbgpath):
+        super().__init__(dbgpath)
+        self._sent = {}
+        self._buffer = b''
+        self._token = 0
+        self._results = {}
+        # the tokens still waited for; the replies of abandoned ones are dropped
+        self._pending = set()
+        self._streams = []
+        self._stop_count = 0
+        # set by read_reg_layout()
+        self._regnames: Any = None
+        self._regnumbers: Any = None
+        self.stop_record = None
+        self._running = False
+        self._live = False
+        self._reset_checkpoints()
+        self._stop_records: deque = deque(maxlen=GDBMIController.MAX_NOTIFICATIONS)
+        self.notifications: deque = deque(maxlen=GDBMIController.MAX_NOTIFICATIONS)
+        self.check_debugger_exists()
+        self.open_debugger()
+        self.command('-gdb-set confirm off')
+        self.command('-gdb-set pagination off')
+
+    def open_debugger(self):
+        self._spawn([self.dbgpath, '--interpreter=mi3', '-q'])
+        # the first command is answered only after the startup output
+        self.command('-gdb-version')
+        print('gdb/mi start up.')
+
+    def send(self, cmd):
+        self._token += 1
+        token = self._token
+        self._pending.add(token)
+        self._process.stdin.write(f'{token}{cmd}\n'.encode())
+        self._process.stdin.flush()
+        if self._stats is not None:
+            self._sent[token] = (cmd, time.perf_counter())
+        return token
+
+    def wait(self, token, timeout=None):
+        if timeout is None:
+            timeout = GDBMIController.DEFAULT_TIMEOUT
+        timeout_time = time.time() + timeout
+        while token not in self._results:
+            if not self._pump(timeout_time):
+                if self._stats is not None:
+                    self._stats.timeouts += 1
+                self._abandon([token])
+                raise TimeoutError('gdb/mi not responding: token {}'.format(token))
+        self._pending.discard(token)
+        return self._results.pop(token)
+
+    def _abandon(self, tokens):
+        # a timed out request: its late replies are dropped by _dispatch()
+        for token in tokens:
+            self._pending.discard(token)
+            self._results.pop(token, None)
+            self._sent.pop(token, None)
+
+    def wait_stopped(self, count, timeout=None):
+        # wait for the first *stopped record after `count` stops were seen
+        if timeout is None:
+            timeout = GDBMIController.DEFAULT_TIMEOUT
+        timeout_time = time.time() + timeout
+        while self._stop_count <= count:
+            if not self._pump(timeout_time):
+                if self._stats is not None:
+                    self._stats.timeouts += 1
+                raise TimeoutError('gdb/mi target not stopped')
+        return self._stop_records[count - self._stop_count]
+
+    def command(self, cmd, timeout=None):
+        record = self.wait(self.send(cmd), timeout=timeout)
+        if record.klass == 'error':
+            raise Exception(record.results.get('msg', 'gdb/mi error: {}'.format(cmd)))
+        return record
+
+    def exec_command(self, cmd, timeout=None):
+        return self.exec_batch([cmd], timeout=timeout)[0]
+
+    def exec_batch(self, cmds, timeout=None):
+        responses = []
+        for record in self._request_batch([self._console_command(cmd) for cmd in cmds],
+                                          timeout=timeout):
+            response = record.output
+            if record.klass == 'error':
+                response += record.results.get('msg', '') + '\n'
+            responses.append(response)
+        return responses
+
+    def _request(self, cmd, timeout=None):
+        return self.command(cmd, timeout=timeout)
+
+    def _request_batch(self, cmds, timeout=None, parsers=None):
+        # all commands are in flight at once; gdb answers them in order. a
+        # command that resumes the target is answered when it stops again
+        count = self._stop_count
+        tokens = [self.send(cmd) for cmd in cmds]
+        records = []
+        try:
+            for token in tokens:
+                record = self.wait(token, timeout=timeout)
+                if record.klass == 'running':
+                    stopped = self.wait_stopped(count, timeout=timeout)
+                    count += 1
+                    record = record._replace(output=record.output + stopped.output)
+                records.append(record)
+        except TimeoutError:
+            self._abandon(tokens)
+            raise
+        return records
+
+    def _console_command(self, cmd):
+        escaped = cmd.replace('\\', '\\\\').replace('"', '\\"')
+        return f'-interpreter-exec console "{escaped}"'
+
+    def wait_until_stopped(self, timeout=None):
+        # True as soon as *stopped arrives, False when there is no live process
+        if timeout is None:
+            timeout = GDBMIController.DEFAULT_TIMEOUT
+        timeout_time = time.time() + timeout
+        while self._running:
+            if not self._pump(timeout_time):
+                raise TimeoutError('gdb/mi target not stopped')
+        return self._live
+
+    def reset(self, timeout=None):
+        # kill the target and drop breakpoints; the ELF and its symbols stay loaded
+        self.exec_batch(list(self.RESET_COMMANDS), timeout=timeout)
+
+    def disable_stats(self):
+        super().disable_stats()
+        self._sent.clear()
+
+    def _exec_run(self, cmd, timeout=None):
+        count = self._stop_count
+        self.command(cmd, timeout=timeout)
+        return self.wait_stopped(count, timeout=timeout)
+
+    def _pump(self, timeout_time):
+        select_timeout = timeout_time - time.time()
+        if select_timeout <= 0:
+            return False
+        stats = self._stats
+        if stats is not None:
+            start = time.perf_counter()
+        rready, wready, xready = select.select(
+            [self._process.stdout.fileno()], [], [],
+            select_timeout
+        )
+        if stats is not None:
+            stats.add_phase('select', time.perf_counter() - start)
+        if not rready:
+            return False
+        res = self._process.stdout.read()
+        if res is None:
+            return True
+        if not res:
+            raise EOFError('gdb/mi exited')
+        if stats is not None:
+            stats.bytes_read += len(res)
+            start = time.perf_counter()
+        lines = (self._buffer + res).split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self._dispatch(line.decode(errors='replace').rstrip('\r'))
+        if stats is not None:
+            stats.add_phase('parse', time.perf_counter() - start)
+        return True
+
+    def _dispatch(self, line):
+        if not line or line.startswith('(gdb)'):
+            return
+        if line[0] in '~@&':
+            m = self.pattern_cstring.match(line, 1)
+            if m is None:
+                return
+            if line[0] != '&':
+                self._streams.append(_unescape(m.group(1)))
+            return
+        m = self.pattern_record.match(line)
+        if m is None:
+            # inferior output is not wrapped in stream records
+            self._streams.append(line + '\n')
+            return
+        token = int(m.group(1)) if m.group(1) else None
+        kind, klass = m.group(2), m.group(3)
+        results = parse_results(line, m.end())
+        if kind == '^' or (kind == '*' and klass == 'stopped'):
+            record = MIRecord(token, kind, klass, results, ''.join(self._streams))
+            self._streams = []
+        else:
+            record = MIRecord(token, kind, klass, results, '')
+        if kind == '^':
+            if token in self._pending:
+                self._results[token] = record
+                sent = self._sent.pop(token, None)
+                if sent is not None and self._stats is not None:
+                    self._stats.add_command([sent[0]], time.perf_counter() - sent[1])
+        elif kind == '*':
+            if klass == 'running':
+                self._running = True
+                self._live = True
+                if self.mem_cache:
+                    self.mem_cache.invalidate()
+            elif klass == 'stopped':
+                self._running = False
+                self.stop_record = record
+                self._stop_records.append(record)
+                self._stop_count += 1
+        else:
+            if klass == 'memory-changed' and self.mem_cache:
+                self.mem_cache.invalidate()
+            elif klass == 'thread-group-started':
+                self._live = True
+            elif klass == 'thread-group-exited':
+                self._live = False
+            self.notifications.append(record)
+
+    def load(self, elfpath, timeout=None):
+        self._regnames = None
+        super().load(elfpath, timeout=timeout)
+
+    def run_stop_at_start(self, timeout=None):
+        self._reset_checkpoints()
+        return self._exec_run(self._console_command(self.START_COMMAND), timeout=timeout)
+
+    def step_in(self, inst=False, timeout=None):
+        cmd = '-exec-step-instruction' if inst else '-exec-step'
+        return self._exec_run(cmd, timeout=timeout)
+
+    def step_over(self, inst=False, timeout=None):
+        cmd = '-exec-next-instruction' if inst else '-exec-next'
+        return self._exec_run(cmd, timeout=timeout)
+
+    def step_out(self, inst=False, timeout=None):
+        return self._exec_run('-exec-finish', timeout=timeout)
+
+    def run_steps(self, step, count, timeout=None):
+        # `count` step commands run inside gdb, without a round trip each.
+        # a breakpoint would end the run early, so all are deleted first
+        if timeout is None:
+            timeout = GDBMIController.DEFAULT_TRACE_TIMEOUT
+        self.command('-break-delete')
+        return self.exec_command(self._step_count_command(step, count), timeout=timeout)
+
+    def run_to_hit(self, addr, hits, timeout=None):
+        # continue until addr is reached for the `hits`-th time, with an ignore
+        # count instead of a stop at every hit. False when the program ended first
+        if timeout is None:
+            timeout = GDBMIController.DEFAULT_TRACE_TIMEOUT
+        self.command('-break-delete')
+        self.command(f'-break-insert -i {hits - 1} *{hex(addr)}')
+        self._exec_run('-exec-continue', timeout=timeout)
+        self.command('-break-delete')
+        return self._live
+
+    def watch(self, addr, size, timeout=None):
+        # a hardware watchpoint on writes of `size` (1, 2, 4 or 8) bytes at addr
+        if size not in self.WATCH_TYPES:
+            raise ValueError('unsupported watch size: {}'.format(size))
+        record = self.command(
+            f'-break-watch *({self.WATCH_TYPES[size]} *){hex(addr)}', timeout=timeout)
+        return int(record.results['wpt']['number'])
+
+    def unwatch(self, number, timeout=None):
+        self.command(f'-break-delete {number}', timeout=timeout)
+
+    def run_to_watch(self, timeout=None):
+        # continue until the target stops: the numbers of the watchpoints that
+        # fired ([] for a breakpoint), None when the program ended
+        if timeout is None:
+            timeout = GDBMIController.DEFAULT_TRACE_TIMEOUT
+        stopped = self._exec_run('-exec-continue', timeout=timeout)
+        if not self._live:
+            return None
+        if 'wpt' in stopped.results:
+            return [int(stopped.results['wpt']['number'])]
+        return []
+
+    def write_reg(self, name, value, timeout=None):
+        self.exec_command(self._write_reg_command(name, value), timeout=timeout)
+
+    def write_mem(self, addr, value, size=8, timeout=None):
+        # an integer of `size` (1, 2, 4 or 8) bytes at addr
+        self.exec_command(self._write_mem_command(addr, value, size), timeout=timeout)
+
+    def restart(self, checkpoint, timeout=None):
+        super().restart(checkpoint, timeout=timeout)
+        # whatever gdb reported while switching, the fork is stopped
+        self._live = True
+
+    def read_pc(self, timeout=5):
+        record = self.command(self.PC_VALUE_COMMAND, timeout=timeout)
+        pc = self._parse_pc_value(record)
+        if pc is None:
+            raise Exception("pc not found")
+        return pc
+
+    def _parse_read_pc(self, record):
+        # the address of the instruction of PC_COMMAND
+        for insn in record.results.get('asm_insns', []):
+            return str2int(insn['address'])
+        return None
+
+    def _parse_pc_value(self, record):
+        if record.klass != 'done':
+            return None
+        m = self.pattern_hex.search(record.results.get('value', ''))
+        return str2int(m.group(0)) if m else None
+
+    def read_regnames(self, timeout=5):
+        if self._regnames is None:
+            record = self.command('-data-list-register-names', timeout=timeout)
+            self._regnames = record.results['register-names']
+        return self._regnames
+
+    def read_reg_layout(self, timeout=5):
+        # keep the registers gdb reports as plain integers, in gdb's order
+        if self._reg_layout is None:
+            regnames = self.read_regnames(timeout=timeout)
+            record = self.command('-data-list-register-values --skip-unavailable x',
+                                  timeout=timeout)
+            names = []
+            for item in record.results['register-values']:
+                regname = regnames[int(item['number'])]
+                # vector registers are reported as {...} aggregates
+                if regname and item['value'][:1].isdigit():
+                    names.append(regname)
+            self._reg_layout = RegisterLayout(names)
+            self._regnumbers = {n: str(i) for i, n in enumerate(regnames) if n}
+        return self._reg_layout
+
+    def read_reg(self, names=None, timeout=5):
+        layout = self.read_reg_layout(timeout=timeout).subset(names)
+        record = self.command(self._read_reg_command(layout), timeout=timeout)
+        return self._parse_read_reg(record, layout)
+
+    def _read_reg_command(self, layout):
+        numbers = [self._regnumbers[n] for n in layout.names]
+        return '-data-list-register-values --skip-unavailable x ' + ' '.join(numbers)
+
+    def _parse_read_reg(self, record, layout):
+        registers = RegisterFile(layout)
+        regnames = self._regnames
+        index = layout.index
+        values = registers.values
+        for item in record.results.get('register-values', []):
+            i = index.get(regnames[int(item['number'])])
+            if i is not None:
+                values[i] = str2int(item['value']) & MASK64
+        return registers
+
+    def read_mem(self, addr, size=4, count=1, timeout=3):
+        if self.mem_cache and isinstance(addr, int):
+            data = self.mem_cache.read(addr, size * count)
+            return memory.words(data, size, self._byteorder)
+        record = self.command(self._read_mem_command(addr, size, count), timeout=timeout)
+        return self._parse_read_mem(record)
+
+    def _read_mem_command(self, addr, size, count):
+        if isinstance(addr, int):
+            addr = hex(addr)
+        return f'-data-read-memory {addr} x {size} 1 {count}'
+
+    def _parse_read_mem(self, record):
+        mems = []
+        for row in record.results.get('memory', []):
+            mems += [str2int(v) for v in row['data']]
+        return mems
+
+    def _disasm_range_command(self, start, end=None):
+        # without `end`, the whole function containing `start`
+        if end is None:
+            return f'-data-disassemble -a {hex(start)} -- 0'
+        return f'-data-disassemble -s {hex(start)} -e {hex(end)} -- 0'
+
+    def _format_insn(self, insn):
+        return '<{}+{}>:\t{}'.format(
+            insn.get('func-name', '??'), insn.get('offset', 0), insn['inst'])
+
+    def _parse_read_disasm(self, record):
+        for insn in record.results.get('asm_insns', []):
+            return self._format_insn(insn)
+        return None
+
+    def _parse_disasm_range(self, record):
+        return {str2int(insn['address']): self._format_insn(insn)
+                for insn in record.results.get('asm_insns', [])}
+
+    def _snapshot_commands(self, layout, mem, step, cached=False):
+        if step is not None:
+            step = self.STEP_COMMANDS.get(step) or self._console_command(step)
+        return super()._snapshot_commands(layout, mem, step, cached=cached)
+
+    def _snapshot_parsers(self, layout, mem, step):
+        # records are parsed once they are complete
+        return None
+
+    def _parse_return_address(self, record):
+        for frame in record.results['stack']:
+            return str2int(frame['addr'])
+        raise Exception("return address not found")
+
+
+def _unescape(s):
+    return codecs.escape_decode(s.encode())[0].decode(errors='replace')
+
+
+def parse_results(line, i=0):
+    results = {}
+    while i < len(line) and line[i] == ',':
+        key, value, i = _parse_result(line, i + 1)
+        results[key] = value
+    return results
+
+
+def _parse_result(s, i):
+    j = s.index('=', i)
+    value, k = _parse_value(s, j + 1)
+    return s[i:j], value, k
+
+
+def _parse_value(s, i):
+    c = s[i]
+    if c == '"':
+        m = GDBMIController.pattern_cstring.match(s, i)
+        if m is None:
+            raise ValueError('unterminated gdb/mi string at {}: {!r}'.format(i, s))
+        return _unescape(m.group(1)), m.end()
+    if c == '{':
+        results = {}
+        i += 1
+        while s[i] != '}':
+            key, value, i = _parse_result(s, i)
+            results[key] = value
+            if s[i] == ',':
+                i += 1
+        return results, i + 1
+    if c == '[':
+        values = []
+        i += 1
+        while s[i] != ']':
+            if s[i] in '"{[':
+                value, i = _parse_value(s, i)
+            else:
+                key, value, i = _parse_result(s, i)
+            values.append(value)
+            if s[i] == ',':
+                i += 1
+        return values, i + 1
+    raise ValueError('invalid gdb/mi value at {}: {!r}'.format(i, s))
@@ -1,198 +1,108 @@
-import os
 import re
-import select
-import subprocess
-import time
-
-import fcntl
-
-
-class LLDBController():
-    DEFAULT_TIMEOUT = 1.0
-    DEFAULT_ROUNDUP_TIME = 0.2
 
+from dbgctrl import agent
+from dbgctrl.controller import Parser, TextController
+
+
+class LLDBParser(Parser):
+    # lldb commands and reply patterns, shared by LLDBController and AsyncLLDBController
+    NAME = 'lldb'
+    PROMPT = '(lldb) '
+    INIT_COMMANDS = ('settings set auto-confirm true',)
+    START_COMMAND = 'pr la -s'
+    PC_COMMAND = 'dis -pc -c 1'
+    PC_VALUE_COMMAND = 'register read pc'
+    REG_LAYOUT_COMMAND = 'reg read -a'
+    RETURN_ADDRESS_COMMAND = 'bt'
+    STATUS_COMMAND = 'process status'
+    RESET_COMMANDS = ('process kill', 'breakpoint delete')
+    DELETE_COMMAND = 'breakpoint delete'
+    MAPPINGS_COMMAND = 'memory region --all'
+    STEP_COUNT_COMMANDS = {'si': 'thread step-inst', 'ni': 'thread step-inst-over'}
+    WATCH_SIZES = (1, 2, 4, 8)
+
+    # commands that neither resume the target nor write its memory
+    pattern_readonly_command = re.compile(
+        r'\s*(dis|disassemble|bt|image|help|(reg|register|mem|memory) read'
+        r'|b|(br|breakpoint|watchpoint) (set|list|delete)|(thread|frame) (info|select|backtrace)'
+        r'|settings (show|set)|process status)(\s|$)')
+    pattern_mapping = re.compile(
+        r'^\[(0x[0-9A-Fa-f]+)-(0x[0-9A-Fa-f]+)\)[ \t]+([r-][w-][x-])(.*)$', re.M)
     pattern_exited = re.compile(r'.+ exited with')
-    pattern_invalid = re.compile(r'error: invalid process')
+    pattern_not_running = re.compile(r'error: (invalid process|.*requires a current process)')
+    pattern_stopped = re.compile(r'Process \d+ stopped')
+    pattern_watchpoint = re.compile(r'Watchpoint created: Watchpoint (\d+):')
+    pattern_watch_hit = re.compile(r'stop reason = watchpoint (\d+)')
     pattern_pc = re.compile(r'\-\> +([0-9A-Fa-fx]+)')
     pattern_reg_category = re.compile(r'^(.+): *$')
     pattern_reg_namevalue = re.compile(r'\s*([^ ]+)\s*=\s*([0-9A-Fa-fx]+)\s*.*$')
-    pattern_mem_value = re.compile(r'[0-9A-Fa-fx]+:\s+([0-9A-Fa-fx]+)')
+    pattern_mem_value = re.compile(r'0x[0-9A-Fa-f]+:\s+((?:0x[0-9A-Fa-f]+\s*)+)')
     pattern_disasm = re.compile(r'\-\> +(?:[0-9A-Fa-fx]+)(?:\s)+(.+)')
+    pattern_pc_value = re.compile(r'\s*\w+ = (0x[0-9A-Fa-f]+)')
+    pattern_disasm_line = re.compile(r'(?:\-\>)? +(0x[0-9A-Fa-f]+)(?:\s)+(.+)')
+    pattern_return_address = re.compile(r'#1:? +([0-9A-Fa-fx]+)')
     pattern_func_range = re.compile(r'range = \[([0-9A-Fa-fx]+)\-([0-9A-Fa-fx]+)')
+    # the same, on the bytes of a reply while it arrives
+    pattern_pc_line = re.compile(rb'^\-\> +([0-9A-Fa-fx]+)', re.M)
+    pattern_reg_line = re.compile(rb'^[ \t]*([^ \t\n]+)[ \t]*=[ \t]*([0-9A-Fa-fx]+)', re.M)
+    pattern_mem_line = re.compile(rb'^0x[0-9A-Fa-f]+:[ \t]+((?:0x[0-9A-Fa-f]+[ \t]*)+)', re.M)
 
-    def __init__(self, dbgpath):
-        self.dbgpath = dbgpath
-        self.elfpath = None
-        self._process = None
-        self._stdout = None
-        self.roundup_time = LLDBController.DEFAULT_ROUNDUP_TIME
-        self.check_debugger_exists()
-        self.open_debugger()
-
-    def __del__(self):
-        if self._process:
-            self._process.terminate()
-            self._process.wait()
-            self._process.communicate()
-            self._process = None
-
-    def check_debugger_exists(self):
-        if os.path.exists(self.dbgpath):
-            return
-        raise Exception('debugger not found: {}'.format(self.dbgpath))
-
-    def open_debugger(self):
-        self._process = subprocess.Popen(
-            self.dbgpath,
-            shell=False,
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            bufsize=0,
-        )
-        self.stdout = self._process.stdout
-        # self.stderr = self._process.stderr
-        fcntl.fcntl(self.stdout.fileno(), fcntl.F_SETFL, os.O_NONBLOCK)
-        # fcntl.fcntl(self.stderr.fileno(), fcntl.F_SETFL, os.O_NONBLOCK)
-        print('lldb start up.')
-
-    def exec_command(self, cmd, timeout=None):
-        self._process.stdin.write(f'{cmd}\n'.encode())
-        self._process.stdin.flush()
-        return self.get_response(timeout=timeout)
-
-    def load(self, elfpath, timeout=None):
-        self.elfpath = elfpath
-        self.exec_command(f'file {elfpath}', timeout=timeout)
-
-    def quit(self):
-        self.exec_command('q')
-        print('lldb exited.')
-        if self._process:
-            self._process.terminate()
-            self._process.wait()
-            self._process.communicate()
-            self._process = None
-
-    def get_response(self, timeout=None):
-        if timeout is None:
-            timeout = LLDBController.DEFAULT_TIMEOUT
-        timeout_time = time.time() + timeout
-        responses = []
-        while True:
-            select_timeout = timeout_time - time.time()
-            if select_timeout <= 0:
-                select_timeout = 0
-            rready, wready, xready = select.select(
-                [self._process.stdout.fileno()], [], [],
-                select_timeout
-            )
-            res = None
-            if rready:
-                for fileno in rready:
-                    if fileno == self._process.stdout.fileno():
-                        self._process.stdout.flush()
-                        res = self._process.stdout.read()
-                        responses += [res]
-                    else:
-                        raise Exception("Unknown fd: {}".format(fileno))
-            if timeout == 0:
-                break
-            elif res and (self.roundup_time > 0):
-                timeout_time = min(time.time() + self.roundup_time, timeout_time)
-            elif time.time() > timeout_time:
-                break
-        response = ''.join([r.decode() for r in responses])
-        return response
-
-    def wait_response(self, timeout=None):
-        if timeout is None:
-            timeout = LLDBController.DEFAULT_TIMEOUT
-        timeout_time = time.time() + timeout
-        responses = []
-        while True:
-            res = self.get_response(timeout=timeout)
-            responses.append(res)
-            if '(lldb)' in res:
-                break
-            if time.time() >= timeout_time:
-                break
-        response = ''.join([r for r in responses])
-        return response
-
-    def run_stop_at_start(self, timeout=None):
-        return self.exec_command('pr la -s', timeout=timeout)
-
-    def step_in(self, inst=False, timeout=None):
-        cmd = 'si'if inst else 's'
-        return self.exec_command(cmd, timeout=timeout)
-
-    def step_over(self, inst=False, timeout=None):
-        cmd = 'ni'if inst else 'n'
-        return self.exec_command(cmd, timeout=timeout)
-
-    def step_out(self, inst=False, timeout=None):
-        return self.exec_command('finish', timeout=timeout)
-
-    def read_pc(self, timeout=5):
-        response = self.exec_command('dis -pc -c 1', timeout=timeout)
-        for line in response.splitlines():
-            m = self.pattern_pc.match(line)
-            if m:
-                return str2int(m.group(1))
-        raise Exception("pc not found")
-
-    def read_reg(self, names=None, timeout=5):
-        response = self.exec_command('reg read -a', timeout=timeout)
-        regs = self._parse_read_reg(response)
-        if names is not None:
-            regs = {k: v for k, v in regs.items() if k in names}
-        return regs
-
-    def _parse_read_reg(self, response):
-        registers = {}
-        category = ''
-        for line in response.splitlines():
-            m = self.pattern_reg_category.match(line)
-            if m:
-                category = m.group(1)
-                continue
-            m = self.pattern_reg_namevalue.match(line)
-            if m:
-                regname = m.group(1)
-                value = str2int(m.group(2))
-                registers[regname] = {'category': category, 'value': value}
-        return registers
+    def _step_count_command(self, step, count):
+        if step not in self.STEP_COUNT_COMMANDS:
+            raise ValueError('lldb repeats instruction steps only: {}'.format(step))
+        return f'{self.STEP_COUNT_COMMANDS[step]} -c {count}'
+
+    def _break_hit_commands(self, addr, hits):
+        # a breakpoint that stops at its `hits`-th hit
+        return [f'breakpoint set -a {hex(addr)} -i {hits - 1}']
+
+    def _watch_command(self, addr, size):
+        if size not in self.WATCH_SIZES:
+            raise ValueError('unsupported watch size: {}'.format(size))
+        return f'watchpoint set expression -w write -s {size} -- {hex(addr)}'
+
+    def _unwatch_command(self, number):
+        return f'watchpoint delete {number}'
+
+    def _write_reg_command(self, name, value):
+        return f'register write {name} {hex(value)}'
+
+    def _write_mem_command(self, addr, value, size):
+        if size not in self.WATCH_SIZES:
+            raise ValueError('unsupported write size: {}'.format(size))
+        return f'memory write -s {size} {hex(addr)} {hex(value)}'
 
-    def read_mem(self, addr, size=4, count=1, timeout=3):
-        if type(addr) == int:
+    def _read_reg_command(self, layout):
+        return 'register read ' + ' '.join(layout.names)
+
+    def _read_mem_command(self, addr, size, count):
+        if isinstance(addr, int):
             addr = hex(addr)
-        response = self.exec_command(f'mem read -s{size} -fx -c{count} {addr}', timeout=timeout)
-        mems = []
-        for line in response.splitlines()[1:]:
-            nums = line.strip().split(' ')
-            addr = str2int(nums[0][:-1])
-            mems += [str2int(m) for m in nums[1:]]
-        return mems
-
-    def read_disasm(self, timeout=None):
-        response = self.exec_command('dis -pc -c 1', timeout=timeout)
-        for line in response.splitlines():
-            m = self.pattern_disasm.match(line)
-            if m:
-                return m.group(1)
-        raise Exception("disasm line not found")
+        return f'mem read -s{size} -fx -c{count} {addr}'
 
-    def read_return_address(self, timeout=None):
-        response = self.exec_command('bt', timeout=timeout)
-        for line in response.splitlines():
-            m = re.search(r'#1:? +([0-9A-Fa-fx]+)', line)
-            if m:
-                retaddr = int(m.group(1)[2:], 16)
-                return retaddr
-        raise Exception("return address not found")
+    def _dump_mem_command(self, path, addr, length):
+        return f'memory read --force --binary --outfile {path} {hex(addr)} {hex(addr + length)}'
+
+    def _disasm_range_command(self, start, end=None):
+        # without `end`, the whole function containing `start`
+        if end is None:
+            return f'dis -a {hex(start)}'
+        return f'dis -s {hex(start)} -e {hex(end)}'
+
+
+class LLDBController(LLDBParser, TextController):
+    AGENT_COMMAND = 'command script import {}'.format(agent.LLDB_AGENT)
+
+    def checkpoint(self, timeout=None):
+        raise Exception('lldb has no checkpoints')
+
+    def restart(self, checkpoint, timeout=None):
+        raise Exception('lldb has no checkpoints')
 
     def read_function_range(self, symbol, timeout=None):
+        # the ELF symbol table answers without a round trip; lldb is asked otherwise
+        if self.elf and self.elf.symbol(symbol):
+            return self.elf.function_range(symbol)
         response = self.exec_command('image lookup -v -s {}'.format(symbol), timeout=timeout)
         for line in response.splitlines():
             m = self.pattern_func_range.search(line)
@@ -201,7 +111,3 @@ class LLDBController():
                 end = int(m.group(2)[2:], 16)
                 return (start, end)
         raise Exception("unknown size of function: {}".format(symbol))
-
-
-def str2int(s):
-    return int(s, 16) if s[:2] == '0x' else int(s)
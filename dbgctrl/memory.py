@@ -0,0 +1,244 @@
+import itertools
+import mmap
+import os
+import shutil
+import tempfile
+from collections import OrderedDict, namedtuple
+
+
+# bulk memory reads: the debugger dumps raw bytes into a file on tmpfs,
+# which is mapped instead of being parsed from hex text.
+TMPFS_DIR = '/dev/shm'
+
+_counter = itertools.count()
+
+# a run of changed bytes; old and new are bytes of the same length
+MemoryDiff = namedtuple('MemoryDiff', ['addr', 'old', 'new'])
+# a mapped region of the target, [start, end)
+Mapping = namedtuple('Mapping', ['start', 'end', 'perms', 'name'])
+
+
+def make_dump_dir():
+    tmpdir = TMPFS_DIR if os.path.isdir(TMPFS_DIR) else None
+    return tempfile.mkdtemp(prefix='dbgctrl-', dir=tmpdir)
+
+
+def remove_dump_dir(path):
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def dump_path(dump_dir):
+    # every dump gets a new file: rewriting a mapped file would change older views
+    return os.path.join(dump_dir, 'mem{}.bin'.format(next(_counter)))
+
+
+def map_dump(path, length, response=''):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = -1
+    if size != length:
+        if size >= 0:
+            os.unlink(path)
+        raise Exception('memory dump failed: {}'.format(response.strip()))
+    if length == 0:
+        view = memoryview(b'')
+    else:
+        with open(path, 'rb') as f:
+            view = memoryview(mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ))
+    # the mapping keeps the data alive after the file is gone
+    os.unlink(path)
+    return view
+
+
+def as_dtype(view, dtype=None):
+    if dtype is None:
+        return view
+    import numpy
+    return numpy.frombuffer(view, dtype=dtype)
+
+
+def words(data, size, byteorder):
+    return [int.from_bytes(data[i:i + size], byteorder) for i in range(0, len(data), size)]
+
+
+class MemoryCache():
+    # page-granular cache of target memory, dropped whenever the target runs.
+    # pages inside read-only ranges (e.g. .text, .rodata) survive invalidate().
+    PAGE_SIZE = 4096
+    DEFAULT_MAX_BYTES = 64 << 20
+
+    def __init__(self, fetch, page_size=PAGE_SIZE, max_bytes=DEFAULT_MAX_BYTES):
+        self._fetch = fetch
+        self.page_size = page_size
+        self.max_bytes = max_bytes
+        self.readonly = []
+        self._pages = OrderedDict()
+        self._pinned = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def add_readonly(self, start, end):
+        self.readonly.append((start, end))
+
+    def invalidate(self):
+        self._pages.clear()
+        self._size = 0
+
+    def clear(self):
+        self.invalidate()
+        self._pinned.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'pages': len(self._pages) + len(self._pinned),
+            'bytes': self._size,
+        }
+
+    def read(self, addr, length):
+        if length <= 0:
+            return b''
+        page_size = self.page_size
+        first = addr - addr % page_size
+        last = addr + length - 1
+        last -= last % page_size
+        chunks = []
+        page = first
+        while page <= last:
+            data = self._lookup(page)
+            if data is not None:
+                self.hits += 1
+                chunks.append(data)
+                page += page_size
+                continue
+            # fetch the whole run of missing pages in one request
+            end = page + page_size
+            while end <= last and not self._cached(end):
+                end += page_size
+            try:
+                fetched = bytes(self._fetch(page, end - page))
+            except Exception:
+                # part of the page is not readable: read exactly what was asked
+                self.misses += 1
+                return bytes(self._fetch(addr, length))
+            self.misses += (end - page) // page_size
+            for offset in range(0, end - page, page_size):
+                self._store(page + offset, fetched[offset:offset + page_size])
+            chunks.append(fetched)
+            page = end
+        offset = addr - first
+        return b''.join(chunks)[offset:offset + length]
+
+    def _cached(self, page):
+        return page in self._pages or page in self._pinned
+
+    def _lookup(self, page):
+        data = self._pinned.get(page)
+        if data is not None:
+            return data
+        data = self._pages.get(page)
+        if data is not None:
+            self._pages.move_to_end(page)
+        return data
+
+    def _store(self, page, data):
+        end = page + self.page_size
+        if any(start <= page and end <= stop for start, stop in self.readonly):
+            self._pinned[page] = data
+            return
+        self._pages[page] = data
+        self._size += len(data)
+        while self._size > self.max_bytes and self._pages:
+            _, old = self._pages.popitem(last=False)
+            self._size -= len(old)
+
+
+def diff_runs(old, new):
+    # [(offset, length)] of the bytes that differ between two buffers of the
+    # same length. Halves that are equal are skipped with one comparison,
+    # so a few changes in a large buffer cost a few comparisons each
+    old, new = memoryview(old), memoryview(new)
+    runs: list = []
+    pending = [(0, len(old))]
+    while pending:
+        start, end = pending.pop()
+        if old[start:end] == new[start:end]:
+            continue
+        if end - start > 8:
+            mid = (start + end) // 2
+            # the second half first, so runs come out in address order
+            pending.append((mid, end))
+            pending.append((start, mid))
+            continue
+        for i in range(start, end):
+            if old[i] == new[i]:
+                continue
+            if runs and runs[-1][0] + runs[-1][1] == i:
+                runs[-1][1] += 1
+            else:
+                runs.append([i, 1])
+    return [tuple(run) for run in runs]
+
+
+class MemorySnapshot():
+    # copies of target memory regions, brought up to date by update().
+    # `hashes(regions, page_size)` returns a hash per page of every region
+    # (computed in the debugger), and only pages whose hash changed are read
+    # again with `fetch(addr, length)`. Without `hashes` whole regions are
+    # read again. Pages are counted from the start of their region.
+    PAGE_SIZE = 4096
+
+    def __init__(self, fetch, regions, hashes=None, page_size=PAGE_SIZE):
+        self._fetch = fetch
+        self._hash = hashes
+        self.page_size = page_size
+        self.regions = [(addr, length) for addr, length in regions]
+        self._data = [bytearray(fetch(addr, length)) for addr, length in self.regions]
+        self._hashes = hashes(self.regions, page_size) if hashes else []
+        self.pages_read = 0
+
+    def data(self, i):
+        return memoryview(self._data[i])
+
+    def update(self):
+        # MemoryDiffs since the last update, in region and address order
+        diffs = []
+        if self._hash is None:
+            for i, (addr, length) in enumerate(self.regions):
+                diffs += self._update_range(i, 0, self._fetch(addr, length))
+            return diffs
+        hashes = self._hash(self.regions, self.page_size)
+        page_size = self.page_size
+        for i, (addr, length) in enumerate(self.regions):
+            old, new = self._hashes[i], hashes[i]
+            changed = [j for j in range(len(new)) if new[j] != old[j]]
+            # consecutive changed pages are read in one request
+            k = 0
+            while k < len(changed):
+                first = last = changed[k]
+                k += 1
+                while k < len(changed) and changed[k] == last + 1:
+                    last = changed[k]
+                    k += 1
+                start = first * page_size
+                end = min((last + 1) * page_size, length)
+                diffs += self._update_range(i, start, self._fetch(addr + start, end - start))
+                self.pages_read += last - first + 1
+        self._hashes = hashes
+        return diffs
+
+    def _update_range(self, i, start, data):
+        addr = self.regions[i][0] + start
+        buf = self._data[i]
+        with memoryview(buf) as view:
+            old = view[start:start + len(data)]
+            diffs = [MemoryDiff(addr + offset, bytes(old[offset:offset + n]),
+                                bytes(data[offset:offset + n]))
+                     for offset, n in diff_runs(old, data)]
+            old.release()
+        buf[start:start + len(data)] = data
+        return diffs
@@ -0,0 +1,284 @@
+import re
+import zlib
+from typing import Any, Literal
+
+from dbgctrl import disasm, elf, memory, stats
+from dbgctrl.register import RegisterFile, RegisterLayout
+
+
+class NativeController():
+    # the controllers that read the target themselves (a traced process, a core
+    # file, a remote stub) instead of driving a debugger. there is no
+    # disassembler or command line: objdump disassembles the ELF
+    # (prefill_disasm) and exec_command() knows only a few gdb commands.
+    # with an Arch (dbgctrl.ptrace), registers come as words in kernel order
+    NAME = 'native'
+    DEFAULT_TRACE_TIMEOUT = 24 * 60 * 60.0
+    STATUS_COMMAND = 'info program'
+    DELETE_COMMAND = 'delete'
+
+    pattern_break = re.compile(r'(?:b|break|tbreak|hbreak)\s+\*?(\S+)$')
+    pattern_step = re.compile(r'(si|stepi|ni|nexti)(?:\s+(\d+))?$')
+    pattern_call = re.compile(r'\t(call|callq|bl|blr|blx|jal|jalr)\b')
+    pattern_number = re.compile(r'(0x[0-9A-Fa-f]+|\d+)$')
+
+    def __init__(self, arch=None):
+        self.arch = arch
+        # set by load() and enable_stats()
+        self.elfpath: Any = None
+        self.elf = None
+        self.mem_cache = None
+        self.disasm_cache = {}
+        self._insn_sizes = {}
+        self._stats: Any = None
+        self._byteorder: Literal['little', 'big'] = 'little'
+        self._bias = 0
+        self._reg_layout = None
+        self._reg_indexes = {}
+        # addresses of the breakpoints set by exec_command()
+        self._breakpoints: Any = {}
+        self._live = False
+        self._exit_status = None
+        # the pc of the last stop, until the target runs
+        self._pc = None
+
+    def _read_words(self):
+        raise NotImplementedError
+
+    def _read_bytes(self, addr, length, timeout=None):
+        raise NotImplementedError
+
+    def read_pc(self, timeout=None):
+        raise NotImplementedError
+
+    def _insert_breakpoints(self, addrs, timeout=None):
+        raise NotImplementedError
+
+    def _remove_breakpoints(self, addrs, timeout=None):
+        raise NotImplementedError
+
+    def _step(self, step, timeout=None):
+        # one `si`, `ni` or `c`
+        raise NotImplementedError
+
+    def _resume(self, timeout=None):
+        raise NotImplementedError
+
+    def _run_to(self, addr, timeout=None):
+        # continue with a temporary breakpoint at addr
+        raise NotImplementedError
+
+    def reset(self, timeout=None):
+        raise NotImplementedError
+
+    def enable_stats(self):
+        # time per phase and per request (ptrace call, packet), see stats()
+        self._stats = stats.Stats()
+        stats.instrument(self, self._stats)
+        return self._stats
+
+    def disable_stats(self):
+        stats.uninstrument(self)
+        self._stats = None
+
+    def stats(self):
+        return self._stats.report() if self._stats is not None else {}
+
+    def load(self, elfpath, timeout=None):
+        # the ELF for symbols and disassembly; the target is opened by the subclass
+        self.elfpath = elfpath
+        if self.elf:
+            self.elf.close()
+        self.elf = elf.open_elf(elfpath)
+        self._byteorder = self.elf.byteorder if self.elf else 'little'
+        if self.mem_cache:
+            self.mem_cache.clear()
+        self.disasm_cache.clear()
+        self._insn_sizes.clear()
+
+    def wait_until_stopped(self, timeout=None):
+        # every request returns once the target has stopped again
+        return self._live
+
+    def exec_command(self, cmd, timeout=None):
+        return self.exec_batch([cmd], timeout=timeout)[0]
+
+    def exec_batch(self, cmds, timeout=None):
+        return [self._exec(cmd.strip(), timeout) for cmd in cmds]
+
+    def _exec(self, cmd, timeout):
+        # the gdb commands used by dbgctrl applications
+        m = self.pattern_break.match(cmd)
+        if m:
+            addr = self._location(m.group(1))
+            self._insert_breakpoints([addr], timeout)
+            return 'Breakpoint at {}\n'.format(hex(addr))
+        m = self.pattern_step.match(cmd)
+        if m:
+            for _ in range(int(m.group(2) or 1)):
+                if not self._live:
+                    break
+                self._step(m.group(1)[0] + 'i', timeout)
+            return self._status()
+        if cmd in ('c', 'continue'):
+            self._resume(timeout)
+            return self._status()
+        if cmd in ('d', 'delete'):
+            self._remove_breakpoints(list(self._breakpoints), timeout)
+            return ''
+        if cmd == 'kill':
+            self.reset(timeout)
+            return ''
+        if cmd == self.STATUS_COMMAND:
+            return self._status()
+        raise Exception('not available with {}: {}'.format(self.NAME, cmd))
+
+    def _status(self):
+        if self._live:
+            return 'Program stopped at {}.\n'.format(hex(self.read_pc()))
+        if self._exit_status is not None:
+            return 'Program exited with code {:02x}.\n'.format(self._exit_status & 0xff)
+        return 'The program is not being run.\n'
+
+    def _location(self, location):
+        if self.pattern_number.match(location):
+            return int(location, 0)
+        symbol = self.elf.symbol(location) if self.elf else None
+        if symbol is None:
+            raise Exception('symbol not found: {}'.format(location))
+        return symbol.value + self._bias
+
+    def _invalidate(self):
+        # the target is about to run
+        self._pc = None
+        if self.mem_cache:
+            self.mem_cache.invalidate()
+
+    def _call_return(self, pc):
+        # the instruction after a call at pc, where `ni` stops. it needs the
+        # disassembly of pc (prefill_disasm); without it, `ni` steps into the call
+        text = self.disasm_cache.get(pc)
+        size = self._insn_sizes.get(pc)
+        if text and size and self.pattern_call.search(text):
+            return pc + size
+        return None
+
+    def step_in(self, inst=False, timeout=None):
+        if not inst:
+            raise ValueError('only instruction steps with {}'.format(self.NAME))
+        self._step('si', timeout)
+        return self._status()
+
+    def step_over(self, inst=False, timeout=None):
+        if not inst:
+            raise ValueError('only instruction steps with {}'.format(self.NAME))
+        self._step('ni', timeout)
+        return self._status()
+
+    def step_out(self, inst=False, timeout=None):
+        # to the return address, which is known at function entry only
+        self._run_to(self.read_return_address(), timeout)
+        return self._status()
+
+    def read_reg_layout(self, timeout=None):
+        if self._reg_layout is None:
+            self._reg_layout = RegisterLayout(
+                self.arch.order, ['general'] * len(self.arch.order))
+        return self._reg_layout
+
+    def _parse_regs(self, words, layout):
+        indexes = self._reg_indexes.get(layout)
+        if indexes is None:
+            index = {name: i for i, name in enumerate(self.arch.names)}
+            indexes = self._reg_indexes[layout] = [index[name] for name in layout.names]
+        return RegisterFile(layout, [words[i] for i in indexes])
+
+    def read_reg(self, names=None, timeout=None):
+        layout = self.read_reg_layout().subset(names)
+        return self._parse_regs(self._read_words(), layout)
+
+    def read_mem(self, addr, size=4, count=1, timeout=None):
+        if self.mem_cache:
+            data = self.mem_cache.read(addr, size * count)
+        else:
+            data = self._read_bytes(addr, size * count, timeout)
+        return memory.words(data, size, self._byteorder)
+
+    def read_mem_bytes(self, addr, length, dtype=None, timeout=None):
+        # raw bytes as a memoryview (or a numpy array of `dtype`)
+        if self.mem_cache:
+            view = memoryview(self.mem_cache.read(addr, length))
+        else:
+            view = memoryview(self._read_bytes(addr, length, timeout))
+        return memory.as_dtype(view, dtype)
+
+    def enable_mem_cache(self, max_bytes=memory.MemoryCache.DEFAULT_MAX_BYTES,
+                         page_size=memory.MemoryCache.PAGE_SIZE, readonly=()):
+        # opt-in page cache for read_mem/read_mem_bytes, dropped when the target runs
+        self.mem_cache = memory.MemoryCache(
+            self._read_bytes,
+            page_size=page_size, max_bytes=max_bytes)
+        for start, end in readonly:
+            self.mem_cache.add_readonly(start, end)
+        return self.mem_cache
+
+    def disable_mem_cache(self):
+        self.mem_cache = None
+
+    def page_hashes(self, regions, page_size=memory.MemorySnapshot.PAGE_SIZE, timeout=None):
+        # a crc32 per page of every (addr, length) region
+        hashes = []
+        for addr, length in regions:
+            data = self._read_bytes(addr, length)
+            hashes.append([zlib.crc32(data[offset:offset + page_size])
+                           for offset in range(0, length, page_size)])
+        return hashes
+
+    def mem_snapshot(self, regions, page_size=memory.MemorySnapshot.PAGE_SIZE):
+        # copies of the regions; reading them again costs no more than hashing them
+        return memory.MemorySnapshot(self.read_mem_bytes, regions, page_size=page_size)
+
+    def prefill_disasm(self, start, end=None, timeout=None):
+        # disassemble [start, end) (or the function containing start) once,
+        # with objdump on the ELF file
+        if self.elf is None:
+            return 0
+        link = start - self._bias
+        if end is None:
+            found = self.elf.symbol_at(link)
+            if found is None:
+                return 0
+            symbol, _ = found
+            link, end = symbol.value, symbol.value + max(symbol.size, 1)
+        else:
+            end -= self._bias
+        table = disasm.objdump(self.elfpath, link, end, bias=self._bias)
+        for addr, insn in table.items():
+            self.disasm_cache[addr] = insn.text
+            self._insn_sizes[addr] = insn.size
+        return len(table)
+
+    def read_disasm(self, pc=None, timeout=None):
+        # None for a pc outside the ELF file
+        if pc is None:
+            pc = self.read_pc()
+        if pc not in self.disasm_cache:
+            self.prefill_disasm(pc)
+        return self.disasm_cache.get(pc)
+
+    def read_return_address(self, timeout=None):
+        # valid at function entry: the word at sp on x86, the link register elsewhere
+        if self.arch.link is None:
+            sp = self.read_reg([self.arch.sp])[self.arch.sp]
+            return self.read_mem(sp, size=8)[0]
+        return self.read_reg([self.arch.link])[self.arch.link]
+
+    def read_function_range(self, symbol, timeout=None):
+        # [start, end) from the symbol table of the loaded ELF (link-time addresses)
+        if self.elf is None:
+            raise Exception("unknown size of function: {}".format(symbol))
+        return self.elf.function_range(symbol)
+
+    def trace(self, path, regs, start, end, exit='reach', step='ni', maxcount=1000,
+              disasm=True, timeout=None):
+        raise Exception('no in-debugger tracing with {}, use the step engine'.format(self.NAME))
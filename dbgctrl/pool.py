@@ -0,0 +1,116 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class SessionPool():
+    # keeps `size` debuggers running with the ELF loaded. Sessions are reset
+    # (and optionally run to the first instruction) in the background after
+    # release(), so acquire() hands out a ready one.
+    DEFAULT_SIZE = 4
+
+    def __init__(self, dbgpath, elfpath, size=DEFAULT_SIZE, start=False, **kwargs):
+        self.dbgpath = dbgpath
+        self.elfpath = elfpath
+        self.size = size
+        self.start = start
+        self._kwargs = kwargs
+        # ready sessions, and the errors of those that failed to open
+        self._idle: queue.Queue = queue.Queue()
+        self._sessions = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size)
+        for _ in range(size):
+            self._executor.submit(self._background, self._open)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _background(self, func, *args):
+        # errors are handed to the next acquire() instead of being lost; the
+        # session that failed is already closed
+        try:
+            func(*args)
+        except Exception as e:
+            self._idle.put(e)
+
+    def _open(self):
+        import dbgctrl
+        dbg = dbgctrl.controller(self.dbgpath, **self._kwargs)
+        with self._lock:
+            self._sessions.append(dbg)
+        try:
+            dbg.load(self.elfpath)
+            self._prepare(dbg)
+        except Exception:
+            self._discard(dbg)
+            raise
+
+    def _prepare(self, dbg):
+        if self.start:
+            dbg.run_stop_at_start()
+            if not dbg.wait_until_stopped():
+                raise Exception('target did not start: {}'.format(self.elfpath))
+        self._idle.put(dbg)
+
+    def _recycle(self, dbg):
+        try:
+            dbg.reset()
+            self._prepare(dbg)
+        except Exception:
+            self._replace(dbg)
+
+    def _replace(self, dbg):
+        self._discard(dbg)
+        self._open()
+
+    def _discard(self, dbg):
+        with self._lock:
+            if dbg in self._sessions:
+                self._sessions.remove(dbg)
+        try:
+            dbg.quit()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        try:
+            dbg = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError('no debugger session available')
+        if isinstance(dbg, Exception):
+            # the error took the place of a session: open another for its slot
+            self._executor.submit(self._background, self._open)
+            raise dbg
+        return dbg
+
+    def release(self, dbg, broken=False):
+        # a session that raised may be mid-command: start a fresh one instead
+        func = self._replace if broken else self._recycle
+        self._executor.submit(self._background, func, dbg)
+
+    @contextmanager
+    def session(self, timeout=None):
+        dbg = self.acquire(timeout=timeout)
+        broken = False
+        try:
+            yield dbg
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(dbg, broken=broken)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for dbg in sessions:
+            try:
+                dbg.quit()
+            except Exception:
+                pass
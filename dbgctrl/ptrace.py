@@ -0,0 +1,523 @@
+import ctypes
+import os
+import platform
+import re
+import signal
+import time
+from array import array
+from collections import namedtuple
+from typing import Any
+
+from dbgctrl import elf, memory
+from dbgctrl.native import NativeController
+from dbgctrl.register import MASK64, RegisterFile
+from dbgctrl.snapshot import Snapshot
+
+
+# native Linux tracing without a debugger: the program is started under
+# ptrace(2) and single stepped by this process. registers are the
+# NT_PRSTATUS register set (general purpose registers only), memory is read
+# with process_vm_readv(2) and written through /proc/PID/mem, breakpoints
+# are trap instructions patched into the code
+PTRACE_TRACEME = 0
+PTRACE_PEEKUSER = 3
+PTRACE_POKEUSER = 6
+PTRACE_CONT = 7
+PTRACE_KILL = 8
+PTRACE_SINGLESTEP = 9
+PTRACE_SETOPTIONS = 0x4200
+PTRACE_GETREGSET = 0x4204
+PTRACE_SETREGSET = 0x4205
+PTRACE_O_EXITKILL = 0x100000
+NT_PRSTATUS = 1
+ADDR_NO_RANDOMIZE = 0x0040000
+AT_NULL, AT_ENTRY = 0, 9
+# offsetof(struct user, u_debugreg) on x86_64
+DEBUGREG_OFFSET = 848
+DEBUGREG_COUNT = 4
+# DR7 length bits per watched size
+DEBUGREG_LENGTHS = {1: 0b00, 2: 0b01, 4: 0b11, 8: 0b10}
+DEBUGREG_WRITE = 0b01
+
+# names: the register set in kernel order (gdb names); order: the order of
+# `info registers`; trap: the breakpoint instruction; trap_offset: how far
+# past the trap the pc is reported
+Arch = namedtuple('Arch', ['machine', 'names', 'order', 'pc', 'sp', 'link', 'trap', 'trap_offset'])
+
+X86_64_REGS = [
+    'r15', 'r14', 'r13', 'r12', 'rbp', 'rbx', 'r11', 'r10', 'r9', 'r8', 'rax', 'rcx',
+    'rdx', 'rsi', 'rdi', 'orig_rax', 'rip', 'cs', 'eflags', 'rsp', 'ss', 'fs_base',
+    'gs_base', 'ds', 'es', 'fs', 'gs']
+AARCH64_REGS = ['x{}'.format(i) for i in range(31)] + ['sp', 'pc', 'cpsr']
+RISCV64_REGS = [
+    'pc', 'ra', 'sp', 'gp', 'tp', 't0', 't1', 't2', 'fp', 's1'] + \
+    ['a{}'.format(i) for i in range(8)] + ['s{}'.format(i) for i in range(2, 12)] + \
+    ['t{}'.format(i) for i in range(3, 7)]
+ARCHS = {
+    'x86_64': Arch(
+        62, X86_64_REGS,
+        ['rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rbp', 'rsp', 'r8', 'r9', 'r10', 'r11',
+         'r12', 'r13', 'r14', 'r15', 'rip', 'eflags', 'cs', 'ss', 'ds', 'es', 'fs', 'gs',
+         'fs_base', 'gs_base', 'orig_rax'],
+        'rip', 'rsp', None, b'\xcc', 1),
+    'aarch64': Arch(183, AARCH64_REGS, AARCH64_REGS, 'pc', 'sp', 'x30',
+                    (0xd4200000).to_bytes(4, 'little'), 0),
+    'riscv64': Arch(243, RISCV64_REGS, RISCV64_REGS[1:] + ['pc'], 'pc', 'sp', 'ra',
+                    (0x00100073).to_bytes(4, 'little'), 0),
+}
+# c.ebreak, for a compressed instruction
+RISCV_TRAP16 = (0x9002).to_bytes(2, 'little')
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+_libc = None
+
+
+def libc():
+    # loaded on first use, so the module imports on any platform
+    global _libc
+    if _libc is None:
+        lib = ctypes.CDLL(None, use_errno=True)
+        lib.ptrace.restype = ctypes.c_long
+        lib.ptrace.argtypes = [ctypes.c_long, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p]
+        lib.process_vm_readv.restype = ctypes.c_ssize_t
+        lib.process_vm_readv.argtypes = [
+            ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_ulong,
+            ctypes.POINTER(iovec), ctypes.c_ulong, ctypes.c_ulong]
+        lib.personality.argtypes = [ctypes.c_ulong]
+        _libc = lib
+    return _libc
+
+
+def ptrace(request, pid, addr=None, data=None):
+    # errno is only cleared for the PEEK requests, which may return -1
+    if request == PTRACE_PEEKUSER:
+        ctypes.set_errno(0)
+    result = (_libc or libc()).ptrace(request, pid, addr, data)
+    if result == -1:
+        errno = ctypes.get_errno()
+        if errno:
+            raise OSError(errno, 'ptrace({}): {}'.format(request, os.strerror(errno)))
+    return result
+
+
+class PtraceController(NativeController):
+    NAME = 'ptrace'
+
+    pattern_maps = re.compile(
+        r'([0-9a-f]+)-([0-9a-f]+) (\S+) \S+ \S+ \S+ *(.*)$', re.M)
+
+    def __init__(self, dbgpath=None):
+        # dbgpath is not used: the program is traced by this process
+        arch = ARCHS.get(platform.machine())
+        if arch is None:
+            raise Exception('ptrace is not supported on {}'.format(platform.machine()))
+        super().__init__(arch)
+        self.dbgpath = dbgpath
+        # set while the program runs
+        self._pid: Any = None
+        self._mem_fd: Any = None
+        self._signal = 0
+        # addr: the original bytes under the trap
+        self._breakpoints = {}
+        # number: debug register
+        self._watchpoints = {}
+        self._watch_count = 0
+        # id: (register words, [(addr, bytes)] of the writable mappings)
+        self._checkpoints = {}
+        self._regs = (ctypes.c_uint64 * len(self.arch.names))()
+        self._regs_iov = iovec(ctypes.addressof(self._regs), ctypes.sizeof(self._regs))
+        self._pc_index = self.arch.names.index(self.arch.pc)
+
+    def __del__(self):
+        self._kill()
+
+    def _count(self, kind, start):
+        self._stats.add_command([kind], time.perf_counter() - start)
+
+    def load(self, elfpath, timeout=None):
+        # the program is started by run_stop_at_start()
+        super().load(elfpath, timeout=timeout)
+        if self.elf and self.elf.machine != self.arch.machine:
+            raise Exception('not a native program: {}'.format(elfpath))
+
+    def quit(self):
+        self._kill()
+        print('ptrace exited.')
+        if self.elf:
+            self.elf.close()
+            self.elf = None
+
+    def run_stop_at_start(self, timeout=None):
+        # start the program stopped at its first instruction, like gdb `starti`.
+        # address space randomization is disabled, as gdb does
+        self._kill()
+        self._breakpoints.clear()
+        self._watchpoints.clear()
+        self._checkpoints.clear()
+        lib = libc()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                lib.personality(ADDR_NO_RANDOMIZE)
+                if lib.ptrace(PTRACE_TRACEME, 0, None, None) == 0:
+                    devnull = os.open(os.devnull, os.O_RDONLY)
+                    os.dup2(devnull, 0)
+                    os.execv(self.elfpath, [self.elfpath])
+            finally:
+                os._exit(127)
+        self._pid = pid
+        self._live = True
+        self._exit_status = None
+        self._signal = 0
+        self._pc = None
+        if self._wait() != signal.SIGTRAP:
+            self._kill()
+            raise Exception('program not started: {}'.format(self.elfpath))
+        ptrace(PTRACE_SETOPTIONS, pid, None, PTRACE_O_EXITKILL)
+        self._mem_fd = os.open('/proc/{}/mem'.format(pid), os.O_RDWR)
+        self._bias = self._read_bias()
+        print('ptrace start up.')
+        return self._status()
+
+    def reset(self, timeout=None):
+        # kill the program and drop breakpoints; the ELF stays loaded
+        self._kill()
+        self._breakpoints.clear()
+        self._watchpoints.clear()
+        self._checkpoints.clear()
+
+    def _kill(self):
+        if self._mem_fd is not None:
+            os.close(self._mem_fd)
+            self._mem_fd = None
+        if self._pid is not None:
+            try:
+                os.kill(self._pid, signal.SIGKILL)
+                os.waitpid(self._pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self._pid = None
+        self._live = False
+
+    def _wait(self, timeout=None):
+        # the signal that stopped the program, or None when it has ended
+        if timeout is None:
+            _, status = os.waitpid(self._pid, 0)
+        else:
+            timeout_time = time.time() + timeout
+            delay = 0.0001
+            while True:
+                pid, status = os.waitpid(self._pid, os.WNOHANG)
+                if pid:
+                    break
+                if time.time() >= timeout_time:
+                    if self._stats is not None:
+                        self._stats.timeouts += 1
+                    raise TimeoutError('program not stopped')
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        self._pc = None
+        if os.WIFSTOPPED(status):
+            sig = os.WSTOPSIG(status)
+            # other signals are delivered when the program is resumed
+            self._signal = 0 if sig == signal.SIGTRAP else sig
+            return sig
+        self._exit_status = os.waitstatus_to_exitcode(status)
+        self._pid = None
+        self._live = False
+        if self._mem_fd is not None:
+            os.close(self._mem_fd)
+            self._mem_fd = None
+        return None
+
+    def _read_bias(self):
+        # shift of a PIE executable: AT_ENTRY of the auxiliary vector against e_entry
+        if self.elf is None or self.elf.type != elf.ET_DYN:
+            return 0
+        with open('/proc/{}/auxv'.format(self._pid), 'rb') as f:
+            auxv = array('Q', f.read())
+        for i in range(0, len(auxv) - 1, 2):
+            if auxv[i] == AT_NULL:
+                break
+            if auxv[i] == AT_ENTRY:
+                return auxv[i + 1] - self.elf.entry
+        return 0
+
+    def _trap(self, original):
+        if self.arch.machine == ARCHS['riscv64'].machine and original[0] & 3 != 3:
+            return RISCV_TRAP16
+        return self.arch.trap
+
+    def _insert_breakpoints(self, addrs, timeout=None):
+        for addr in addrs:
+            if addr in self._breakpoints or not self._live:
+                continue
+            original = self._read_raw(addr, len(self.arch.trap))
+            trap = self._trap(original)
+            self._breakpoints[addr] = original[:len(trap)]
+            os.pwrite(self._mem_fd, trap, addr)
+
+    def _remove_breakpoints(self, addrs, timeout=None):
+        for addr in addrs:
+            original = self._breakpoints.pop(addr, None)
+            if original is not None and self._live:
+                os.pwrite(self._mem_fd, original, addr)
+
+    def _single_step(self):
+        # a trap at pc is lifted for the step
+        original = None
+        if self._breakpoints:
+            pc = self._pc if self._pc is not None else self.read_pc()
+            original = self._breakpoints.get(pc)
+            if original is not None:
+                os.pwrite(self._mem_fd, original, pc)
+        self._invalidate()
+        if self._stats is not None:
+            start = time.perf_counter()
+        ptrace(PTRACE_SINGLESTEP, self._pid, None, self._signal)
+        sig = self._wait()
+        if self._stats is not None:
+            self._count('PTRACE_SINGLESTEP', start)
+        if original is not None and self._live:
+            os.pwrite(self._mem_fd, self._trap(original), pc)
+        return sig
+
+    def _resume(self, timeout=None):
+        # continue to a breakpoint, a watchpoint or a signal. the pc is moved
+        # back onto a breakpoint it has passed
+        if timeout is None:
+            timeout = PtraceController.DEFAULT_TRACE_TIMEOUT
+        if self._breakpoints:
+            pc = self._pc if self._pc is not None else self.read_pc()
+            if pc in self._breakpoints:
+                self._single_step()
+                if not self._live or self.read_pc() in self._breakpoints:
+                    return self._live
+        self._invalidate()
+        if self._stats is not None:
+            start = time.perf_counter()
+        ptrace(PTRACE_CONT, self._pid, None, self._signal)
+        sig = self._wait(timeout)
+        if self._stats is not None:
+            self._count('PTRACE_CONT', start)
+        if sig == signal.SIGTRAP and self.arch.trap_offset:
+            words = self._read_words()
+            addr = words[self._pc_index] - self.arch.trap_offset
+            if addr in self._breakpoints:
+                self._regs[self._pc_index] = addr
+                ptrace(PTRACE_SETREGSET, self._pid, NT_PRSTATUS, ctypes.byref(self._regs_iov))
+                self._pc = addr
+        return self._live
+
+    def _run_to(self, addr, timeout=None):
+        if addr in self._breakpoints:
+            return self._resume(timeout)
+        self._insert_breakpoints([addr])
+        try:
+            return self._resume(timeout)
+        finally:
+            self._remove_breakpoints([addr])
+
+    def _step(self, step, timeout=None):
+        if step == 'si':
+            return self._single_step()
+        if step == 'c':
+            return self._resume(timeout)
+        if step != 'ni':
+            raise ValueError('only si, ni and c with ptrace: {}'.format(step))
+        ret = self._call_return(self._pc if self._pc is not None else self.read_pc())
+        if ret is not None:
+            return self._run_to(ret, timeout)
+        return self._single_step()
+
+    def run_steps(self, step, count, timeout=None):
+        # breakpoints would end the run early, so all are deleted first
+        self._remove_breakpoints(list(self._breakpoints))
+        for _ in range(count):
+            if not self._live:
+                break
+            self._step(step, timeout)
+        return self._status()
+
+    def run_to_hit(self, addr, hits, timeout=None):
+        # continue until addr is reached for the `hits`-th time.
+        # False when the program ended first
+        self._remove_breakpoints(list(self._breakpoints))
+        self._insert_breakpoints([addr])
+        for _ in range(hits):
+            if not self._resume(timeout):
+                break
+        self._remove_breakpoints([addr])
+        return self._live
+
+    def _debugreg(self, i):
+        return ptrace(PTRACE_PEEKUSER, self._pid, DEBUGREG_OFFSET + 8 * i) & MASK64
+
+    def _set_debugreg(self, i, value):
+        ptrace(PTRACE_POKEUSER, self._pid, DEBUGREG_OFFSET + 8 * i, value)
+
+    def watch(self, addr, size, timeout=None):
+        # a hardware watchpoint on writes of `size` (1, 2, 4 or 8) bytes at
+        # addr, in a free x86 debug register
+        if self.arch.machine != ARCHS['x86_64'].machine:
+            raise Exception('hardware watchpoints need x86_64 with ptrace')
+        if size not in DEBUGREG_LENGTHS or addr % size:
+            raise ValueError('watchpoint of {} bytes at {}'.format(size, hex(addr)))
+        used = set(self._watchpoints.values())
+        free = [i for i in range(DEBUGREG_COUNT) if i not in used]
+        if not free:
+            raise Exception('no free debug register for a watchpoint')
+        i = free[0]
+        self._set_debugreg(i, addr)
+        control = (1 << (2 * i)) | \
+            ((DEBUGREG_LENGTHS[size] << 2 | DEBUGREG_WRITE) << (16 + 4 * i))
+        self._set_debugreg(7, self._debugreg(7) | control)
+        self._watch_count += 1
+        self._watchpoints[self._watch_count] = i
+        return self._watch_count
+
+    def unwatch(self, number, timeout=None):
+        i = self._watchpoints.pop(number)
+        if self._live:
+            self._set_debugreg(7, self._debugreg(7) & ~((3 << (2 * i)) | (0xf << (16 + 4 * i))))
+
+    def run_to_watch(self, timeout=None):
+        # continue until the program stops: the numbers of the watchpoints that
+        # fired ([] for a breakpoint), None when the program ended
+        if not self._resume(timeout):
+            return None
+        if not self._watchpoints:
+            return []
+        status = self._debugreg(6)
+        self._set_debugreg(6, 0)
+        return [n for n, i in self._watchpoints.items() if status & (1 << i)]
+
+    def write_reg(self, name, value, timeout=None):
+        words = self._read_words()
+        words[self.arch.names.index(name)] = value & MASK64
+        ptrace(PTRACE_SETREGSET, self._pid, NT_PRSTATUS, ctypes.byref(self._regs_iov))
+        self._pc = None
+
+    def write_mem(self, addr, value, size=8, timeout=None):
+        # an integer of `size` (1, 2, 4 or 8) bytes at addr
+        if size not in (1, 2, 4, 8):
+            raise ValueError('unsupported write size: {}'.format(size))
+        if not self._live:
+            raise Exception('The program is not being run.')
+        data = (value & ((1 << size * 8) - 1)).to_bytes(size, self._byteorder)
+        os.pwrite(self._mem_fd, data, addr)
+        if self.mem_cache:
+            self.mem_cache.invalidate()
+
+    def checkpoint(self, timeout=None):
+        # not a fork like gdb's: a copy of the general registers and of the
+        # writable mappings, written back by restart(). files, the brk and
+        # mappings made after the checkpoint are not rewound
+        words = bytes(self._read_words())
+        regions = [(m.start, bytes(self._read_raw(m.start, m.end - m.start)))
+                   for m in self.read_mappings()
+                   if 'w' in m.perms and m.name not in ('[vvar]', '[vsyscall]')]
+        checkpoint = len(self._checkpoints) + 1
+        self._checkpoints[checkpoint] = (words, regions)
+        return checkpoint
+
+    def restart(self, checkpoint, timeout=None):
+        words, regions = self._checkpoints[checkpoint]
+        if not self._live:
+            raise Exception('The program is not being run.')
+        # the regions are clipped to the mappings of now: memory unmapped since
+        # the checkpoint is skipped, and nothing is written unless every mapped
+        # part is still writable
+        mappings = self.read_mappings()
+        writes = []
+        for addr, data in regions:
+            view = memoryview(data)
+            for m in mappings:
+                start, end = max(addr, m.start), min(addr + len(data), m.end)
+                if start >= end:
+                    continue
+                if 'w' not in m.perms:
+                    raise Exception('checkpoint {} not restored: {} is not writable'.format(
+                        checkpoint, hex(start)))
+                writes.append((start, view[start - addr:end - addr]))
+        for addr, data in writes:
+            n = os.pwrite(self._mem_fd, data, addr)
+            if n != len(data):
+                raise Exception('checkpoint {} restored partly: {} of {} bytes at {}'.format(
+                    checkpoint, n, len(data), hex(addr)))
+        ctypes.memmove(self._regs, words, len(words))
+        self._regs_iov.iov_len = ctypes.sizeof(self._regs)
+        ptrace(PTRACE_SETREGSET, self._pid, NT_PRSTATUS, ctypes.byref(self._regs_iov))
+        self._signal = 0
+        self._invalidate()
+
+    def _read_words(self):
+        # the register set as words in kernel order
+        if not self._live:
+            raise Exception('The program is not being run.')
+        if self._stats is not None:
+            start = time.perf_counter()
+        self._regs_iov.iov_len = ctypes.sizeof(self._regs)
+        ptrace(PTRACE_GETREGSET, self._pid, NT_PRSTATUS, ctypes.byref(self._regs_iov))
+        if self._stats is not None:
+            self._count('PTRACE_GETREGSET', start)
+        words = self._regs
+        self._pc = words[self._pc_index]
+        return words
+
+    def read_pc(self, timeout=None):
+        if self._pc is None:
+            self._read_words()
+        return self._pc
+
+    def _read_raw(self, addr, length):
+        # process_vm_readv into a new buffer; traps read as inserted
+        if not self._live:
+            raise Exception('The program is not being run.')
+        if self._stats is not None:
+            start = time.perf_counter()
+        buf = bytearray(length)
+        local = iovec(ctypes.addressof((ctypes.c_char * length).from_buffer(buf)), length)
+        remote = iovec(addr, length)
+        n = libc().process_vm_readv(self._pid, ctypes.byref(local), 1, ctypes.byref(remote), 1, 0)
+        if self._stats is not None:
+            self._count('process_vm_readv', start)
+            self._stats.bytes_read += max(n, 0)
+        if n != length:
+            raise Exception('memory read failed at {}'.format(hex(addr + max(n, 0))))
+        return buf
+
+    def _read_bytes(self, addr, length, timeout=None):
+        # the original code under breakpoints, as gdb shows it
+        buf = self._read_raw(addr, length) if length else bytearray()
+        for bp, original in self._breakpoints.items():
+            if addr - len(original) < bp < addr + length:
+                for i, b in enumerate(original):
+                    if addr <= bp + i < addr + length:
+                        buf[bp + i - addr] = b
+        return buf
+
+    def read_mappings(self, timeout=None):
+        with open('/proc/{}/maps'.format(self._pid)) as f:
+            maps = f.read()
+        return [memory.Mapping(int(m.group(1), 16), int(m.group(2), 16), m.group(3),
+                               m.group(4).strip())
+                for m in self.pattern_maps.finditer(maps)]
+
+    def snapshot(self, regs=None, disasm=True, mem=(), step=None, timeout=None):
+        # step, registers (with the pc) and memory without leaving this process
+        layout = self.read_reg_layout().subset(regs)
+        if step is not None:
+            self._step(step, timeout)
+            if not self._live:
+                return Snapshot(None, RegisterFile(layout), None, [[] for _ in mem])
+        words = self._read_words()
+        pc = self._pc
+        values = self._parse_regs(words, layout)
+        mems = [self.read_mem(addr, size=size, count=count) for addr, size, count in mem]
+        dis = self.read_disasm(pc) if disasm else None
+        return Snapshot(pc, values, dis, mems)
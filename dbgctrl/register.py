@@ -0,0 +1,100 @@
+from array import array
+
+
+MASK64 = (1 << 64) - 1
+
+
+class RegisterLayout():
+    # register names and their order for one target, shared by all RegisterFiles
+    __slots__ = ('names', 'categories', 'index', '_byte_index', '_subsets')
+
+    def __init__(self, names, categories=None):
+        self.names = tuple(names)
+        if categories is None:
+            categories = ('-',) * len(self.names)
+        self.categories = tuple(categories)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self._byte_index = None
+        self._subsets = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __repr__(self):
+        return 'RegisterLayout({!r})'.format(self.names)
+
+    @property
+    def byte_index(self):
+        # names as bytes, for parsing replies without decoding them
+        if self._byte_index is None:
+            self._byte_index = {name.encode(): i for name, i in self.index.items()}
+        return self._byte_index
+
+    def subset(self, names):
+        # layouts are cached per name list, so snapshots of the same registers share one
+        if names is None:
+            return self
+        key = tuple(names)
+        layout = self._subsets.get(key)
+        if layout is None:
+            picked = [name for name in dict.fromkeys(key) if name in self.index]
+            layout = RegisterLayout(picked, [self.categories[self.index[n]] for n in picked])
+            self._subsets[key] = layout
+        return layout
+
+
+class RegisterFile():
+    # register values of one snapshot, stored as unsigned 64-bit words
+    __slots__ = ('layout', 'values')
+
+    def __init__(self, layout, values=None):
+        self.layout = layout
+        if values is None:
+            self.values = array('Q', bytes(8 * len(layout)))
+        else:
+            self.values = array('Q', values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, name):
+        return name in self.layout.index
+
+    def __iter__(self):
+        return iter(self.layout.names)
+
+    def __getitem__(self, name):
+        return self.values[self.layout.index[name]]
+
+    def __setitem__(self, name, value):
+        self.values[self.layout.index[name]] = value & MASK64
+
+    def __eq__(self, other):
+        if not isinstance(other, RegisterFile):
+            return NotImplemented
+        return self.layout.names == other.layout.names and self.values == other.values
+
+    def __repr__(self):
+        return 'RegisterFile({!r})'.format(self.to_dict())
+
+    def get(self, name, default=None):
+        i = self.layout.index.get(name)
+        return default if i is None else self.values[i]
+
+    def keys(self):
+        return self.layout.names
+
+    def items(self):
+        return zip(self.layout.names, self.values)
+
+    def category(self, name):
+        return self.layout.categories[self.layout.index[name]]
+
+    def to_dict(self):
+        return dict(zip(self.layout.names, self.values))
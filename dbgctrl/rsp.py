@@ -0,0 +1,708 @@
+import os
+import re
+import select
+import socket
+import subprocess
+import time
+import xml.etree.ElementTree as ElementTree
+from typing import Any, Callable, Optional
+
+from dbgctrl import elf, memory
+from dbgctrl.native import NativeController
+from dbgctrl.register import MASK64, RegisterFile, RegisterLayout
+from dbgctrl.snapshot import Snapshot
+
+
+# the gdb remote serial protocol, spoken directly to gdbserver, lldb-server
+# or a gdb stub (qemu -s), without a debugger process in between: registers
+# come from one `g` packet, memory from binary `x` (or hex `m`) packets, and
+# the packets of one step are sent together (see NativeController for the
+# disassembly and gdb commands)
+AT_NULL, AT_ENTRY = 0, 9
+XINCLUDE_NS = b'http://www.w3.org/2001/XInclude'
+XINCLUDE = '{' + XINCLUDE_NS.decode() + '}include'
+EM_386, EM_X86_64, EM_RISCV = 3, 62, 243
+
+pattern_escape = re.compile(rb'\}(.)|\*(.)', re.S)
+
+
+def checksum(data):
+    return sum(data) & 0xff
+
+
+def decode(data):
+    # undo the '}' escapes and the '*' run-length encoding of a reply
+    if b'}' not in data and b'*' not in data:
+        return bytes(data)
+    out = bytearray()
+    pos = 0
+    for m in pattern_escape.finditer(data):
+        out += data[pos:m.start()]
+        if m.group(1) is not None:
+            out.append(m.group(1)[0] ^ 0x20)
+        else:
+            out += out[-1:] * (m.group(2)[0] - 29)
+        pos = m.end()
+    out += data[pos:]
+    return bytes(out)
+
+
+def packet_kind(packet):
+    # 'qXfer', 'vCont', 'Z0', 'm', ... for the stats
+    if packet[:1] in b'qQv':
+        return re.split(rb'[^A-Za-z]', packet, maxsplit=1)[0].decode()
+    if packet[:1] in b'Zz':
+        return packet[:2].decode()
+    return packet[:1].decode()
+
+
+class RSPController(NativeController):
+    NAME = 'rsp'
+    DEFAULT_TIMEOUT = 30.0
+    RECV_SIZE = 1 << 16
+    # replies may be shorter than PacketSize; reads are split below it
+    PACKET_MARGIN = 64
+    PC_NAMES = ('pc', 'rip', 'eip')
+    SP_NAMES = ('sp', 'rsp', 'esp')
+    LINK_NAMES = ('lr', 'x30', 'ra')
+    # breakpoint kinds of Z0 by ELF machine (the length of the instruction replaced)
+    BREAKPOINT_KINDS = {EM_386: 1, EM_X86_64: 1}
+
+    def __init__(self, dbgpath=None, address=None):
+        # dbgpath: gdbserver or lldb-server, started for the program by
+        # run_stop_at_start(); address: host:port of a running stub instead
+        super().__init__()
+        self.dbgpath = dbgpath
+        self.address = address
+        # the process, the file descriptors and the ELF are set while open
+        self._process: Any = None
+        self._sock = None
+        self._rfd: Any = None
+        self._wfd: Any = None
+        self._buffer = bytearray()
+        self._ack = True
+        self._features = {}
+        self._packet_size = 4096
+        self._binary = False
+        self._vcont = False
+        self._tdesc: Any = None
+        self._g_size = None
+        self._reg_slices = {}
+        self._breakpoints = set()
+        self._watchpoints = {}
+        self._watch_count = 0
+        self._thread = None
+        self._pid = None
+        if dbgpath is not None:
+            self.check_debugger_exists()
+
+    def __del__(self):
+        self._close()
+
+    def check_debugger_exists(self):
+        if os.path.exists(self.dbgpath):
+            return
+        raise Exception('debugger not found: {}'.format(self.dbgpath))
+
+    def open_debugger(self, timeout=None):
+        # start (or connect to) the stub; the program stops at its first instruction
+        if timeout is None:
+            timeout = RSPController.DEFAULT_TIMEOUT
+        if self.address is not None:
+            host, _, port = self.address.rpartition(':')
+            self._connect(host or 'localhost', int(port), timeout)
+        elif 'lldb-server' in os.path.basename(self.dbgpath):
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+            self._process = subprocess.Popen(
+                [self.dbgpath, 'gdbserver', '127.0.0.1:{}'.format(port), '--', self.elfpath],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self._connect('127.0.0.1', port, timeout)
+        else:
+            # gdbserver speaks the protocol on its stdin and stdout with `-`
+            self._process = subprocess.Popen(
+                [self.dbgpath, '--once', '-', self.elfpath],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                bufsize=0)
+            self._rfd = self._process.stdout.fileno()
+            self._wfd = self._process.stdin.fileno()
+        self._buffer = bytearray()
+        self._ack = True
+        reply = self._request(['qSupported:swbreak+;hwbreak+;xmlRegisters=i386'], timeout)[0]
+        for item in reply.decode().split(';'):
+            if item.endswith(('+', '-')):
+                self._features[item[:-1]] = item[-1]
+            elif '=' in item:
+                key, value = item.split('=', 1)
+                self._features[key] = value
+        self._packet_size = int(self._features.get('PacketSize', '1000'), 16)
+        self._binary = self._features.get('binary-upload') == '+'
+        if self._features.get('QStartNoAckMode') == '+':
+            if self._request(['QStartNoAckMode'], timeout)[0] == b'OK':
+                self._ack = False
+        self._vcont = b';s' in self._request(['vCont?'], timeout)[0]
+        self._parse_stop(self._request(['?'], timeout)[0])
+        self._bias = self._read_bias(timeout)
+        print('rsp start up.')
+
+    def _connect(self, host, port, timeout):
+        timeout_time = time.time() + timeout
+        while True:
+            try:
+                self._sock = socket.create_connection((host, port), timeout=timeout)
+                break
+            except OSError:
+                # the stub may not listen yet
+                if time.time() >= timeout_time:
+                    raise
+                time.sleep(0.05)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._rfd = self._wfd = self._sock.fileno()
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process.communicate()
+            self._process = None
+        self._rfd = self._wfd = None
+        self._live = False
+
+    def _send(self, packets):
+        data = b''.join(b'$%s#%02x' % (p, checksum(p)) for p in packets)
+        view = memoryview(data)
+        while view:
+            n = os.write(self._wfd, view)
+            view = view[n:]
+
+    def _receive(self, count, timeout):
+        # the next `count` replies; '+' acks and notifications are skipped
+        timeout_time = time.time() + timeout
+        stats = self._stats
+        replies: list = []
+        buf = self._buffer
+        while len(replies) < count:
+            start = buf.find(b'$')
+            end = buf.find(b'#', start) if start >= 0 else -1
+            if end >= 0 and len(buf) >= end + 3:
+                payload = bytes(buf[start + 1:end])
+                if int(buf[end + 1:end + 3], 16) != checksum(payload):
+                    raise Exception('rsp checksum error: {!r}'.format(payload[:64]))
+                del buf[:end + 3]
+                if self._ack:
+                    os.write(self._wfd, b'+')
+                if payload[:1] == b'O' and payload != b'OK':
+                    # console output of the program
+                    continue
+                replies.append(payload)
+                continue
+            select_timeout = timeout_time - time.time()
+            if select_timeout <= 0:
+                if stats is not None:
+                    stats.timeouts += 1
+                raise TimeoutError('rsp stub not responding')
+            if stats is not None:
+                select_start = time.perf_counter()
+            rready, _, _ = select.select([self._rfd], [], [], select_timeout)
+            if stats is not None:
+                stats.add_phase('select', time.perf_counter() - select_start)
+            if not rready:
+                continue
+            data = os.read(self._rfd, RSPController.RECV_SIZE)
+            if not data:
+                raise EOFError('rsp stub exited')
+            if stats is not None:
+                stats.bytes_read += len(data)
+            buf += data
+        if stats is not None:
+            parse_start = time.perf_counter()
+        replies = [decode(r) for r in replies]
+        if stats is not None:
+            stats.add_phase('decode', time.perf_counter() - parse_start)
+        return replies
+
+    def _request(self, packets, timeout=None):
+        # packets are pipelined: all are written, then the replies read in order
+        if timeout is None:
+            timeout = RSPController.DEFAULT_TIMEOUT
+        packets = [p.encode() if isinstance(p, str) else p for p in packets]
+        if self._rfd is None:
+            raise Exception('rsp stub not connected')
+        if self._stats is not None:
+            start = time.perf_counter()
+        self._send(packets)
+        replies = self._receive(len(packets), timeout)
+        if self._stats is not None:
+            self._stats.add_command(
+                [packet_kind(p) for p in packets], time.perf_counter() - start)
+        return replies
+
+    def _parse_stop(self, reply):
+        # T/S: stopped; W/X: the process has ended
+        kind = reply[:1]
+        if kind in (b'W', b'X'):
+            self._live = False
+            self._exit_status = int(reply[1:3], 16)
+            return None
+        if kind not in (b'T', b'S'):
+            raise Exception('unexpected stop reply: {!r}'.format(reply[:64]))
+        self._live = True
+        info = {}
+        for item in reply[3:].split(b';'):
+            key, _, value = item.partition(b':')
+            if key:
+                info[key.decode()] = value.decode()
+        thread = info.get('thread')
+        if thread:
+            self._thread = thread
+            if thread.startswith('p'):
+                self._pid = int(thread[1:].split('.')[0], 16)
+        return info
+
+    def _read_xfer(self, obj, annex, timeout=None):
+        data = b''
+        size = self._packet_size - RSPController.PACKET_MARGIN
+        while True:
+            reply = self._request(
+                ['qXfer:{}:read:{}:{:x},{:x}'.format(obj, annex, len(data), size)], timeout)[0]
+            if reply[:1] not in (b'm', b'l'):
+                raise Exception('qXfer:{} failed: {!r}'.format(obj, reply[:64]))
+            data += reply[1:]
+            if reply[:1] == b'l':
+                return data
+
+    def _read_bias(self, timeout=None):
+        # shift of a PIE executable: AT_ENTRY of the auxiliary vector against e_entry
+        if self.elf is None or self.elf.type != elf.ET_DYN:
+            return 0
+        if self._features.get('qXfer:auxv:read') != '+':
+            return 0
+        auxv = self._read_xfer('auxv', '', timeout)
+        size = self.elf.bits // 8
+        for i in range(0, len(auxv) - 2 * size + 1, 2 * size):
+            key = int.from_bytes(auxv[i:i + size], self._byteorder)
+            if key == AT_NULL:
+                break
+            if key == AT_ENTRY:
+                return int.from_bytes(auxv[i + size:i + 2 * size], self._byteorder) - self.elf.entry
+        return 0
+
+    def _read_tdesc(self, timeout=None):
+        # [(name, regnum, size, feature)] from target.xml and its includes
+        if self._features.get('qXfer:features:read') != '+':
+            raise Exception('the stub does not send a target description')
+        regs = []
+        pending = ['target.xml']
+        regnum = 0
+        while pending:
+            xml = self._read_xfer('features', pending.pop(0), timeout)
+            if b'xi:include' in xml and b'xmlns:xi' not in xml:
+                # gdbserver relies on the DTD to declare the xi prefix
+                xml = xml.replace(b'<target', b'<target xmlns:xi="' + XINCLUDE_NS + b'"', 1)
+            root = ElementTree.fromstring(xml)
+            features = [root] if root.tag == 'feature' else list(root)
+            for node in features:
+                if node.tag == XINCLUDE:
+                    pending.append(node.attrib['href'])
+                elif node.tag == 'feature':
+                    for reg in node.iter('reg'):
+                        regnum = int(reg.get('regnum', regnum))
+                        regs.append((reg.attrib['name'], regnum, int(reg.attrib['bitsize']) // 8,
+                                     node.get('name', '-')))
+                        regnum += 1
+        return sorted(regs, key=lambda r: r[1])
+
+    def _reg_offsets(self):
+        # offset of each register in the `g` reply, in register number order
+        offsets = {}
+        offset = 0
+        for name, regnum, size, _ in self._tdesc:
+            offsets[name] = (regnum, offset, size)
+            offset += size
+        return offsets
+
+    def load(self, elfpath, timeout=None):
+        # the program is started by run_stop_at_start()
+        super().load(elfpath, timeout=timeout)
+
+    def quit(self):
+        if self._wfd is not None:
+            try:
+                self._send([b'k'])
+            except OSError:
+                pass
+        self._close()
+        print('rsp exited.')
+        if self.elf:
+            self.elf.close()
+            self.elf = None
+
+    def run_stop_at_start(self, timeout=None):
+        if not self._live:
+            self._close()
+            self._breakpoints.clear()
+            self._watchpoints.clear()
+            self.open_debugger(timeout=timeout)
+        return self._status()
+
+    def reset(self, timeout=None):
+        # kill the target and drop breakpoints; the ELF stays loaded
+        if self._wfd is not None:
+            self._send([b'k'])
+        self._close()
+        self._breakpoints.clear()
+        self._watchpoints.clear()
+
+    def _exec(self, cmd, timeout):
+        # the gdb commands of NativeController, and `maint packet`
+        if cmd.startswith('maint packet '):
+            return self._request([cmd[len('maint packet '):]], timeout)[0].decode(
+                errors='replace') + '\n'
+        return super()._exec(cmd, timeout)
+
+    def _breakpoint_kind(self, addr, timeout=None):
+        machine = self.elf.machine if self.elf else EM_X86_64
+        if machine == EM_RISCV:
+            # compressed instructions are 2 bytes long
+            return 4 if self._read_bytes(addr, 2, timeout)[0] & 3 == 3 else 2
+        return self.BREAKPOINT_KINDS.get(machine, 4)
+
+    def _breakpoint_packet(self, op, addr, timeout=None):
+        return '{}0,{:x},{:x}'.format(op, addr, self._breakpoint_kind(addr, timeout))
+
+    def _insert_breakpoints(self, addrs, timeout=None):
+        addrs = [addr for addr in dict.fromkeys(addrs) if addr not in self._breakpoints]
+        replies = self._request([self._breakpoint_packet('Z', a, timeout) for a in addrs], timeout)
+        for addr, reply in zip(addrs, replies):
+            if reply != b'OK':
+                raise Exception('breakpoint not set at {}: {!r}'.format(hex(addr), reply))
+            self._breakpoints.add(addr)
+
+    def _remove_breakpoints(self, addrs, timeout=None):
+        self._request([self._breakpoint_packet('z', a, timeout) for a in addrs], timeout)
+        self._breakpoints.difference_update(addrs)
+
+    def _step_packet(self):
+        if not self._vcont:
+            return b's'
+        if self._thread:
+            return 'vCont;s:{}'.format(self._thread).encode()
+        return b'vCont;s'
+
+    def _resume_packet(self):
+        return b'vCont;c' if self._vcont else b'c'
+
+    def _step_packets(self, step, pc=None):
+        # the packets of one instruction step and the index of the stop reply.
+        # `ni` runs over a call to the next instruction, which needs the
+        # disassembly of pc (prefill_disasm); without it, it steps into the call
+        if step not in ('si', 'ni', 'c'):
+            raise ValueError('only si, ni and c over the remote protocol: {}'.format(step))
+        if step == 'c':
+            self._invalidate()
+            return [self._resume_packet()], 0
+        if step == 'ni':
+            if pc is None:
+                pc = self._pc if self._pc is not None else self.read_pc()
+            ret = self._call_return(pc)
+            if ret is not None:
+                if ret in self._breakpoints:
+                    self._invalidate()
+                    return [self._resume_packet()], 0
+                packets = [self._breakpoint_packet('Z', ret), self._resume_packet(),
+                           self._breakpoint_packet('z', ret)]
+                self._invalidate()
+                return packets, 1
+        self._invalidate()
+        return [self._step_packet()], 0
+
+    def _step(self, step, timeout=None):
+        packets, i = self._step_packets(step)
+        return self._parse_stop(self._request(packets, timeout)[i])
+
+    def _resume(self, timeout=None):
+        if timeout is None:
+            timeout = RSPController.DEFAULT_TRACE_TIMEOUT
+        self._invalidate()
+        return self._parse_stop(self._request([self._resume_packet()], timeout)[0])
+
+    def _run_to(self, addr, timeout=None):
+        # continue with a temporary breakpoint at addr
+        if addr in self._breakpoints:
+            return self._resume(timeout)
+        self._invalidate()
+        replies = self._request([self._breakpoint_packet('Z', addr), self._resume_packet(),
+                                 self._breakpoint_packet('z', addr)],
+                                timeout or RSPController.DEFAULT_TRACE_TIMEOUT)
+        return self._parse_stop(replies[1])
+
+    def run_steps(self, step, count, timeout=None):
+        # `si` steps are pipelined, up to a thousand per write
+        if timeout is None:
+            timeout = RSPController.DEFAULT_TRACE_TIMEOUT
+        self._remove_breakpoints(list(self._breakpoints), timeout)
+        while count > 0 and self._live:
+            if step == 'si':
+                n = min(count, 1000)
+                self._invalidate()
+                for reply in self._request([self._step_packet()] * n, timeout):
+                    if self._parse_stop(reply) is None:
+                        break
+            else:
+                n = 1
+                self._step(step, timeout)
+            count -= n
+        return self._status()
+
+    def run_to_hit(self, addr, hits, timeout=None):
+        # continue until addr is reached for the `hits`-th time.
+        # False when the program ended first
+        self._remove_breakpoints(list(self._breakpoints), timeout)
+        self._insert_breakpoints([addr], timeout)
+        for _ in range(hits):
+            if self._resume(timeout) is None:
+                break
+        if self._live:
+            self._remove_breakpoints([addr], timeout)
+        return self._live
+
+    def watch(self, addr, size, timeout=None):
+        # a hardware watchpoint (Z2) on writes of `size` bytes at addr
+        reply = self._request(['Z2,{:x},{:x}'.format(addr, size)], timeout)[0]
+        if reply != b'OK':
+            raise Exception('watchpoint not set: {!r}'.format(reply))
+        self._watch_count += 1
+        self._watchpoints[self._watch_count] = (addr, size)
+        return self._watch_count
+
+    def unwatch(self, number, timeout=None):
+        addr, size = self._watchpoints.pop(number)
+        self._request(['z2,{:x},{:x}'.format(addr, size)], timeout)
+
+    def run_to_watch(self, timeout=None):
+        # continue until the target stops: the numbers of the watchpoints that
+        # fired ([] for a breakpoint), None when the program ended
+        info = self._resume(timeout)
+        if info is None:
+            return None
+        if 'watch' not in info:
+            return []
+        addr = int(info['watch'], 16)
+        return [n for n, (start, size) in self._watchpoints.items()
+                if start <= addr < start + size]
+
+    def write_reg(self, name, value, timeout=None):
+        self.read_reg_layout(timeout=timeout)
+        regnum, _, size = self._reg_offsets()[name]
+        data = (value & ((1 << size * 8) - 1)).to_bytes(size, self._byteorder)
+        reply = self._request(['P{:x}={}'.format(regnum, data.hex())], timeout)[0]
+        if reply != b'OK':
+            raise Exception('register not written: {!r}'.format(reply))
+        self._pc = None
+
+    def write_mem(self, addr, value, size=8, timeout=None):
+        # an integer of `size` (1, 2, 4 or 8) bytes at addr
+        if size not in (1, 2, 4, 8):
+            raise ValueError('unsupported write size: {}'.format(size))
+        data = (value & ((1 << size * 8) - 1)).to_bytes(size, self._byteorder)
+        reply = self._request(['M{:x},{:x}:{}'.format(addr, size, data.hex())], timeout)[0]
+        if reply != b'OK':
+            raise Exception('memory not written: {!r}'.format(reply))
+        if self.mem_cache:
+            self.mem_cache.invalidate()
+
+    def checkpoint(self, timeout=None):
+        raise Exception('rsp stubs have no checkpoints')
+
+    def restart(self, checkpoint, timeout=None):
+        raise Exception('rsp stubs have no checkpoints')
+
+    def read_reg_layout(self, timeout=5):
+        # the register list is read once per target and reused by every read_reg()
+        if self._reg_layout is None:
+            self._tdesc = self._read_tdesc(timeout)
+            self._reg_layout = RegisterLayout(
+                [r[0] for r in self._tdesc], [r[3] for r in self._tdesc])
+            self._reg_slices = {}
+        return self._reg_layout
+
+    def _reg_plan(self, layout):
+        # the packets that read `layout` (plus the pc): `g`, and `p` for the
+        # registers beyond the end of the `g` reply
+        plan = self._reg_slices.get(layout)
+        if plan is None:
+            offsets = self._reg_offsets()
+            names = self._pc_names()[:1] + list(layout.names)
+            in_g = [(name,) + offsets[name][1:] for name in names
+                    if self._g_size is None or sum(offsets[name][1:]) <= self._g_size]
+            by_p = [(name, offsets[name][0]) for name in names
+                    if self._g_size is not None and sum(offsets[name][1:]) > self._g_size]
+            plan = self._reg_slices[layout] = (in_g, by_p)
+        return plan
+
+    def _reg_packets(self, layout):
+        in_g, by_p = self._reg_plan(layout)
+        return ['g'] + ['p{:x}'.format(regnum) for _, regnum in by_p]
+
+    def _parse_regs(self, replies, layout):
+        # (pc, RegisterFile) from the replies of _reg_packets()
+        if replies[0][:1] == b'E' and len(replies[0]) == 3:
+            raise Exception('registers not read: {!r}'.format(replies[0]))
+        blob = bytes.fromhex(replies[0].replace(b'x', b'0').decode())
+        if self._g_size is None:
+            # the `g` reply may end before the last register
+            self._g_size = len(blob)
+            self._reg_slices = {}
+            more = self._reg_packets(layout)[1:]
+            return self._parse_regs(replies[:1] + (self._request(more) if more else []), layout)
+        in_g, by_p = self._reg_plan(layout)
+        values = {name: int.from_bytes(blob[offset:offset + size], self._byteorder) & MASK64
+                  for name, offset, size in in_g}
+        for (name, _), reply in zip(by_p, replies[1:]):
+            values[name] = int.from_bytes(
+                bytes.fromhex(reply.replace(b'x', b'0').decode()), self._byteorder) & MASK64
+        pc_names = self._pc_names()
+        pc = values.get(pc_names[0]) if pc_names else None
+        self._pc = pc
+        return pc, RegisterFile(layout, [values[name] for name in layout.names])
+
+    def _pc_names(self):
+        layout = self.read_reg_layout()
+        return [name for name in self.PC_NAMES if name in layout][:1]
+
+    def read_pc(self, timeout=5):
+        if not self._live:
+            raise Exception('pc not found')
+        empty = self.read_reg_layout(timeout).subset([])
+        pc, _ = self._parse_regs(self._request(self._reg_packets(empty), timeout), empty)
+        if pc is None:
+            raise Exception('pc not found')
+        return pc
+
+    def read_reg(self, names=None, timeout=5):
+        layout = self.read_reg_layout(timeout=timeout).subset(names)
+        _, regs = self._parse_regs(self._request(self._reg_packets(layout), timeout), layout)
+        return regs
+
+    def _read_words(self):
+        # the registers come from `g` and `p` packets by the target description
+        raise Exception('no register words over the remote protocol, use read_reg()')
+
+    def _mem_packets(self, addr, length):
+        # [(packet, addr, length)] of reads below the packet size
+        if self._binary:
+            chunk = self._packet_size - RSPController.PACKET_MARGIN
+            fmt = 'x{:x},{:x}'
+        else:
+            chunk = (self._packet_size - RSPController.PACKET_MARGIN) // 2
+            fmt = 'm{:x},{:x}'
+        return [(fmt.format(a, min(chunk, addr + length - a)), a, min(chunk, addr + length - a))
+                for a in range(addr, addr + length, chunk)]
+
+    def _parse_mem(self, reply):
+        if reply[:1] == b'E' and len(reply) == 3:
+            return None
+        if self._binary:
+            return reply[1:] if reply[:1] == b'b' else reply
+        return bytes.fromhex(reply.decode())
+
+    def _read_bytes(self, addr, length, timeout=None):
+        # pipelined reads; a short reply is continued with another request
+        reads = self._mem_packets(addr, length)
+        replies = self._request([p for p, _, _ in reads], timeout) if reads else []
+        out = bytearray()
+        for (_, a, n), reply in zip(reads, replies):
+            data = self._parse_mem(reply)
+            while data is not None and len(data) < n and data:
+                out += data
+                a, n = a + len(data), n - len(data)
+                data = self._parse_mem(self._request([self._mem_packets(a, n)[0][0]], timeout)[0])
+            if not data:
+                raise Exception('memory read failed at {}'.format(hex(a)))
+            out += data
+        return bytes(out)
+
+    def page_hashes(self, regions, page_size=memory.MemorySnapshot.PAGE_SIZE, timeout=None):
+        # a crc per page of every (addr, length) region, computed by the stub (qCRC)
+        pages = [(addr + offset, min(page_size, length - offset))
+                 for addr, length in regions for offset in range(0, length, page_size)]
+        replies = self._request(['qCRC:{:x},{:x}'.format(a, n) for a, n in pages], timeout)
+        if replies and not replies[0]:
+            raise Exception('the stub does not compute qCRC')
+        values = iter(int(r[1:], 16) if r[:1] == b'C' else None for r in replies)
+        return [[next(values) for _ in range(0, length, page_size)] for _, length in regions]
+
+    def mem_snapshot(self, regions, page_size=memory.MemorySnapshot.PAGE_SIZE):
+        # copies of the regions, re-read by page when its qCRC changes
+        # (or whole, if the stub has no qCRC)
+        hashes: Optional[Callable] = self.page_hashes
+        try:
+            self.page_hashes([(regions[0][0], 1)] if regions else [])
+        except Exception:
+            hashes = None
+        return memory.MemorySnapshot(
+            self.read_mem_bytes, regions, hashes=hashes, page_size=page_size)
+
+    def read_mappings(self, timeout=None):
+        # memory.Mappings from qMemoryRegionInfo (lldb-server)
+        mappings: list = []
+        addr = 0
+        while addr <= MASK64:
+            reply = self._request(['qMemoryRegionInfo:{:x}'.format(addr)], timeout)[0].decode()
+            if not reply or reply.startswith('E'):
+                if not mappings and addr == 0:
+                    raise Exception('the stub does not describe memory regions')
+                break
+            info = dict(item.split(':', 1) for item in reply.split(';') if ':' in item)
+            start, size = int(info['start'], 16), int(info['size'], 16)
+            if 'permissions' in info and info['permissions']:
+                perms = ''.join(c if c in info['permissions'] else '-' for c in 'rwx')
+                name = bytes.fromhex(info.get('name', '')).decode(errors='replace')
+                mappings.append(memory.Mapping(start, start + size, perms, name))
+            if size == 0:
+                break
+            addr = start + size
+        return mappings
+
+    def snapshot(self, regs=None, disasm=True, mem=(), step=None, timeout=None):
+        # step, registers (with the pc) and memory are sent in one write
+        layout = self.read_reg_layout(timeout=timeout).subset(regs)
+        packets, stop = [], None
+        if step is not None:
+            packets, stop = self._step_packets(step)
+        reg_start = len(packets)
+        packets += self._reg_packets(layout)
+        reads = [self._mem_packets(addr, size * count) for addr, size, count in mem]
+        mem_start = len(packets)
+        for r in reads:
+            packets += [p for p, _, _ in r]
+        replies = self._request(packets, timeout)
+        if stop is not None and self._parse_stop(replies[stop]) is None:
+            return Snapshot(None, RegisterFile(layout), None, [[] for _ in mem])
+        pc, values = self._parse_regs(replies[reg_start:mem_start], layout)
+        mems = []
+        i = mem_start
+        for (addr, size, count), r in zip(mem, reads):
+            data = b''.join(self._parse_mem(reply) or b'' for reply in replies[i:i + len(r)])
+            if len(data) < size * count:
+                data = self._read_bytes(addr, size * count, timeout)
+            mems.append(memory.words(data, size, self._byteorder))
+            i += len(r)
+        dis = self.read_disasm(pc) if disasm and pc is not None else None
+        return Snapshot(pc, values, dis, mems)
+
+    def read_return_address(self, timeout=None):
+        # valid at function entry: the word at sp on x86, the link register elsewhere
+        layout = self.read_reg_layout(timeout)
+        if self.elf is None or self.elf.machine in (EM_386, EM_X86_64):
+            sp = [name for name in self.SP_NAMES if name in layout][0]
+            size = 4 if self.elf and self.elf.bits == 32 else 8
+            return self.read_mem(self.read_reg([sp], timeout)[sp], size=size, timeout=timeout)[0]
+        link = [name for name in self.LINK_NAMES if name in layout]
+        if not link:
+            raise Exception('return address not found')
+        return self.read_reg(link[:1], timeout)[link[0]]
@@ -0,0 +1,6 @@
+from collections import namedtuple
+
+
+# state of the target read by one snapshot() round trip.
+# mem holds one list of words per requested (addr, size, count).
+Snapshot = namedtuple('Snapshot', ['pc', 'regs', 'disasm', 'mem'])
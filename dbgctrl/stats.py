@@ -0,0 +1,164 @@
+import functools
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from dbgctrl.logging import getLogger
+
+
+# opt-in instrumentation of the controllers: latency per command kind,
+# bytes read, and time per phase (select, roundup, read, decode, parse, ...)
+logger = getLogger('stats')
+
+BUCKETS = 32
+
+pattern_console_command = re.compile(r'-interpreter-exec console "(.*)"')
+pattern_command_kind = re.compile(r'\s*(-?[A-Za-z_][\w-]*|\S+)')
+
+
+def command_kind(cmd):
+    # 'x/4xw 0x1000' -> 'x', 'info registers rax' -> 'info'
+    m = pattern_console_command.match(cmd)
+    if m:
+        cmd = m.group(1)
+    m = pattern_command_kind.match(cmd)
+    return m.group(1) if m else cmd
+
+
+class Histogram():
+    # log2 buckets of microseconds: bucket i holds [2**(i-1), 2**i) us
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile, in seconds
+        if self.count == 0:
+            return 0.0
+        rank = p * self.count / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min or 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': list(self.buckets),
+        }
+
+
+class Stats():
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.commands = defaultdict(Histogram)
+        self.phases = defaultdict(float)
+        self.bytes_read = 0
+        self.timeouts = 0
+        # open timed() calls per phase: only the outermost one is counted
+        self._depth = defaultdict(int)
+
+    def add_command(self, cmds, seconds):
+        kind = '+'.join(command_kind(cmd) for cmd in cmds)
+        self.commands[kind].add(seconds)
+        logger.debug('{} {:.6f}s'.format(kind, seconds))
+
+    def add_phase(self, name, seconds):
+        self.phases[name] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def timed(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # e.g. a _parse_* method calling another is timed once
+            depth = self._depth
+            if depth[name]:
+                return func(*args, **kwargs)
+            depth[name] += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.phases[name] += time.perf_counter() - start
+                depth[name] -= 1
+        return wrapper
+
+    def report(self):
+        return {
+            'elapsed': time.perf_counter() - self.start_time,
+            'bytes_read': self.bytes_read,
+            'timeouts': self.timeouts,
+            'phases': dict(self.phases),
+            'commands': {kind: h.to_dict() for kind, h in self.commands.items()},
+        }
+
+
+def instrument(dbg, stats):
+    # time the reply parsers of one controller instance; the class is untouched,
+    # so controllers without stats pay nothing
+    for name in dir(type(dbg)):
+        if name.startswith('_parse_') and callable(getattr(dbg, name)):
+            setattr(dbg, name, stats.timed('parse', getattr(dbg, name)))
+
+
+def uninstrument(dbg):
+    for name in list(vars(dbg)):
+        if name.startswith('_parse_'):
+            delattr(dbg, name)
+
+
+def format_report(report, steps=None, seconds=None):
+    # `seconds`: time the steps took, if not the whole lifetime of the stats
+    lines = []
+    elapsed = report['elapsed']
+    if seconds is None:
+        seconds = elapsed
+    if steps is not None and seconds > 0:
+        lines.append('steps: {} in {:.3f}s, {:.1f} steps/s'.format(steps, seconds, steps / seconds))
+    lines.append('bytes read: {}, timeouts: {}'.format(report['bytes_read'], report['timeouts']))
+    phases = dict(report['phases'])
+    phases['other'] = max(elapsed - sum(phases.values()), 0.0)
+    for name, seconds in sorted(phases.items(), key=lambda item: -item[1]):
+        share = seconds * 100 / elapsed if elapsed > 0 else 0.0
+        lines.append('  {:<12} {:10.3f}s {:5.1f}%'.format(name, seconds, share))
+    commands = sorted(report['commands'].items(), key=lambda item: -item[1]['total'])
+    for kind, h in commands:
+        lines.append('  {:<32} n={:<8} mean={:.6f}s p50<={:.6f}s p99<={:.6f}s max={:.6f}s'.format(
+            kind, h['count'], h['mean'], h['p50'], h['p99'], h['max']))
+    return lines
+
+
+def log_report(report, steps=None, seconds=None):
+    for line in format_report(report, steps=steps, seconds=seconds):
+        logger.info(line)
@@ -0,0 +1,151 @@
+from dbgctrl.register import MASK64, RegisterFile
+
+
+# incremental parsing of debugger replies: complete lines are handed to a
+# parser while the rest of the reply is still arriving, and dropped from the
+# receive buffer, so a large reply is never kept or decoded as a whole
+def bytes2int(s):
+    return int(s, 16) if s[:2] == b'0x' else int(s)
+
+
+class LineParser():
+    # subclasses get every match of `pattern` (bytes, re.M) in the reply
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def add(self, m):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def feed(self, buf, end):
+        # buf[:end] holds complete lines only
+        for m in self.pattern.finditer(buf, 0, end):
+            self.add(m)
+
+    def parse(self, text):
+        # a whole reply at once, e.g. one read with roundup framing
+        data = text.encode()
+        self.feed(data, len(data))
+        return self.result()
+
+
+class RegisterParser(LineParser):
+    # (name, value) matches into a RegisterFile
+    def __init__(self, pattern, layout):
+        super().__init__(pattern)
+        self.registers = RegisterFile(layout)
+        self.index = layout.byte_index
+
+    def add(self, m):
+        i = self.index.get(m.group(1))
+        if i is not None:
+            self.registers.values[i] = bytes2int(m.group(2)) & MASK64
+
+    def result(self):
+        return self.registers
+
+
+class WordParser(LineParser):
+    # lines of memory words into a list
+    def __init__(self, pattern):
+        super().__init__(pattern)
+        self.words = []
+
+    def add(self, m):
+        self.words += [bytes2int(v) for v in m.group(1).split()]
+
+    def result(self):
+        return self.words
+
+
+class ValueParser(LineParser):
+    # the first match only, e.g. the pc, or None
+    def __init__(self, pattern):
+        super().__init__(pattern)
+        self.value = None
+
+    def add(self, m):
+        if self.value is None:
+            self.value = bytes2int(m.group(1))
+
+    def result(self):
+        return self.value
+
+
+class ReplyReader():
+    # splits the debugger output at the prompt into the replies of a batch.
+    # replies without a parser are decoded as text (prompt included); the
+    # others are fed to their parser line by line and return its result.
+    # the receive buffer is reused by every batch.
+    def __init__(self, prompt):
+        self.prompt = prompt.encode()
+        self.buffer = bytearray()
+        self.replies = []
+        self._parsers = []
+        self._pos = 0
+
+    @property
+    def done(self):
+        return len(self.replies) >= len(self._parsers)
+
+    def start(self, parsers, late=0):
+        # the first `late` replies are owed by a batch that timed out: they are
+        # read as text and dropped by the caller. without them, output left over
+        # from an earlier batch does not belong to this one
+        if not late:
+            del self.buffer[:]
+        self.replies = []
+        self._parsers = [None] * late + list(parsers)
+        self._pos = 0
+
+    def feed(self, data):
+        self.buffer += data
+        buf = self.buffer
+        prompt = self.prompt
+        while not self.done:
+            parser = self._parsers[len(self.replies)]
+            end = buf.find(prompt, self._pos)
+            if parser is not None:
+                # complete lines before the prompt go to the parser now
+                limit = end if end >= 0 else len(buf)
+                newline = buf.rfind(b'\n', 0, limit)
+                if newline >= 0:
+                    parser.feed(buf, newline + 1)
+                    del buf[:newline + 1]
+                    if end >= 0:
+                        end -= newline + 1
+            if end < 0:
+                self._pos = max(0, len(buf) - len(prompt) + 1)
+                break
+            end += len(prompt)
+            if parser is None:
+                self.replies.append(buf[:end].decode())
+            else:
+                # the last line has no newline before the prompt
+                parser.feed(buf[:end - len(prompt)] + b'\n', end - len(prompt) + 1)
+                self.replies.append(parser.result())
+            del buf[:end]
+            self._pos = 0
+        return self.done
+
+    def close(self):
+        # end of output: what has arrived is the current reply, the rest are empty
+        buf = self.buffer
+        while not self.done:
+            parser = self._parsers[len(self.replies)]
+            if parser is None:
+                self.replies.append(buf.decode())
+            else:
+                parser.feed(buf + b'\n', len(buf) + 1)
+                self.replies.append(parser.result())
+            del buf[:]
+
+    def missing(self):
+        # replies whose prompt has not arrived yet
+        return len(self._parsers) - len(self.replies)
+
+    def pending(self):
+        # the incomplete reply as text, for error messages
+        return self.buffer.decode(errors='replace')
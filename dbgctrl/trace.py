@@ -0,0 +1,829 @@
+import bisect
+import csv
+import heapq
+import lzma
+import mmap
+import os
+import queue
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+from array import array
+from collections import namedtuple
+from itertools import repeat
+from operator import itemgetter
+from typing import Any, Dict
+
+from dbgctrl.agent import TraceRecord
+
+
+# columnar trace file, little endian:
+#   header: b'DBGTRC01' <H nregs> { <H length> <utf-8 register name> }*nregs
+#   chunk:  b'CHNK' <I rows> <B codec> <I stored size> <stored payload>
+# the payload (compressed with the chunk codec) holds the rows of the chunk:
+#   <I nstrings> { <H length> <utf-8> }*nstrings   new disassembly strings
+#   pc column, disasm column (string index or -1), one column per register
+# every column is <B encoding> <I size> <data>:
+#   RAW     value*rows
+#   CONST   value of every row
+#   SPARSE  <first value> <bitmap: row i (from 1) differs from row i-1> <changed value>*
+MAGIC = b'DBGTRC01'
+CODECS = {'none': 0, 'zlib': 1, 'lzma': 2}
+RAW, CONST, SPARSE = 0, 1, 2
+DEFAULT_CHUNK_ROWS = 4096
+
+# sidecar query index of a trace (<trace>.idx), in host byte order so that
+# its sections are used in place through mmap:
+#   header: b'DBGIDX01' <B big endian> <I rows> <I block> <I npcs> <H nregs>
+#           { <H length> <utf-8 register name> }*nregs, padded to 8 bytes
+#   table:  <Q offset> <Q size> of every section in INDEX_SECTIONS
+# steps are record numbers, from 1 like the `No.` column of regdump.
+#   pcs       Q*npcs       pc of every pc id (ids in order of first execution)
+#   sorted    I*npcs       pc ids sorted by pc
+#   starts    Q*(npcs+1)   postings of pc id i: postings[starts[i]:starts[i+1]]
+#   postings  I*rows       steps of every pc id
+#   pcids     I*rows       pc id of every step
+#   dstarts   Q*(npcs+1)   disassembly of pc id i: disasm[dstarts[i]:dstarts[i+1]]
+#   disasm    utf-8
+#   cstarts   Q*(nregs+1)  change points of register r: [cstarts[r], cstarts[r+1])
+#   csteps    I*changes    step at which the register took a new value (step 1 included)
+#   cvalues   Q*changes    that value
+#   marks     Q*(blocks*nregs)  sampled state: for every block of steps and
+#                          register, the last change point at or before the
+#                          first step of the block, relative to cstarts
+INDEX_MAGIC = b'DBGIDX01'
+INDEX_SECTIONS = ('pcs', 'sorted', 'starts', 'postings', 'pcids', 'dstarts', 'disasm',
+                  'cstarts', 'csteps', 'cvalues', 'marks')
+INDEX_TYPES: Dict[str, Any] = {
+    'pcs': 'Q', 'sorted': 'I', 'starts': 'Q', 'postings': 'I', 'pcids': 'I', 'dstarts': 'Q',
+    'disasm': 'B', 'cstarts': 'Q', 'csteps': 'I', 'cvalues': 'Q', 'marks': 'Q'}
+DEFAULT_INDEX_BLOCK = 65536
+# steps indexed in memory before they are spilled to disk
+DEFAULT_INDEX_RUN = 1 << 20
+MAX_INDEX_ROWS = (1 << 32) - 1
+
+_HEADER = struct.Struct('<H')
+_LENGTH = struct.Struct('<H')
+_COUNT = struct.Struct('<I')
+_CHUNK = struct.Struct('<4sIBI')
+_COLUMN = struct.Struct('<BI')
+_INDEX_HEADER = struct.Struct('<BIIIH')
+_INDEX_SECTION = struct.Struct('<QQ')
+
+
+def _compress(codec, data):
+    if codec == CODECS['zlib']:
+        return zlib.compress(data)
+    elif codec == CODECS['lzma']:
+        return lzma.compress(data)
+    return data
+
+
+def _decompress(codec, data):
+    if codec == CODECS['zlib']:
+        return zlib.decompress(data)
+    elif codec == CODECS['lzma']:
+        return lzma.decompress(data)
+    return data
+
+
+def _to_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def encode_column(values):
+    rows = len(values)
+    itemsize = values.itemsize
+    first = array(values.typecode, values[:1])
+    if values.count(first[0]) == rows:
+        encoding, body = CONST, _to_bytes(first)
+    else:
+        changed = [i for i, (prev, value) in enumerate(zip(values, values[1:]), 1)
+                   if value != prev]
+        nbitmap = (rows + 6) // 8
+        if itemsize + nbitmap + len(changed) * itemsize < rows * itemsize:
+            bitmap = bytearray(nbitmap)
+            for i in changed:
+                bitmap[(i - 1) >> 3] |= 1 << ((i - 1) & 7)
+            picked = array(values.typecode, [values[i] for i in changed])
+            encoding, body = SPARSE, _to_bytes(first) + bytes(bitmap) + _to_bytes(picked)
+        else:
+            encoding, body = RAW, _to_bytes(values)
+    return _COLUMN.pack(encoding, len(body)) + body
+
+
+def decode_column(buf, offset, typecode, rows):
+    # returns the values and the offset of the next column
+    encoding, size = _COLUMN.unpack_from(buf, offset)
+    start = offset + _COLUMN.size
+    end = start + size
+    if encoding == RAW:
+        values = _from_bytes(typecode, buf[start:end])
+    elif encoding == CONST:
+        values = _from_bytes(typecode, buf[start:end]) * rows
+    elif encoding == SPARSE:
+        itemsize = array(typecode).itemsize
+        nbitmap = (rows + 6) // 8
+        first = _from_bytes(typecode, buf[start:start + itemsize])
+        bitmap = buf[start + itemsize:start + itemsize + nbitmap]
+        changed = _from_bytes(typecode, buf[start + itemsize + nbitmap:end])
+        values = first * rows
+        value = first[0]
+        j = 0
+        for i in range(1, rows):
+            if bitmap[(i - 1) >> 3] >> ((i - 1) & 7) & 1:
+                value = changed[j]
+                j += 1
+            values[i] = value
+    else:
+        raise ValueError('unknown column encoding: {}'.format(encoding))
+    return values, end
+
+
+def encode_chunk(strings, pc, disasm, regs, codec):
+    parts = [_COUNT.pack(len(strings))]
+    for s in strings:
+        data = s.encode()
+        parts.append(_LENGTH.pack(len(data)) + data)
+    parts.append(encode_column(pc))
+    parts.append(encode_column(disasm))
+    parts += [encode_column(column) for column in regs]
+    payload = _compress(codec, b''.join(parts))
+    return _CHUNK.pack(b'CHNK', len(pc), codec, len(payload)) + payload
+
+
+class RecordWriter():
+    # the interface of the trace outputs (TraceWriter, TraceIndexWriter, the
+    # csv output of regdump): records are appended, count says how many
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, pc, disasm, values):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class TraceWriter(RecordWriter):
+    # rows are collected into columns here; full chunks are encoded,
+    # compressed and written by a background thread
+    QUEUE_SIZE = 16
+
+    def __init__(self, path, names, chunk_rows=DEFAULT_CHUNK_ROWS, compress='none'):
+        if compress not in CODECS:
+            raise ValueError('unknown compression: {}'.format(compress))
+        super().__init__()
+        self.path = path
+        self.names = tuple(names)
+        self.chunk_rows = chunk_rows
+        self.codec = CODECS[compress]
+        self._strings = {}
+        self._new_strings = []
+        self._new_columns()
+        self._error = None
+        self._file = open(path, 'wb')
+        header = [MAGIC, _HEADER.pack(len(self.names))]
+        for name in self.names:
+            data = name.encode()
+            header.append(_LENGTH.pack(len(data)) + data)
+        self._file.write(b''.join(header))
+        self._queue: queue.Queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self._thread.start()
+
+    def _new_columns(self):
+        self._pc = array('Q')
+        self._disasm = array('i')
+        self._regs = [array('Q') for _ in self.names]
+
+    def _write_chunks(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is None:
+                try:
+                    strings, pc, disasm, regs = item
+                    self._file.write(encode_chunk(strings, pc, disasm, regs, self.codec))
+                except Exception as e:
+                    self._error = e
+
+    def append(self, pc, disasm, values):
+        if len(values) != len(self._regs):
+            raise ValueError('expected {} register values'.format(len(self._regs)))
+        if disasm is None:
+            index = -1
+        elif disasm in self._strings:
+            index = self._strings[disasm]
+        else:
+            index = self._strings[disasm] = len(self._strings)
+            self._new_strings.append(disasm)
+        self._pc.append(pc)
+        self._disasm.append(index)
+        for column, value in zip(self._regs, values):
+            column.append(value)
+        self.count += 1
+        if len(self._pc) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if self._error is not None:
+            raise self._error
+        if not self._pc:
+            return
+        self._queue.put((self._new_strings, self._pc, self._disasm, self._regs))
+        self._new_strings = []
+        self._new_columns()
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+class TraceChunk():
+    __slots__ = ('rows', 'codec', 'offset', 'size', 'first_row', 'columns')
+
+    def __init__(self, rows, codec, offset, size, first_row):
+        self.rows = rows
+        self.codec = codec
+        self.offset = offset
+        self.size = size
+        self.first_row = first_row
+        # payload offset of every column, filled on first access
+        self.columns = None
+
+
+class TraceReader():
+    # reads a trace written by TraceWriter through mmap; only the chunks and
+    # columns that are asked for get decoded
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+        buf = self._map
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError('not a dbgctrl trace: {}'.format(path))
+        offset = len(MAGIC)
+        nregs, = _HEADER.unpack_from(buf, offset)
+        offset += _HEADER.size
+        names = []
+        for _ in range(nregs):
+            n, = _LENGTH.unpack_from(buf, offset)
+            offset += _LENGTH.size
+            names.append(bytes(buf[offset:offset + n]).decode())
+            offset += n
+        self.names = tuple(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.chunks = []
+        self.rows = 0
+        while offset < len(buf):
+            if offset + _CHUNK.size > len(buf):
+                raise ValueError('truncated trace: {}'.format(path))
+            magic, rows, codec, size = _CHUNK.unpack_from(buf, offset)
+            if magic != b'CHNK':
+                raise ValueError('broken trace chunk at {}'.format(offset))
+            offset += _CHUNK.size
+            if offset + size > len(buf):
+                raise ValueError('truncated trace: {}'.format(path))
+            self.chunks.append(TraceChunk(rows, codec, offset, size, self.rows))
+            self.rows += rows
+            offset += size
+        self._strings = None
+        # (chunk, payload) of the last chunk read
+        self._payload: tuple = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        self._payload = (None, None)
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def _read_payload(self, chunk):
+        # the last decompressed chunk is kept: columns are usually read chunk by chunk
+        cached, payload = self._payload
+        if cached is chunk:
+            return payload
+        view = memoryview(self._map)[chunk.offset:chunk.offset + chunk.size]
+        if chunk.codec != CODECS['none']:
+            view = memoryview(_decompress(chunk.codec, view))
+        self._payload = (chunk, view)
+        return view
+
+    def _chunk_strings(self, chunk, payload):
+        nstrings, = _COUNT.unpack_from(payload, 0)
+        offset = _COUNT.size
+        strings = []
+        for _ in range(nstrings):
+            n, = _LENGTH.unpack_from(payload, offset)
+            offset += _LENGTH.size
+            strings.append(bytes(payload[offset:offset + n]).decode())
+            offset += n
+        return strings, offset
+
+    def _column_offsets(self, chunk, payload):
+        if chunk.columns is None:
+            _, offset = self._chunk_strings(chunk, payload)
+            columns = []
+            for _ in range(2 + len(self.names)):
+                columns.append(offset)
+                _, size = _COLUMN.unpack_from(payload, offset)
+                offset += _COLUMN.size + size
+            chunk.columns = columns
+        return chunk.columns
+
+    def _column_position(self, name):
+        if name == 'pc':
+            return 0, 'Q'
+        elif name == 'disasm':
+            return 1, 'i'
+        elif name in self.index:
+            return 2 + self.index[name], 'Q'
+        raise KeyError(name)
+
+    def column_chunks(self, name):
+        # yields the values of one column (a register, 'pc' or 'disasm') per chunk
+        position, typecode = self._column_position(name)
+        for chunk in self.chunks:
+            payload = self._read_payload(chunk)
+            offset = self._column_offsets(chunk, payload)[position]
+            values, _ = decode_column(payload, offset, typecode, chunk.rows)
+            yield values
+
+    def column(self, name, dtype=None):
+        # the whole column as a NumPy array (uint64, or int32 for 'disasm')
+        import numpy
+        if dtype is None:
+            dtype = numpy.int32 if name == 'disasm' else numpy.uint64
+        parts = [numpy.frombuffer(values, dtype=values.typecode)
+                 for values in self.column_chunks(name)]
+        if not parts:
+            return numpy.empty(0, dtype=dtype)
+        return numpy.concatenate(parts).astype(dtype, copy=False)
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            strings = []
+            for chunk in self.chunks:
+                strings += self._chunk_strings(chunk, self._read_payload(chunk))[0]
+            self._strings = strings
+        return self._strings
+
+    def records(self):
+        strings = []
+        for chunk in self.chunks:
+            payload = self._read_payload(chunk)
+            new_strings, offset = self._chunk_strings(chunk, payload)
+            strings += new_strings
+            columns = []
+            for typecode in ['Q', 'i'] + ['Q'] * len(self.names):
+                values, offset = decode_column(payload, offset, typecode, chunk.rows)
+                columns.append(values)
+            pcs, disasms, regs = columns[0], columns[1], columns[2:]
+            for row in range(chunk.rows):
+                index = disasms[row]
+                yield TraceRecord(
+                    pcs[row], tuple(column[row] for column in regs),
+                    strings[index] if index >= 0 else None)
+
+
+def read_records(path):
+    # TraceRecords of a regdump output, a bin trace or a csv file
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        with TraceReader(path) as trace:
+            yield from trace
+        return
+    with open(path, newline='') as f:
+        rows = csv.reader(f)
+        next(rows, None)
+        for row in rows:
+            yield TraceRecord(
+                int(row[1], 16), tuple(int(v, 16) for v in row[3:]),
+                row[2] if row[2] != 'None' else None)
+
+
+def read_names(path):
+    # register names of a regdump output
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        with TraceReader(path) as trace:
+            return trace.names
+    with open(path, newline='') as f:
+        return tuple(next(csv.reader(f), [])[3:])
+
+
+# spill file offsets of the sections of one run of TraceIndexWriter:
+#   pcids     I*rows   pc id of every step of the run
+#   postings  I*       steps of the pc ids of the run (ids, sorted), split by pstarts
+#   csteps    I*       change points of every register, split by cstarts
+#   cvalues   Q*       their values
+IndexRun = namedtuple('IndexRun', ['pcids', 'rows', 'ids', 'postings', 'pstarts',
+                                   'csteps', 'cvalues', 'cstarts'])
+
+
+class TraceIndexWriter(RecordWriter):
+    # builds the query index of a trace; same interface as TraceWriter, so it
+    # can be fed while tracing. steps are collected in runs of `run_rows`; a
+    # full run is spilled to a temporary file and close() merges the runs
+    # into the index, so memory is bounded by one run and the pc table
+    def __init__(self, path, names, block=DEFAULT_INDEX_BLOCK, run_rows=DEFAULT_INDEX_RUN):
+        if block <= 0:
+            raise ValueError('invalid index block: {}'.format(block))
+        if run_rows <= 0:
+            raise ValueError('invalid index run: {}'.format(run_rows))
+        super().__init__()
+        self.path = path
+        self.names = tuple(names)
+        self.block = block
+        self.run_rows = run_rows
+        self._ids = {}
+        self._pcs = array('Q')
+        self._disasm = []
+        # steps of every pc id and change points of every register, in the spilled runs
+        self._counts = array('Q')
+        self._nchanges = array('Q', [0] * len(self.names))
+        self._marks = array('Q')
+        self._last = None
+        self._runs = []
+        self._spill = tempfile.TemporaryFile(
+            prefix='dbgctrl-', suffix='.idxrun', dir=os.path.dirname(os.path.abspath(path)))
+        self._new_run()
+
+    def _new_run(self):
+        # pc id -> steps of the run
+        self._postings = {}
+        self._pcids = array('I')
+        self._csteps = [array('I') for _ in self.names]
+        self._cvalues = [array('Q') for _ in self.names]
+
+    def append(self, pc, disasm, values):
+        if len(values) != len(self.names):
+            raise ValueError('expected {} register values'.format(len(self.names)))
+        if self.count >= MAX_INDEX_ROWS:
+            raise ValueError('too many records to index')
+        self.count += 1
+        step = self.count
+        pcid = self._ids.get(pc)
+        if pcid is None:
+            pcid = self._ids[pc] = len(self._pcs)
+            self._pcs.append(pc)
+            self._disasm.append(disasm or '')
+            self._counts.append(0)
+        postings = self._postings.get(pcid)
+        if postings is None:
+            postings = self._postings[pcid] = array('I')
+        postings.append(step)
+        self._pcids.append(pcid)
+        last = self._last
+        for i, value in enumerate(values):
+            if last is None or value != last[i]:
+                self._csteps[i].append(step)
+                self._cvalues[i].append(value)
+        self._last = tuple(values)
+        if (step - 1) % self.block == 0:
+            self._marks.extend(n + len(steps) - 1
+                               for n, steps in zip(self._nchanges, self._csteps))
+        if len(self._pcids) >= self.run_rows:
+            self._spill_run()
+
+    def _spill_run(self):
+        if not self._pcids:
+            return
+        f = self._spill
+        pcids = self._pcids
+        ids = array('I', sorted(self._postings))
+        postings = [self._postings[pcid] for pcid in ids]
+        pstarts = array('Q', [0])
+        for pcid, steps in zip(ids, postings):
+            pstarts.append(pstarts[-1] + len(steps))
+            self._counts[pcid] += len(steps)
+        cstarts = array('Q', [0])
+        for r, steps in enumerate(self._csteps):
+            cstarts.append(cstarts[-1] + len(steps))
+            self._nchanges[r] += len(steps)
+        offsets = []
+        for parts in ([pcids], postings, self._csteps, self._cvalues):
+            offsets.append(f.tell())
+            for part in parts:
+                f.write(part)
+        self._runs.append(IndexRun(offsets[0], len(pcids), ids, offsets[1], pstarts,
+                                   offsets[2], offsets[3], cstarts))
+        self._new_run()
+
+    def _merged(self):
+        # the sections that are merged from the runs, as generators of parts
+        # read back from the spill file
+        runs = self._runs
+        fd = self._spill.fileno()
+
+        def spill(start, end):
+            return os.pread(fd, end - start, start)
+
+        def postings():
+            # pc id order, and step order within a pc id: the runs hold their
+            # pc ids sorted, and merge() keeps the order of the runs on a tie
+            streams = [zip(run.ids, range(len(run.ids)), repeat(run)) for run in runs]
+            for _, i, run in heapq.merge(*streams, key=itemgetter(0)):
+                yield spill(run.postings + run.pstarts[i] * 4,
+                            run.postings + run.pstarts[i + 1] * 4)
+
+        def pcids():
+            for run in runs:
+                yield spill(run.pcids, run.pcids + run.rows * 4)
+
+        def changes(name, itemsize):
+            for r in range(len(self.names)):
+                for run in runs:
+                    start = getattr(run, name)
+                    yield spill(start + run.cstarts[r] * itemsize,
+                                start + run.cstarts[r + 1] * itemsize)
+
+        return {'postings': postings(), 'pcids': pcids(),
+                'csteps': changes('csteps', 4), 'cvalues': changes('cvalues', 8)}
+
+    def _sections(self):
+        npcs = len(self._pcs)
+        starts = array('Q', [0])
+        for count in self._counts:
+            starts.append(starts[-1] + count)
+        disasm = [d.encode() for d in self._disasm]
+        dstarts = array('Q', [0])
+        for data in disasm:
+            dstarts.append(dstarts[-1] + len(data))
+        cstarts = array('Q', [0])
+        for n in self._nchanges:
+            cstarts.append(cstarts[-1] + n)
+        changes = cstarts[-1]
+        return {
+            'pcs': [self._pcs],
+            'sorted': [array('I', sorted(range(npcs), key=self._pcs.__getitem__))],
+            'starts': [starts],
+            'postings': self.count * 4,
+            'pcids': self.count * 4,
+            'dstarts': [dstarts],
+            'disasm': disasm,
+            'cstarts': [cstarts],
+            'csteps': changes * 4,
+            'cvalues': changes * 8,
+            'marks': [self._marks],
+        }
+
+    def close(self):
+        if self._spill.closed:
+            return
+        try:
+            self._spill_run()
+            self._spill.flush()
+            self._write_index()
+        finally:
+            self._spill.close()
+            self._runs = []
+            self._new_run()
+
+    def _write_index(self):
+        # sections held here are lists of parts, merged ones only have a size yet
+        sections = self._sections()
+        parts = [INDEX_MAGIC, _INDEX_HEADER.pack(
+            sys.byteorder == 'big', self.count, self.block, len(self._pcs), len(self.names))]
+        for name in self.names:
+            data = name.encode()
+            parts.append(_LENGTH.pack(len(data)) + data)
+        header = b''.join(parts)
+        header += bytes(-len(header) % 8)
+        offset = len(header) + _INDEX_SECTION.size * len(INDEX_SECTIONS)
+        table = []
+        for name in INDEX_SECTIONS:
+            parts = sections[name]
+            if isinstance(parts, int):
+                size = parts
+            else:
+                size = sum(len(part) * (part.itemsize if isinstance(part, array) else 1)
+                           for part in parts)
+            table.append((offset, size))
+            offset += size + -size % 8
+        sections.update(self._merged())
+        with open(self.path, 'wb') as f:
+            f.write(header)
+            f.write(b''.join(_INDEX_SECTION.pack(*entry) for entry in table))
+            for name, (_, size) in zip(INDEX_SECTIONS, table):
+                for part in sections[name]:
+                    f.write(part)
+                f.write(bytes(-size % 8))
+
+
+def build_index(path, index_path=None, block=DEFAULT_INDEX_BLOCK):
+    # index an existing regdump output (csv or bin) into <path>.idx
+    index_path = index_path or path + '.idx'
+    with TraceIndexWriter(index_path, read_names(path), block=block) as index:
+        for record in read_records(path):
+            index.append(record.pc, record.disasm, record.regs)
+    return index_path
+
+
+class TraceIndex():
+    # queries on an index written by TraceIndexWriter, through mmap: a query
+    # reads a few pages of the sections it searches, not the whole trace
+    # the sections, set by __init__() from INDEX_SECTIONS
+    _pcs: Any
+    _sorted: Any
+    _starts: Any
+    _postings: Any
+    _pcids: Any
+    _dstarts: Any
+    _disasm: Any
+    _cstarts: Any
+    _csteps: Any
+    _cvalues: Any
+    _marks: Any
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+        buf = self._map
+        if buf[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError('not a dbgctrl trace index: {}'.format(path))
+        offset = len(INDEX_MAGIC)
+        big, self.rows, self.block, self.npcs, nregs = _INDEX_HEADER.unpack_from(buf, offset)
+        if big != (sys.byteorder == 'big'):
+            raise ValueError('trace index of another byte order: {}'.format(path))
+        offset += _INDEX_HEADER.size
+        names = []
+        for _ in range(nregs):
+            n, = _LENGTH.unpack_from(buf, offset)
+            offset += _LENGTH.size
+            names.append(bytes(buf[offset:offset + n]).decode())
+            offset += n
+        offset += -offset % 8
+        self.names = tuple(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        view = memoryview(buf)
+        self._offsets = {}
+        for name in INDEX_SECTIONS:
+            start, size = _INDEX_SECTION.unpack_from(buf, offset)
+            offset += _INDEX_SECTION.size
+            if start + size > len(buf):
+                raise ValueError('truncated trace index: {}'.format(path))
+            self._offsets[name] = start
+            setattr(self, '_' + name, view[start:start + size].cast(INDEX_TYPES[name]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    def close(self):
+        for name in INDEX_SECTIONS:
+            view = getattr(self, '_' + name, None)
+            if view is not None:
+                view.release()
+                setattr(self, '_' + name, None)
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def _pcid(self, pc):
+        ids = self._sorted
+        lo, hi = 0, len(ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._pcs[ids[mid]] < pc:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(ids) and self._pcs[ids[lo]] == pc:
+            return ids[lo]
+        return None
+
+    def _check_step(self, step):
+        if not 1 <= step <= self.rows:
+            raise IndexError('step out of the trace: {}'.format(step))
+
+    def count(self, pc):
+        # how many times pc was executed
+        pcid = self._pcid(pc)
+        return 0 if pcid is None else self._starts[pcid + 1] - self._starts[pcid]
+
+    def steps(self, pc, start=None, stop=None):
+        # the steps at which pc was executed, [start:stop] of them
+        pcid = self._pcid(pc)
+        if pcid is None:
+            return []
+        return self._postings[self._starts[pcid]:self._starts[pcid + 1]][start:stop].tolist()
+
+    def pc_counts(self):
+        # (pc, count) of every executed pc, by pc
+        for pcid in self._sorted:
+            yield self._pcs[pcid], self._starts[pcid + 1] - self._starts[pcid]
+
+    def disasm(self, pc):
+        pcid = self._pcid(pc)
+        if pcid is None:
+            return None
+        return bytes(self._disasm[self._dstarts[pcid]:self._dstarts[pcid + 1]]).decode() or None
+
+    def _changes(self, name):
+        # [lo, hi) of the change points of a register
+        r = self.index[name]
+        return r, self._cstarts[r], self._cstarts[r + 1]
+
+    def _change_at(self, r, lo, hi, step):
+        # the change point in effect at step, searched between the marks of its block
+        block = (step - 1) // self.block
+        nregs = len(self.names)
+        if (block + 1) * nregs < len(self._marks):
+            hi = lo + self._marks[(block + 1) * nregs + r] + 1
+        lo += self._marks[block * nregs + r]
+        return bisect.bisect_right(self._csteps, step, lo, hi) - 1
+
+    def value(self, name, step):
+        # the value of a register at step
+        self._check_step(step)
+        r, lo, hi = self._changes(name)
+        return self._cvalues[self._change_at(r, lo, hi, step)]
+
+    def state(self, step):
+        # TraceRecord of step
+        self._check_step(step)
+        pcid = self._pcids[step - 1]
+        regs = []
+        for r in range(len(self.names)):
+            regs.append(self._cvalues[self._change_at(
+                r, self._cstarts[r], self._cstarts[r + 1], step)])
+        disasm = bytes(self._disasm[self._dstarts[pcid]:self._dstarts[pcid + 1]]).decode()
+        return TraceRecord(self._pcs[pcid], tuple(regs), disasm or None)
+
+    def changes(self, name, start=1, stop=None):
+        # (step, value) of every change of a register in steps [start, stop),
+        # after the change in effect at start
+        r, lo, hi = self._changes(name)
+        first = self._change_at(r, lo, hi, max(start, 1)) if self.rows else lo
+        last = hi if stop is None else bisect.bisect_left(self._csteps, stop, lo, hi)
+        return list(zip(self._csteps[first:last].tolist(), self._cvalues[first:last].tolist()))
+
+    def first(self, name, value, start=1):
+        # the first step from start at which a register holds value, or None.
+        # the change values are searched as bytes, without decoding them
+        r, lo, hi = self._changes(name)
+        if start > self.rows:
+            return None
+        i = self._change_at(r, lo, hi, max(start, 1))
+        if self._cvalues[i] == value:
+            return max(start, 1)
+        needle = array('Q', [value & ((1 << 64) - 1)]).tobytes()
+        base = self._offsets['cvalues']
+        pos = base + (i + 1) * 8
+        while True:
+            pos = self._map.find(needle, pos, base + hi * 8)
+            if pos < 0:
+                return None
+            if (pos - base) % 8 == 0:
+                return self._csteps[(pos - base) // 8]
+            pos += 1
@@ -0,0 +1,40 @@
+import ast
+import inspect
+import textwrap
+
+import pytest
+
+from dbgctrl import (AsyncGDBController, AsyncLLDBController, CoreController, GDBController,
+                     GDBMIController, LLDBController, PtraceController, RSPController)
+from dbgctrl.controller import Controller
+
+CONTROLLERS = [GDBController, LLDBController, GDBMIController, AsyncGDBController,
+               AsyncLLDBController, PtraceController, CoreController, RSPController]
+
+
+def unimplemented(func):
+    # a hook of a base class: its body only raises NotImplementedError
+    tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    body = tree.body[0].body
+    if len(body) != 1 or not isinstance(body[0], ast.Raise):
+        return False
+    return ast.unparse(body[0].exc) == 'NotImplementedError'
+
+
+@pytest.mark.parametrize('cls', CONTROLLERS, ids=lambda cls: cls.__name__)
+def test_hooks_implemented(cls):
+    missing = [name for name in dir(cls)
+               if inspect.isfunction(getattr(cls, name)) and unimplemented(getattr(cls, name))]
+    assert missing == []
+
+
+def test_gdbmi_console_commands():
+    # gdb/mi runs the dump, write and step commands of gdb through the console
+    dbg = GDBMIController.__new__(GDBMIController)
+    Controller.__init__(dbg, 'gdb')
+    assert dbg._dump_mem_command('/tmp/dump', 0x1000, 0x10) == (
+        'dump binary memory /tmp/dump 0x1000 0x1010')
+    assert dbg._write_reg_command('rax', 1) == 'set var $rax = 0x1'
+    assert dbg._write_mem_command(0x1000, 2, 4) == 'set var *(unsigned int *)0x1000 = 0x2'
+    assert dbg._step_count_command('si', 10) == 'si 10'
+    assert dbg._console_command('echo "a"\\n') == '-interpreter-exec console "echo \\"a\\"\\\\n"'
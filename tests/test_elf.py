@@ -0,0 +1,163 @@
+import os
+import struct
+
+import pytest
+
+from dbgctrl.elf import (EM_ARM, ET_DYN, ET_EXEC, PT_LOAD, PT_NOTE, SHF_ALLOC, SHF_EXECINSTR,
+                         SHF_WRITE, SHT_SYMTAB, STT_FUNC, STT_OBJECT, ElfFile, open_elf)
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), '..', 'examples', 'test.elf')
+SHT_PROGBITS, SHT_STRTAB = 1, 3
+STB_GLOBAL = 1
+
+
+@pytest.fixture
+def example():
+    with ElfFile(EXAMPLE) as elf:
+        yield elf
+
+
+def test_example_header(example):
+    assert example.bits == 64
+    assert example.byteorder == 'little'
+    assert example.type == ET_DYN
+    assert example.entry == 0x1040
+
+
+def test_example_sections(example):
+    assert len(example.sections) == 30
+    text = example.section('.text')
+    assert (text.addr, text.offset, text.size) == (0x1040, 0x1040, 0x231)
+    assert text.flags == SHF_ALLOC | SHF_EXECINSTR
+    assert example.section('.nothing') is None
+    assert example.section_at(0x1220).name == '.text'
+    assert example.section_at(0x2000).name == '.rodata'
+    assert example.section_at(0x10) is None
+    assert (0x1040, 0x1271) in example.readonly_ranges()
+    assert (0x1040, 0x1271) not in example.writable_ranges()
+    assert example.section('.data').addr in [start for start, _ in example.writable_ranges()]
+
+
+def test_example_segments(example):
+    loads = [s for s in example.segments if s.type == PT_LOAD]
+    assert [(s.vaddr, s.memsz) for s in loads] == [
+        (0x0, 0x5e0), (0x1000, 0x281), (0x2000, 0x13c), (0x3e00, 0x218)]
+    assert len([s for s in example.segments if s.type == PT_NOTE]) == 2
+    assert 'GNU' in [note.name for note in example.notes()]
+
+
+def test_example_symbols(example):
+    main = example.symbol('main')
+    assert (main.value, main.size, main.type, main.section) == (0x1220, 81, STT_FUNC, '.text')
+    assert example.symbol('completed.0').type == STT_OBJECT
+    assert example.symbol('__libc_start_main') is None
+    assert example.symbol('nothing') is None
+    assert example.function_range('func1_1') == (0x1130, 0x1178)
+    assert example.function_range('func1') == (0x11d0, 0x1214)
+    with pytest.raises(Exception):
+        example.function_range('completed.0')
+    with pytest.raises(Exception):
+        example.function_range('nothing')
+
+
+def test_example_symbol_at(example):
+    assert example.symbol_at(0x1220) == (example.symbol('main'), 0)
+    assert example.symbol_at(0x1188) == (example.symbol('func1_2'), 8)
+    # past the end of func1, before main
+    assert example.symbol_at(0x1218) is None
+    assert example.symbol_at(0x0) is None
+
+
+def test_example_load_bias(example):
+    # a PIE runs wherever it is loaded
+    assert example.load_bias(0x1220, 0x555555555224) == 0x555555554000
+
+
+@pytest.mark.parametrize('size', [0, 3, 16, 40, 64, 1000, 14040, 14100, -1])
+def test_truncated(tmp_path, size):
+    with open(EXAMPLE, 'rb') as f:
+        data = f.read()
+    path = tmp_path / 'truncated.elf'
+    path.write_bytes(data[:size])
+    assert open_elf(str(path)) is None
+
+
+def test_not_elf(tmp_path):
+    path = tmp_path / 'text.elf'
+    path.write_bytes(b'#!/bin/sh\n' * 10)
+    with pytest.raises(ValueError):
+        ElfFile(str(path))
+    assert open_elf(str(path)) is None
+    assert open_elf(str(tmp_path / 'missing.elf')) is None
+
+
+def elf32(endian, machine):
+    # an executable of .text (two functions) and .data (an object) loaded at 0x8000
+    strtab = b'\0func\0thumb\0object\0'
+    shstrtab = b'\0.text\0.data\0.symtab\0.strtab\0.shstrtab\0'
+    text = bytes(0x20)
+    data = bytes(8)
+    symbols = b''.join(struct.pack(endian + 'IIIBBH', *symbol) for symbol in [
+        (0, 0, 0, 0, 0, 0),
+        (1, 0x8000, 0x10, STB_GLOBAL << 4 | STT_FUNC, 0, 1),
+        (6, 0x8011, 0x10, STB_GLOBAL << 4 | STT_FUNC, 0, 1),
+        (12, 0x9000, 8, STB_GLOBAL << 4 | STT_OBJECT, 0, 2),
+    ])
+    offset = 52 + 32
+    body = b''
+    offsets = []
+    for blob in [text, data, symbols, strtab, shstrtab]:
+        offsets.append(offset + len(body))
+        body += blob + bytes(-len(blob) % 4)
+    shoff = offset + len(body)
+    sections = [
+        (0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+        (1, SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, 0x8000, offsets[0], len(text), 0, 0, 4, 0),
+        (7, SHT_PROGBITS, SHF_ALLOC | SHF_WRITE, 0x9000, offsets[1], len(data), 0, 0, 4, 0),
+        (13, SHT_SYMTAB, 0, 0, offsets[2], len(symbols), 4, 1, 4, 16),
+        (21, SHT_STRTAB, 0, 0, offsets[3], len(strtab), 0, 0, 1, 0),
+        (29, SHT_STRTAB, 0, 0, offsets[4], len(shstrtab), 0, 0, 1, 0),
+    ]
+    ident = b'\x7fELF' + bytes([1, 1 if endian == '<' else 2, 1]) + bytes(9)
+    header = struct.pack(endian + 'HHIIIIIHHHHHH', ET_EXEC, machine, 1, 0x8000, 52, shoff,
+                         0, 52, 32, 1, 40, len(sections), 5)
+    phdr = struct.pack(endian + 'IIIIIIII', PT_LOAD, 0, 0x8000, 0x8000, shoff, shoff, 5, 0x1000)
+    return ident + header + phdr + body + b''.join(
+        struct.pack(endian + 'IIIIIIIIII', *section) for section in sections)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_elf32(tmp_path, endian):
+    path = tmp_path / 'test32.elf'
+    path.write_bytes(elf32(endian, 3))
+    with ElfFile(str(path)) as elf:
+        assert elf.bits == 32
+        assert elf.byteorder == ('little' if endian == '<' else 'big')
+        assert (elf.type, elf.machine, elf.entry) == (ET_EXEC, 3, 0x8000)
+        assert [s.name for s in elf.sections] == [
+            '', '.text', '.data', '.symtab', '.strtab', '.shstrtab']
+        assert elf.segments[0].type == PT_LOAD
+        assert elf.segments[0].vaddr == 0x8000
+        assert elf.readonly_ranges() == [(0x8000, 0x8020)]
+        assert elf.writable_ranges() == [(0x9000, 0x9008)]
+        assert elf.function_range('func') == (0x8000, 0x8010)
+        assert elf.symbol('thumb').value == 0x8011
+        assert elf.symbol('object').section == '.data'
+        assert elf.symbol_at(0x9004) == (elf.symbol('object'), 4)
+        assert elf.load_bias(0x8000, 0x8004) == 0
+
+
+def test_elf32_arm(tmp_path):
+    # the thumb bit is not part of the address of an ARM function
+    path = tmp_path / 'test32.elf'
+    path.write_bytes(elf32('<', EM_ARM))
+    with ElfFile(str(path)) as elf:
+        assert elf.function_range('thumb') == (0x8010, 0x8020)
+        assert elf.symbol_at(0x8012) == (elf.symbol('thumb'), 2)
+
+
+def test_elf32_truncated(tmp_path):
+    data = elf32('<', 3)
+    path = tmp_path / 'test32.elf'
+    path.write_bytes(data[:-40])
+    assert open_elf(str(path)) is None
@@ -0,0 +1,68 @@
+import pytest
+
+from dbgctrl import GDBMIController
+from dbgctrl.controller import Controller
+from dbgctrl.gdbmi import parse_results
+
+
+def results(line):
+    # the results after the class of a record
+    return parse_results(line, line.index(','))
+
+
+def test_flat_results():
+    assert results('^done,value="0x401000",bkpt="1"') == {'value': '0x401000', 'bkpt': '1'}
+    assert parse_results('^done') == {}
+    assert parse_results('^done', 5) == {}
+
+
+def test_nested_tuples():
+    line = '*stopped,reason="end-stepping-range",frame={addr="0x401000",args={}}'
+    assert results(line) == {
+        'reason': 'end-stepping-range', 'frame': {'addr': '0x401000', 'args': {}}}
+
+
+def test_lists():
+    # lists of values and lists of results (whose keys are dropped)
+    line = ('^done,register-names=["rax","","rbx"],memory=[{begin="0x10",contents="48"}],'
+            'stack=[frame={level="0",addr="0x1"},frame={level="1",addr="0x2"}],empty=[]')
+    assert results(line) == {
+        'register-names': ['rax', '', 'rbx'],
+        'memory': [{'begin': '0x10', 'contents': '48'}],
+        'stack': [{'level': '0', 'addr': '0x1'}, {'level': '1', 'addr': '0x2'}],
+        'empty': [],
+    }
+
+
+def test_escaped_strings():
+    line = r'^error,msg="No symbol \"x\" in current context.\n",path="C:\\tmp"'
+    assert results(line) == {
+        'msg': 'No symbol "x" in current context.\n', 'path': 'C:\\tmp'}
+
+
+def test_invalid_values():
+    with pytest.raises(ValueError):
+        results('^done,value="unterminated')
+    with pytest.raises(ValueError):
+        results('^done,value=0x10')
+
+
+def controller():
+    dbg = GDBMIController.__new__(GDBMIController)
+    Controller.__init__(dbg, 'gdb')
+    dbg._sent, dbg._results, dbg._pending, dbg._streams = {}, {}, set(), []
+    return dbg
+
+
+def test_abandoned_results_dropped():
+    # the late replies of a timed out batch do not pile up
+    dbg = controller()
+    dbg._pending.update([1, 2, 3])
+    dbg._dispatch('1^done')
+    dbg._abandon([1, 2, 3])
+    dbg._dispatch('2^done,value="2"')
+    dbg._pending.add(4)
+    dbg._dispatch('4^done,value="4"')
+    assert list(dbg._results) == [4]
+    assert dbg._results[4].results == {'value': '4'}
+    assert dbg._pending == {4}
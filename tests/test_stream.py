@@ -0,0 +1,101 @@
+import pytest
+
+from dbgctrl.gdb import GDBParser
+from dbgctrl.stream import ReplyReader, ValueParser, WordParser
+
+PROMPT = GDBParser.PROMPT
+PC_REPLY = ('Dump of assembler code from 0x401000 to 0x401001:\n'
+            '=> 0x0000000000401000 <main+0>:\tmov    %rsp,%rbp\n'
+            'End of assembler dump.\n')
+MEM_REPLY = ('0x401000 <main>:\t0x48\t0x89\t0xe5\t0x90\n'
+             '0x401004 <main+4>:\t0x01\t0x02\n')
+
+
+def read(parsers, chunks, count=None):
+    reader = ReplyReader(PROMPT)
+    reader.start(parsers or [None] * count)
+    for chunk in chunks:
+        if reader.feed(chunk.encode()):
+            break
+    return reader
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7])
+def test_prompt_split_across_reads(size):
+    # every split of the prompt, and of the lines before it
+    output = 'Starting program: /bin/true\n' + PROMPT + PC_REPLY + PROMPT
+    reader = read(None, split(output, size), count=2)
+    assert reader.done
+    assert reader.replies == ['Starting program: /bin/true\n' + PROMPT, PC_REPLY + PROMPT]
+
+
+@pytest.mark.parametrize('size', [1, 4, 6, 1000])
+def test_parsed_reply_split_across_reads(size):
+    parsers = [ValueParser(GDBParser.pattern_pc_line), WordParser(GDBParser.pattern_mem_line)]
+    reader = read(parsers, split(PC_REPLY + PROMPT + MEM_REPLY + PROMPT, size))
+    assert reader.done
+    assert reader.replies == [0x401000, [0x48, 0x89, 0xe5, 0x90, 0x01, 0x02]]
+
+
+def test_prompt_in_the_middle_of_a_line():
+    # the last line of a reply has no newline before the prompt
+    parser = WordParser(GDBParser.pattern_mem_line)
+    reader = read([parser], ['0x401000 <main>:\t0x48\t', '0x89' + PROMPT])
+    assert reader.replies == [[0x48, 0x89]]
+
+
+def test_several_replies_in_one_read():
+    output = 'a\n' + PROMPT + PROMPT + 'b\nc\n' + PROMPT + PC_REPLY + PROMPT
+    parsers = [None, None, None, ValueParser(GDBParser.pattern_pc_line)]
+    reader = read(parsers, [output])
+    assert reader.done
+    assert reader.replies == ['a\n' + PROMPT, PROMPT, 'b\nc\n' + PROMPT, 0x401000]
+    assert reader.buffer == b''
+
+
+def test_output_after_the_last_reply():
+    # output beyond the batch stays in the buffer until the next batch starts
+    reader = read(None, ['a\n' + PROMPT + 'b\n' + PROMPT], count=1)
+    assert reader.replies == ['a\n' + PROMPT]
+    assert reader.pending() == 'b\n' + PROMPT
+    reader.start([None])
+    reader.feed(b'c\n' + PROMPT.encode())
+    assert reader.replies == ['c\n' + PROMPT]
+
+
+def test_prompt_like_output():
+    # '(gdb)' without the space, or a prompt cut short, is part of the reply
+    output = ['$1 = "(gdb)"\n', '(gdb\n(gdb)x ', '(gd', '\n', PROMPT]
+    reader = read(None, output, count=1)
+    assert reader.done
+    assert reader.replies == ['$1 = "(gdb)"\n(gdb\n(gdb)x (gd\n' + PROMPT]
+
+
+def test_prompt_like_output_to_parser():
+    output = '(gdb)\n=> (gdb)\n=> 0x401000 <main>\n(gdb' + PROMPT
+    reader = read([ValueParser(GDBParser.pattern_pc_line)], split(output, 3))
+    assert reader.replies == [0x401000]
+
+
+def test_missing_replies():
+    reader = read(None, ['a\n' + PROMPT + 'b\n'], count=3)
+    assert not reader.done
+    assert reader.missing() == 2
+    assert reader.pending() == 'b\n'
+    reader.close()
+    assert reader.replies == ['a\n' + PROMPT, 'b\n', '']
+
+
+def test_late_replies():
+    # the replies owed by a timed out batch come first, and are read as text
+    reader = read(None, ['a\n'], count=2)
+    late = reader.missing()
+    reader.start([ValueParser(GDBParser.pattern_pc_line)], late=late)
+    reader.feed((PROMPT + 'b\n' + PROMPT + PC_REPLY + PROMPT).encode())
+    assert reader.done
+    assert reader.replies[:late] == ['a\n' + PROMPT, 'b\n' + PROMPT]
+    assert reader.replies[late:] == [0x401000]
@@ -0,0 +1,146 @@
+from array import array
+
+import pytest
+
+from dbgctrl.agent import TraceRecord
+from dbgctrl.trace import (CONST, RAW, SPARSE, TraceReader, TraceWriter, _COLUMN,
+                           decode_column, encode_column, read_records)
+
+NAMES = ('rax', 'rbx')
+# pc, disasm, rax, rbx: the disassembly of 0x14 and 0x18 first shows up in later chunks
+RECORDS = [
+    (0x10, 'a', 1, 0),
+    (0x10, 'a', 1, 0),
+    (0x14, 'b', 1, 5),
+    (0x10, 'a', 2, 5),
+    (0x18, None, 2, 5),
+    (0x10, 'a', 3, 7),
+    (0x14, 'b', 1, 7),
+    (0x1c, 'c', 1, 7),
+]
+
+
+def encoding(column):
+    return _COLUMN.unpack_from(column, 0)[0]
+
+
+def round_trip(values):
+    column = encode_column(values)
+    # the column is read from the middle of a buffer, up to its own end
+    decoded, end = decode_column(b'xx' + column + b'yy', 2, values.typecode, len(values))
+    assert end == 2 + len(column)
+    assert decoded == values
+    return encoding(column)
+
+
+def test_const_column():
+    assert round_trip(array('Q', [7] * 100)) == CONST
+    assert round_trip(array('Q', [1 << 63])) == CONST
+    assert round_trip(array('i', [-1] * 5)) == CONST
+
+
+# a bitmap of (rows - 1) bits, on and around byte boundaries
+@pytest.mark.parametrize('rows', [2, 8, 9, 10, 17, 100])
+def test_sparse_column(rows):
+    values = array('Q', [5] * rows)
+    values[-1] = 6
+    assert round_trip(values) == (SPARSE if rows > 2 else RAW)
+    values = array('Q', [3] + [5] * (rows - 1))
+    assert round_trip(values) == (SPARSE if rows > 2 else RAW)
+
+
+def test_sparse_column_changes():
+    values = array('Q', [1] * 50 + [2] * 30 + [1] * 20)
+    assert round_trip(values) == SPARSE
+    values = array('i', [-1, -1, 4, 4, 4, 4, 4, 4, 4, -1, -1, -1])
+    assert round_trip(values) == SPARSE
+
+
+def test_raw_column():
+    assert round_trip(array('Q', range(100))) == RAW
+    assert round_trip(array('i', [-1, 0, 1, 2])) == RAW
+    assert round_trip(array('Q', [1 << 64 - 1, 0, 1 << 64 - 1, 0])) == RAW
+
+
+def test_unknown_column_encoding():
+    column = _COLUMN.pack(9, 8) + bytes(8)
+    with pytest.raises(ValueError):
+        decode_column(column, 0, 'Q', 1)
+
+
+def write_trace(path, chunk_rows, compress='none'):
+    with TraceWriter(path, NAMES, chunk_rows=chunk_rows, compress=compress) as trace:
+        for pc, disasm, *values in RECORDS:
+            trace.append(pc, disasm, values)
+        assert trace.count == len(RECORDS)
+    return path
+
+
+def expected():
+    return [TraceRecord(pc, tuple(values), disasm) for pc, disasm, *values in RECORDS]
+
+
+# chunks of one row, rows that split into full and partial chunks, and a single chunk
+@pytest.mark.parametrize('chunk_rows', [1, 3, 4, 8, 4096])
+@pytest.mark.parametrize('compress', ['none', 'zlib', 'lzma'])
+def test_trace_round_trip(tmp_path, chunk_rows, compress):
+    path = write_trace(str(tmp_path / 'trace.bin'), chunk_rows, compress)
+    with TraceReader(path) as trace:
+        assert trace.names == NAMES
+        assert len(trace) == len(RECORDS)
+        assert len(trace.chunks) == -(-len(RECORDS) // chunk_rows)
+        assert [chunk.first_row for chunk in trace.chunks] == list(
+            range(0, len(RECORDS), chunk_rows))
+        assert list(trace) == expected()
+        # every string is stored once, in the chunk that uses it first
+        assert trace.strings == ['a', 'b', 'c']
+        pcs = [v for values in trace.column_chunks('pc') for v in values]
+        assert pcs == [pc for pc, *_ in RECORDS]
+        rbx = [v for values in trace.column_chunks('rbx') for v in values]
+        assert rbx == [values[1] for _, _, *values in RECORDS]
+        with pytest.raises(KeyError):
+            list(trace.column_chunks('rcx'))
+    assert list(read_records(path)) == expected()
+
+
+def test_trace_flush(tmp_path):
+    path = str(tmp_path / 'trace.bin')
+    with TraceWriter(path, NAMES, chunk_rows=4096) as trace:
+        for pc, disasm, *values in RECORDS[:3]:
+            trace.append(pc, disasm, values)
+        trace.flush()
+        for pc, disasm, *values in RECORDS[3:]:
+            trace.append(pc, disasm, values)
+    with TraceReader(path) as trace:
+        assert [chunk.rows for chunk in trace.chunks] == [3, 5]
+        assert list(trace) == expected()
+
+
+def test_empty_trace(tmp_path):
+    path = str(tmp_path / 'empty.bin')
+    with TraceWriter(path, NAMES):
+        pass
+    with TraceReader(path) as trace:
+        assert trace.names == NAMES
+        assert len(trace) == 0
+        assert list(trace) == []
+
+
+def test_truncated_trace(tmp_path):
+    path = tmp_path / 'trace.bin'
+    data = open(write_trace(str(path), 3), 'rb').read()
+    path.write_bytes(data[:-1])
+    with pytest.raises(ValueError):
+        TraceReader(str(path))
+    path.write_bytes(b'DBGTRC00' + data[8:])
+    with pytest.raises(ValueError):
+        TraceReader(str(path))
+
+
+def test_writer_arguments(tmp_path):
+    path = str(tmp_path / 'trace.bin')
+    with pytest.raises(ValueError):
+        TraceWriter(path, NAMES, compress='bz2')
+    with TraceWriter(path, NAMES) as trace:
+        with pytest.raises(ValueError):
+            trace.append(0x10, 'a', [1])
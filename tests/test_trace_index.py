@@ -0,0 +1,103 @@
+import pytest
+
+from dbgctrl.agent import TraceRecord
+from dbgctrl.app import trace as app
+from dbgctrl.trace import DEFAULT_INDEX_RUN, TraceIndex, TraceIndexWriter, build_index
+
+NAMES = ('rax', 'rbx')
+# step: pc, disasm, rax, rbx
+RECORDS = [
+    (0x10, 'a', 1, 0),
+    (0x14, 'b', 1, 5),
+    (0x10, 'a', 2, 5),
+    (0x18, None, 2, 5),
+    (0x10, 'a', 3, 7),
+    (0x14, 'b', 1, 7),
+]
+
+
+def write_index(path, block, run_rows):
+    with TraceIndexWriter(path, NAMES, block=block, run_rows=run_rows) as index:
+        for pc, disasm, *values in RECORDS:
+            index.append(pc, disasm, values)
+    return path
+
+
+# runs of 1 and 4 steps are merged from the spill file; blocks of 1 and 2
+# steps sample the state at every step and between the change points
+@pytest.fixture(params=[(1, 1), (2, 4), (2, DEFAULT_INDEX_RUN), (65536, DEFAULT_INDEX_RUN)])
+def index(request, tmp_path):
+    block, run_rows = request.param
+    with TraceIndex(write_index(str(tmp_path / 'trace.idx'), block, run_rows)) as index:
+        yield index
+
+
+def test_count(index):
+    assert len(index) == 6
+    assert index.count(0x10) == 3
+    assert index.count(0x14) == 2
+    assert index.count(0x18) == 1
+    assert index.count(0x99) == 0
+
+
+def test_steps(index):
+    assert index.steps(0x10) == [1, 3, 5]
+    assert index.steps(0x14) == [2, 6]
+    assert index.steps(0x10, start=1, stop=2) == [3]
+    assert index.steps(0x99) == []
+
+
+def test_state(index):
+    assert index.state(1) == TraceRecord(0x10, (1, 0), 'a')
+    assert index.state(4) == TraceRecord(0x18, (2, 5), None)
+    assert index.state(6) == TraceRecord(0x14, (1, 7), 'b')
+    for step, (pc, disasm, *values) in enumerate(RECORDS, 1):
+        assert index.state(step) == TraceRecord(pc, tuple(values), disasm)
+    with pytest.raises(IndexError):
+        index.state(7)
+
+
+def test_changes(index):
+    assert index.changes('rax') == [(1, 1), (3, 2), (5, 3), (6, 1)]
+    assert index.changes('rbx') == [(1, 0), (2, 5), (5, 7)]
+    # the change in effect at start comes first
+    assert index.changes('rax', start=4) == [(3, 2), (5, 3), (6, 1)]
+    assert index.changes('rbx', start=2, stop=5) == [(2, 5)]
+
+
+def test_first(index):
+    assert index.first('rax', 2) == 3
+    assert index.first('rax', 1, start=2) == 2
+    assert index.first('rax', 1, start=3) == 6
+    assert index.first('rbx', 7) == 5
+    assert index.first('rbx', 9) is None
+    assert index.first('rax', 1, start=7) is None
+
+
+def test_hot(index):
+    assert list(index.pc_counts()) == [(0x10, 3), (0x14, 2), (0x18, 1)]
+    args = app.arg_parse(['query', 'trace.csv', 'hot', '2'])
+    assert list(app.query(index, args)) == ['pc,count,dis', '0x10,3,"a"', '0x14,2,"b"']
+
+
+def test_build_index_from_csv(tmp_path):
+    path = tmp_path / 'trace.csv'
+    lines = ['No.,pc,dis,' + ','.join(NAMES)]
+    for step, (pc, disasm, *values) in enumerate(RECORDS, 1):
+        lines.append('{},{},{},{}'.format(
+            step, hex(pc), disasm, ','.join(hex(v) for v in values)))
+    path.write_text('\n'.join(lines) + '\n')
+    with TraceIndex(build_index(str(path), block=2)) as index:
+        assert index.names == NAMES
+        assert index.steps(0x14) == [2, 6]
+        assert index.state(5) == TraceRecord(0x10, (3, 7), 'a')
+
+
+def test_empty(tmp_path):
+    path = str(tmp_path / 'empty.idx')
+    with TraceIndexWriter(path, NAMES):
+        pass
+    with TraceIndex(path) as index:
+        assert len(index) == 0
+        assert index.count(0x10) == 0
+        assert list(index.pc_counts()) == []